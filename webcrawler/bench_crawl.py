@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+"""Benchmark: crawl a synthetic local site with various limits
+
+Serves a generated site from a local asyncio HTTP server (in its own
+process) and crawls all of it with crawling.Crawler once for each
+combination of --max-tasks and --max-pool (each in a fresh process),
+printing URLs/sec, CPU time and peak RSS of the crawler process.
+
+Page N links to fanout pages picked pseudo-randomly (the same ones
+every time), some of them through a redirect; some pages are sent
+chunked instead of with a Content-Length.
+
+Usage:
+  bench_crawl.py [-h] [--pages N] [--fanout N] [--page-size BYTES]
+                 [--latency SECS] [--chunked FRACTION]
+                 [--redirects FRACTION] [--max-tasks LIST]
+                 [--max-pool LIST] [--pipeline N]
+
+Options:
+  -h, --help            show this help message and exit
+  --pages N             Number of pages in the site [default: 2000]
+  --fanout N            Links per page [default: 10]
+  --page-size BYTES     Size of each page [default: 20000]
+  --latency SECS        Delay before each response [default: 0]
+  --chunked FRACTION    Fraction of pages sent chunked [default: 0.5]
+  --redirects FRACTION  Fraction of links that redirect [default: 0.05]
+  --max-tasks LIST      Comma-separated max_tasks values [default: 10,100]
+  --max-pool LIST       Comma-separated max_pool values [default: 10,100]
+  --pipeline N          Pipeline up to N requests per connection [default: 1]
+"""
+
+from docopt import docopt
+import asyncio
+import logging
+import multiprocessing
+import queue
+import random
+import resource
+import sys
+import time
+import crawling
+
+
+class SyntheticSite:
+    """A generated site of pages that link to each other.
+
+    handle() serves it over HTTP/1.1 (with keep-alive and pipelining)
+    to asyncio.start_server().
+    """
+
+    def __init__(self, pages, fanout, page_size, latency=0, chunked=0,
+                 redirects=0):
+        self.pages = pages
+        self.fanout = fanout
+        self.page_size = page_size
+        self.latency = latency
+        self.chunked = chunked
+        self.redirects = redirects
+
+    def page(self, n):
+        """Return (body, whether to send it chunked) for page n."""
+        rng = random.Random(n)
+        links = []
+        for _ in range(self.fanout):
+            prefix = '/r/' if rng.random() < self.redirects else '/page/'
+            links.append('<a href="%s%d">page</a>' %
+                         (prefix, rng.randrange(self.pages)))
+        head = ('<html><head><title>Page %d</title></head><body>\n%s\n' %
+                (n, '\n'.join(links)))
+        tail = '</body></html>\n'
+        filler = 'lorem ipsum dolor sit amet '
+        padding = max(self.page_size - len(head) - len(tail) - 3, 0)
+        text = (filler * (padding // len(filler) + 1))[:padding]
+        body = head + '<p>' + text + tail
+        return body.encode('ascii'), rng.random() < self.chunked
+
+    def respond(self, path):
+        """Return (status line, headers, body, chunked) for a path."""
+        kind, _, number = path.strip('/').partition('/')
+        if not path.strip('/'):
+            kind, number = 'page', '0'
+        if not number.isdigit() or int(number) >= self.pages or \
+           kind not in ('page', 'r'):
+            return '404 Not Found', {}, b'Not found\n', False
+        if kind == 'r':
+            return ('302 Found', {'Location': '/page/' + number}, b'',
+                    False)
+        body, chunked = self.page(int(number))
+        return ('200 OK', {'Content-Type': 'text/html; charset=utf-8'},
+                body, chunked)
+
+    @asyncio.coroutine
+    def handle(self, reader, writer):
+        try:
+            while True:
+                request_line = yield from reader.readline()
+                if not request_line:
+                    break
+                close = False
+                while True:
+                    line = yield from reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    if line.lower().startswith(b'connection:'):
+                        close = b'close' in line.lower()
+                method, path, version = request_line.decode('latin-1').split()
+                if self.latency:
+                    yield from asyncio.sleep(self.latency)
+                status, headers, body, chunked = self.respond(path)
+                if chunked:
+                    headers['Transfer-Encoding'] = 'chunked'
+                else:
+                    headers['Content-Length'] = str(len(body))
+                lines = ['HTTP/1.1 ' + status]
+                lines.extend('%s: %s' % kv for kv in headers.items())
+                writer.write('\r\n'.join(lines + ['', '']).encode('latin-1'))
+                if chunked:
+                    for i in range(0, len(body), 4096):
+                        chunk = body[i:i+4096]
+                        writer.write(('%x\r\n' % len(chunk)).encode('ascii'))
+                        writer.write(chunk + b'\r\n')
+                    writer.write(b'0\r\n\r\n')
+                else:
+                    writer.write(body)
+                yield from writer.drain()
+                if close:
+                    break
+        except (OSError, ValueError):
+            pass  # The crawler gave up on us, or sent garbage.
+        finally:
+            writer.close()
+
+
+def serve(site, ports):
+    """Serve site on a free local port, which is put on ports."""
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    server = loop.run_until_complete(
+        asyncio.start_server(site.handle, '127.0.0.1', 0))
+    ports.put(server.sockets[0].getsockname()[1])
+    loop.run_forever()
+
+
+def run_crawl(root, options, results):
+    """Crawl from root and put (urls, secs, cpu secs, peak RSS) on results."""
+    logging.basicConfig(level=logging.ERROR)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    crawler = crawling.Crawler([root], **options)
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    cpu0 = usage.ru_utime + usage.ru_stime
+    t0 = time.time()
+    try:
+        loop.run_until_complete(crawler.crawl())
+    finally:
+        crawler.close()
+        loop.close()
+    dt = time.time() - t0
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    rss = usage.ru_maxrss
+    if sys.platform != 'darwin':
+        rss *= 1024  # Linux reports kilobytes.
+    results.put((len(crawler.done), dt,
+                 usage.ru_utime + usage.ru_stime - cpu0, rss))
+
+
+def main():
+    site = SyntheticSite(pages=int(args["--pages"]),
+                         fanout=int(args["--fanout"]),
+                         page_size=int(args["--page-size"]),
+                         latency=float(args["--latency"]),
+                         chunked=float(args["--chunked"]),
+                         redirects=float(args["--redirects"]))
+    ports = multiprocessing.Queue()
+    server = multiprocessing.Process(target=serve, args=(site, ports),
+                                     daemon=True)
+    server.start()
+    root = 'http://127.0.0.1:%d/' % ports.get()
+
+    print('%9s %9s %8s %8s %10s %8s %8s' %
+          ('max_tasks', 'max_pool', 'urls', 'secs', 'urls/sec',
+           'cpu', 'rss MB'))
+    try:
+        for max_tasks in [int(n) for n in args["--max-tasks"].split(',')]:
+            for max_pool in [int(n) for n in args["--max-pool"].split(',')]:
+                options = dict(max_tasks=max_tasks, max_pool=max_pool,
+                               pipeline=int(args["--pipeline"]))
+                results = multiprocessing.Queue()
+                crawl = multiprocessing.Process(
+                    target=run_crawl, args=(root, options, results))
+                crawl.start()
+                while True:
+                    try:
+                        urls, dt, cpu, rss = results.get(timeout=1)
+                        break
+                    except queue.Empty:
+                        if not crawl.is_alive():
+                            raise SystemExit('crawl failed: %r' % options)
+                crawl.join()
+                print('%9d %9d %8d %8.2f %10.1f %8.2f %8.1f' %
+                      (max_tasks, max_pool, urls, dt, urls / dt, cpu,
+                       rss / 1e6))
+    finally:
+        server.terminate()
+
+
+if __name__ == "__main__":
+    args = docopt(__doc__, version="0.1")
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+"""Microbenchmark: link extraction with links.LinkExtractor vs. a regex
+
+The regex version is what Fetcher used before LinkExtractor: decode the
+whole body, findall() the href values, then unescape, join and defrag
+each one.  Both are run over every page of a corpus of saved HTML pages.
+
+Usage:
+  bench_links.py [-h] [-n N] [--chunk BYTES] [--follow-src] [<corpus>]
+
+Arguments:
+  corpus  Directory of saved .html pages (by default, the sample site
+          in oop/datastructs/scraping)
+
+Options:
+  -h, --help     show this help message and exit
+  -n N           Number of passes over the corpus [default: 20]
+  --chunk BYTES  Feed the extractor chunks of this size [default: 65536]
+  --follow-src   Also extract src and srcset links
+"""
+
+from docopt import docopt
+import os
+import re
+import time
+import urllib.parse
+import links
+
+HREF_RE = re.compile(r'(?i)href=["\']?([^\s"\'<>]+)')
+
+
+def unescape(s):
+    """The inverse of cgi.escape()."""
+    s = s.replace('&quot;', '"').replace('&gt;', '>').replace('&lt;', '<')
+    return s.replace('&amp;', '&')  # Must be last.
+
+
+def regex_links(url, body):
+    """Extract links the way Fetcher used to."""
+    urls = set()
+    for link in set(HREF_RE.findall(body.decode('utf-8', 'replace'))):
+        link = urllib.parse.urljoin(url, unescape(link))
+        urls.add(urllib.parse.urldefrag(link)[0])
+    return urls
+
+
+def extractor_links(url, body, chunk, follow_src):
+    """Extract links with a LinkExtractor, feeding it chunks."""
+    extractor = links.LinkExtractor(url, follow_src=follow_src)
+    for i in range(0, len(body), chunk):
+        extractor.feed(body[i:i+chunk])
+    return extractor.close()
+
+
+def bench(name, func, pages, passes):
+    """Time func over all pages, passes times, and print the rate."""
+    nbytes = sum(len(body) for url, body in pages) * passes
+    nlinks = 0
+    t0 = time.perf_counter()
+    for _ in range(passes):
+        for url, body in pages:
+            nlinks += len(func(url, body))
+    dt = time.perf_counter() - t0
+    print('%-10s %8.1f pages/sec %8.2f MB/sec %8d links' %
+          (name, len(pages) * passes / dt, nbytes / dt / 1e6,
+           nlinks // passes))
+
+
+def main():
+    corpus = args["<corpus>"] or os.path.join(
+        os.path.dirname(os.path.abspath(__file__)),
+        '../oop/datastructs/scraping/sample_site')
+    pages = []
+    for dirpath, dirnames, filenames in os.walk(corpus):
+        for name in sorted(filenames):
+            if name.endswith(('.html', '.htm')):
+                with open(os.path.join(dirpath, name), 'rb') as f:
+                    pages.append(('http://example.com/' + name, f.read()))
+    if not pages:
+        raise SystemExit('no .html pages in %s' % corpus)
+    print('%d pages, %d bytes' % (len(pages),
+                                  sum(len(body) for url, body in pages)))
+
+    passes = int(args["-n"])
+    chunk = int(args["--chunk"])
+    follow_src = args["--follow-src"]
+    bench('regex', regex_links, pages, passes)
+    bench('extractor',
+          lambda url, body: extractor_links(url, body, chunk, follow_src),
+          pages, passes)
+
+
+if __name__ == "__main__":
+    args = docopt(__doc__, version="0.1")
+    main()
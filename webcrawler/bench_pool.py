@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+"""Benchmark: connection pool churn, deque/OrderedDict pool vs. lists
+
+Takes and recycles fake connections (no sockets) spread over a number
+of keys, the way the crawler does, through crawling.ConnectionPool and
+through the list-based pool it replaced, and prints operations/sec.
+
+Usage:
+  bench_pool.py [-h] [-n N] [--keys N] [--max-pool N] [--max-tasks N]
+
+Options:
+  -h, --help      show this help message and exit
+  -n N            Number of take/recycle rounds [default: 100000]
+  --keys N        Number of distinct (host, port, ssl) keys [default: 200]
+  --max-pool N    Limit pool size [default: 1000]
+  --max-tasks N   Limit pool size per key [default: 100]
+"""
+
+from docopt import docopt
+import logging
+import random
+import time
+import crawling
+
+
+class FakeConnection:
+    """Just enough of a Connection for the pool."""
+
+    def __init__(self, key):
+        self.key = key
+        self.idle_since = None
+
+    def stale(self):
+        return False
+
+    def close(self, recycle=False):
+        pass
+
+
+class ListPool:
+    """The list-based pool logic that ConnectionPool used to have."""
+
+    def __init__(self, max_pool, max_tasks):
+        self.max_pool = max_pool
+        self.max_tasks = max_tasks
+        self.connections = {}
+        self.queue = []
+
+    def pop_connection(self, key):
+        conns = self.connections.get(key)
+        while conns:
+            conn = conns.pop(0)
+            self.queue.remove(conn)
+            if not conns:
+                del self.connections[key]
+            if not conn.stale():
+                return conn
+        return None
+
+    def recycle_connection(self, conn):
+        conns = self.connections.setdefault(conn.key, [])
+        conns.append(conn)
+        self.queue.append(conn)
+        if len(conns) > self.max_tasks:
+            victims = conns
+        elif len(self.queue) > self.max_pool:
+            victims = self.queue
+        else:
+            return
+        for victim in victims:
+            if victim.stale():
+                break
+        else:
+            victim = victims[0]
+        conns = self.connections[victim.key]
+        conns.remove(victim)
+        if not conns:
+            del self.connections[victim.key]
+        self.queue.remove(victim)
+        victim.close()
+
+
+def churn(pool, keys, rounds):
+    """Take a connection for a random key (or make one), then recycle."""
+    rng = random.Random(42)
+    busy = []
+    t0 = time.perf_counter()
+    for _ in range(rounds):
+        key = rng.choice(keys)
+        conn = pool.pop_connection(key) or FakeConnection(key)
+        busy.append(conn)
+        if len(busy) > 50 or rng.random() < 0.5:
+            pool.recycle_connection(busy.pop(rng.randrange(len(busy))))
+    return time.perf_counter() - t0
+
+
+def main():
+    logging.basicConfig(level=logging.ERROR)  # Pruning logs warnings.
+    rounds = int(args["-n"])
+    max_pool = int(args["--max-pool"])
+    max_tasks = int(args["--max-tasks"])
+    keys = [('10.0.%d.%d' % divmod(i, 256), 80, False)
+            for i in range(int(args["--keys"]))]
+    for name, pool in [
+            ('lists', ListPool(max_pool, max_tasks)),
+            ('deques', crawling.ConnectionPool(max_pool, max_tasks,
+                                               idle_timeout=3600)),
+            ]:
+        dt = churn(pool, keys, rounds)
+        print('%-8s %10.0f rounds/sec (%d pooled)' %
+              (name, rounds / dt, len(pool.queue)))
+
+
+if __name__ == "__main__":
+    args = docopt(__doc__, version="0.1")
+    main()
@@ -0,0 +1,87 @@
+"""A simple web crawler -- on-disk cache of response validators and links."""
+
+import logging
+import os
+import sqlite3
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseCache:
+    """An SQLite database of what an earlier crawl saw for each URL.
+
+    For every successful response that had an ETag or Last-Modified
+    header, this records those validators, the content type and the
+    links found in the body, keyed by canonical URL.  A later crawl
+    sends them back in If-None-Match and If-Modified-Since headers, and
+    on a 304 reuses the links instead of fetching the body again.
+
+    Writes are batched like those of frontier.FrontierStore.
+    """
+
+    def __init__(self, cache_dir, checkpoint_every=100):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, 'cache.db')
+        self.checkpoint_every = checkpoint_every
+        self.pending_writes = 0
+        self.db = sqlite3.connect(self.path)
+        self.db.execute('CREATE TABLE IF NOT EXISTS responses '
+                        '(url TEXT PRIMARY KEY, etag TEXT,'
+                        ' last_modified TEXT, ctype TEXT, encoding TEXT,'
+                        ' links TEXT)')
+        self.db.commit()
+
+    def close(self):
+        """Commit outstanding writes and close the database."""
+        self.checkpoint()
+        self.db.close()
+
+    def checkpoint(self):
+        """Commit outstanding writes."""
+        if self.pending_writes:
+            self.db.commit()
+            self.pending_writes = 0
+
+    def get(self, url):
+        """Return the CacheEntry for a URL, or None."""
+        row = self.db.execute('SELECT * FROM responses WHERE url = ?',
+                              (url,)).fetchone()
+        return CacheEntry(*row) if row else None
+
+    def put(self, url, headers, ctype, encoding, urls):
+        """Record a response, if it has validators; urls may be None."""
+        etag = headers.get('etag')
+        last_modified = headers.get('last-modified')
+        if not etag and not last_modified:
+            return
+        links = '\n'.join(sorted(urls)) if urls is not None else None
+        self.db.execute('INSERT OR REPLACE INTO responses '
+                        'VALUES (?, ?, ?, ?, ?, ?)',
+                        (url, etag, last_modified, ctype, encoding, links))
+        self.pending_writes += 1
+        if self.pending_writes >= self.checkpoint_every:
+            self.checkpoint()
+
+
+class CacheEntry:
+    """What the ResponseCache knows about one URL."""
+
+    def __init__(self, url, etag, last_modified, ctype, encoding, links):
+        self.url = url
+        self.etag = etag
+        self.last_modified = last_modified
+        self.ctype = ctype
+        self.encoding = encoding
+        if links is None:
+            self.urls = None  # Not HTML.
+        else:
+            self.urls = set(links.split('\n')) if links else set()
+
+    def headers(self):
+        """Return the headers for a conditional request."""
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
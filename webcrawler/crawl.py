@@ -3,34 +3,106 @@
 
 Usage:
   crawl.py [-h] [--iocp] [--select] [--max-redirect N] [--max-tries N]
-           [--max-tasks N] [--max-pool N] [--exclude REGEX] [--strict]
-           [--lenient] [-v N] [-q]
+           [--retry-base SECS] [--retry-max SECS] [--retry-jitter F]
+           [--retry-statuses LIST]
+           [--max-tasks N] [--min-tasks N] [--max-pool N]
+           [--max-host-tasks N] [--host-delay SECS] [--max-body BYTES]
+           [--exclude REGEX] [--strict] [--lenient] [--follow-src]
+           [--bloom N]
+           [--idle-timeout SECS] [--dns-ttl SECS] [--pipeline N]
+           [--state-dir DIR] [--cache-dir DIR] [--workers N]
+           [--progress SECS] [--metrics ADDR] [--timings FILE]
+           [--report-format FMT] [--ignore-robots] [--sitemap URL]...
+           [--sitemaps] [--order NAME] [--dedup BITS] [--warc DIR]
+           [--warc-size BYTES] [--graph DIR] [--scores FILE]
+           [--no-rewrite] [--prewarm N] [-v N] [-q]
            <root>...
 
 Arguments:
   root    Root URL (may be repeated)
 
 Options:
-  -h, --help        show this help message and exit
-  --iocp            Use IOCP event loop (Windows only)
-  --select          Use Select event loop instead of default
-  --max-redirect N  Limit redirection chains (for 301, 302 etc.) [default: 10]
-  --max-tries N     Limit retries on network errors [default: 4]
-  --max-tasks N     Limit concurrent connections [default: 100]
-  --max-pool N      Limit connection pool size [default: 100]
-  --exclude REGEX   Exclude matching URLs
-  --strict          Strict host matching (default)
-  --lenient         Lenient host matching
-  -v, --verbose N   Verbose logging (0-3) [default: 1]
-  -q, --quiet       Quiet logging
+  -h, --help           show this help message and exit
+  --iocp               Use IOCP event loop (Windows only)
+  --select             Use Select event loop instead of default
+  --max-redirect N     Limit redirection chains (for 301, 302 etc.)
+                       [default: 10]
+  --max-tries N        Limit tries per URL, counting retries after network
+                       errors and --retry-statuses [default: 4]
+  --retry-base SECS    Wait SECS before the first retry, doubling for each
+                       retry after that (0 retries at once) [default: 1]
+  --retry-max SECS     Wait at most SECS between tries, unless a Retry-After
+                       header asks for longer [default: 60]
+  --retry-jitter F     Wait a random part, up to F, less [default: 1]
+  --retry-statuses LIST
+                       Retry responses with these statuses (separated by
+                       commas) [default: 429,500,502,503,504]
+  --max-tasks N        Limit concurrent connections [default: 100]
+  --min-tasks N        Adapt the limit between N and --max-tasks to the
+                       latency, errors and 429/503 responses seen
+  --max-pool N         Limit connection pool size [default: 100]
+  --max-host-tasks N   Limit concurrent connections per host (by default,
+                       only --max-tasks does)
+  --host-delay SECS    Minimum delay between requests to a host [default: 0]
+  --max-body BYTES     Limit the bytes read per response [default: 10485760]
+  --exclude REGEX      Exclude matching URLs
+  --strict             Strict host matching (default)
+  --lenient            Lenient host matching
+  --follow-src         Also follow src and srcset links (images, scripts)
+  --bloom N            Track seen URLs in a Bloom filter sized for N URLs
+  --idle-timeout SECS  Close pooled connections idle this long [default: 30]
+  --dns-ttl SECS       Cache DNS answers for SECS seconds [default: 300]
+  --pipeline N         Pipeline up to N requests per connection [default: 1]
+  --state-dir DIR      Checkpoint crawl state to DIR and resume from it
+  --cache-dir DIR      Cache validators and links in DIR for recrawls
+  --workers N          Shard the crawl by host over N processes [default: 1]
+  --progress SECS      Print a progress line every SECS seconds
+  --metrics ADDR       Serve live metrics as JSON over HTTP at ADDR (a port,
+                       host:port or Unix socket path; with --workers, shard
+                       N uses port+N or PATH.N)
+  --timings FILE       Append per-URL phase timings to FILE as JSON lines
+                       (with --workers, shard N uses FILE.N)
+  --report-format FMT  Report as text when done, or as jsonl or csv while
+                       crawling [default: text]
+  --ignore-robots      Don't fetch or honor robots.txt
+  --sitemap URL        Seed the crawl from this sitemap (may be repeated)
+  --sitemaps           Seed the crawl from the roots' sitemaps (as listed
+                       in robots.txt, else /sitemap.xml)
+  --order NAME         Which URLs of a host to fetch first: fifo, depth
+                       (shallowest first) or module:function, called as
+                       function(url, depth) with lower first [default: fifo]
+  --dedup BITS         Don't follow the links of pages that duplicate an
+                       earlier page: the same body, or text whose SimHash
+                       differs in at most BITS bits (0 for exact copies
+                       only; 3 is usual)
+  --warc DIR           Archive responses in WARC files in DIR, with an
+                       index of where each URL's record is
+  --warc-size BYTES    Start a new WARC file after BYTES [default: 1000000000]
+  --graph DIR          Save the link graph in DIR, for graph.py
+  --scores FILE        Fetch the URLs with the highest PageRank in FILE
+                       (written by graph.py --scores) first, instead of
+                       following --order
+  --no-rewrite         Don't learn which hosts redirect all their URLs
+                       (e.g. http to https) to rewrite URLs in advance
+  --prewarm N          Open N connections to each root host before
+                       crawling (for https, N-1 of them resume the first
+                       one's TLS session)
+  -v, --verbose N      Verbose logging (0-3) [default: 1]
+  -q, --quiet          Quiet logging
 """
 
 from docopt import docopt
 import asyncio
+import importlib
 import logging
 import sys
 import crawling
+import graph
+import metrics
 import reporting
+import scheduling
+import sharding
+import sitemap
 
 
 def fix_url(url):
@@ -40,6 +112,18 @@ def fix_url(url):
     return url
 
 
+def get_priority(name, scores=None):
+    """Return the priority function for --order NAME or --scores FILE."""
+    if scores:
+        return graph.ScorePriority(graph.load_scores(scores))
+    if name in scheduling.PRIORITIES:
+        return scheduling.PRIORITIES[name]
+    module, sep, function = name.partition(':')
+    if not sep:
+        sys.exit('unknown order %r' % name)
+    return getattr(importlib.import_module(module), function)
+
+
 def main():
     "Parse arguments, set up event loop, run crawler and print a report."
 
@@ -56,6 +140,60 @@ def main():
     else:
         args["--strict"] = True
 
+    # Set comprehension to avoid redundancy.
+    roots = {fix_url(root) for root in args["<root>"]}
+
+    options = dict(exclude=args["--exclude"],
+                   strict=args["--strict"],
+                   follow_src=args["--follow-src"],
+                   max_redirect=int(args["--max-redirect"]),
+                   max_tries=int(args["--max-tries"]),
+                   max_tasks=int(args["--max-tasks"]),
+                   min_tasks=int(args["--min-tasks"] or 0),
+                   max_pool=int(args["--max-pool"]),
+                   max_host_tasks=int(args["--max-host-tasks"] or 0),
+                   host_delay=float(args["--host-delay"]),
+                   max_body=int(args["--max-body"]),
+                   bloom=int(args["--bloom"] or 0),
+                   idle_timeout=float(args["--idle-timeout"]),
+                   dns_ttl=float(args["--dns-ttl"]),
+                   pipeline=int(args["--pipeline"]),
+                   state_dir=args["--state-dir"],
+                   cache_dir=args["--cache-dir"],
+                   timings=args["--timings"],
+                   obey_robots=not args["--ignore-robots"],
+                   priority=get_priority(args["--order"], args["--scores"]),
+                   dedup_bits=(int(args["--dedup"])
+                               if args["--dedup"] is not None else None),
+                   warc_dir=args["--warc"],
+                   warc_size=int(args["--warc-size"]),
+                   graph_dir=args["--graph"],
+                   rewrite_origins=not args["--no-rewrite"],
+                   prewarm=int(args["--prewarm"] or 0),
+                   retry_policy=scheduling.RetryPolicy(
+                       base=float(args["--retry-base"]),
+                       max_delay=float(args["--retry-max"]),
+                       jitter=float(args["--retry-jitter"]),
+                       statuses=[int(status) for status in
+                                 args["--retry-statuses"].split(',')
+                                 if status.strip()]),
+                   )
+
+    report_format = args["--report-format"]
+    if report_format != 'text' and report_format not in reporting.WRITERS:
+        sys.exit('unknown report format %r' % report_format)
+
+    workers = int(args["--workers"])
+    if workers > 1:
+        # Each worker process runs its own (default) event loop.
+        sharding.crawl(roots, workers,
+                       progress=float(args["--progress"] or 0),
+                       address=args["--metrics"],
+                       report_format=report_format,
+                       sitemaps=(args["--sitemap"], args["--sitemaps"]),
+                       **options)
+        return
+
     if args["--iocp"]:
         from asyncio.windows_events import ProactorEventLoop
         loop = ProactorEventLoop()
@@ -66,27 +204,33 @@ def main():
     else:
         loop = asyncio.get_event_loop()
 
-    # Set comprehension to avoid redundancy.
-    roots = {fix_url(root) for root in args["<root>"]}
-
     # Instantiating the crawler with our arguments.
-    crawler = crawling.Crawler(roots,
-                               exclude=args["--exclude"],
-                               strict=args["--strict"],
-                               max_redirect=int(args["--max-redirect"]),
-                               max_tries=int(args["--max-tries"]),
-                               max_tasks=int(args["--max-tasks"]),
-                               max_pool=int(args["--max-pool"])
-                               )
+    writer = None
+    if report_format != 'text':
+        writer = reporting.WRITERS[report_format](sys.stdout)
+    crawler = crawling.Crawler(roots, report=writer, **options)
+    monitor = metrics.Monitor(crawler,
+                              progress=float(args["--progress"] or 0),
+                              address=args["--metrics"])
 
     # "And this is where the magic happens."
     try:
+        loop.run_until_complete(monitor.start())
+        loop.run_until_complete(crawler.warm_up())
+        if args["--sitemap"] or args["--sitemaps"]:
+            loop.run_until_complete(sitemap.seed(crawler, args["--sitemap"],
+                                                 args["--sitemaps"]))
         loop.run_until_complete(crawler.crawl())
     except KeyboardInterrupt:
         sys.stderr.flush()
-        print('\nInterrupted\n')
+        # Keep the report on stdout parseable.
+        print('\nInterrupted\n', file=sys.stderr if writer else None)
     finally:
-        reporting.report(crawler)
+        loop.run_until_complete(monitor.stop())
+        if writer is None:
+            reporting.report(crawler)
+        else:
+            writer.finish(crawler)
         crawler.close()
         loop.close()
 
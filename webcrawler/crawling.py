@@ -2,19 +2,32 @@
 
 import asyncio
 import cgi
+import collections
+import hashlib
+import itertools
 from http.client import BadStatusLine
 import logging
 import re
+import socket
 import time
 import urllib.parse
+import zlib
 
-logger = logging.getLogger(__name__)
+import cache
+import dedup
+import frontier
+import graph
+import links
+import metrics
+import robots
+import scheduling
+import tls
+import urlnorm
+import warc
 
+logger = logging.getLogger(__name__)
 
-def unescape(s):
-    """The inverse of cgi.escape()."""
-    s = s.replace('&quot;', '"').replace('&gt;', '>').replace('&lt;', '<')
-    return s.replace('&amp;', '&')  # Must be last.
+USER_AGENT = 'asyncio-example-crawl/0.0'
 
 
 class ConnectionPool:
@@ -23,20 +36,80 @@ class ConnectionPool:
     To open a connection, use reserve().  To recycle it, use unreserve().
 
     The pool is mostly just a mapping from (host, port, ssl) tuples to
-    lists of Connections.  The currently active connections are *not*
-    in the data structure; get_connection() takes the connection out,
-    and recycle_connection() puts it back in.  To recycle a
-    connection, call conn.close(recycle=True).
+    deques of Connections, oldest first.  The currently active
+    connections are *not* in the data structure; get_connection()
+    takes the connection out, and recycle_connection() puts it back
+    in.  To recycle a connection, call conn.close(recycle=True).
+
+    There are limits to both the overall pool and the per-key pool;
+    when one is exceeded the oldest connection (for the key, or
+    overall) is closed.  All pooled connections are also kept in an
+    OrderedDict in the order they were recycled, so finding the
+    oldest is O(1), as are taking and recycling connections.
+    Connections idle for more than idle_timeout seconds are closed.
+
+    Host names are resolved through a cache: answers are kept for
+    dns_ttl seconds, failures for dns_negative_ttl seconds, and
+    concurrent lookups of the same name share one resolver call.
+    Expired entries are dropped now and then (see expire_dns()), so
+    the cache doesn't grow with every host the crawl has seen.
 
-    There are limits to both the overall pool and the per-key pool.
+    If pipeline is more than 1, a connection taken from the pool (so
+    known to be kept alive by the server) may be used for up to that
+    many requests at once (HTTP/1.1 pipelining); get_connection() then
+    returns a PipelineSlot for it.  While in use that way, connections
+    are listed in pipelines.  If a pipeline breaks, the requests
+    waiting in it fail with PipelineError and the host isn't pipelined
+    to anymore.
+
+    All TLS connections share ssl_context, which is made by
+    tls.make_context() when the first one is opened, unless one is
+    given.  On Python 3.6 and later that is a tls.SessionContext, which
+    resumes the sessions of earlier connections to the same server;
+    before that, every handshake is a full one.  The handshakes are
+    counted in tls_handshakes (of which tls_resumed were resumed) and
+    timed in tls_time.  warm() opens connections to a host ahead of
+    time.
     """
 
-    def __init__(self, max_pool=10, max_tasks=5):
+    def __init__(self, max_pool=10, max_tasks=5, idle_timeout=30,
+                 dns_ttl=300, dns_negative_ttl=30, pipeline=1,
+                 ssl_context=None):
         self.max_pool = max_pool  # Overall limit.
         self.max_tasks = max_tasks  # Per-key limit.
+        self.idle_timeout = idle_timeout
+        self.pipeline = pipeline  # Requests per connection.
+        # {(host, port, ssl): [Connection, ...], ...} by requested host.
+        self.pipelines = {}
+        self.no_pipeline = set()  # {(host, port, ssl), ...}
+        self.pipelined_requests = 0
+        self.reused = 0  # Connections taken from the pool (or pipelined).
+        self.opened = 0  # New connections.
+        self.dns_ttl = dns_ttl
+        self.dns_negative_ttl = dns_negative_ttl
         self.loop = asyncio.get_event_loop()
-        self.connections = {}  # {(host, port, ssl): [Connection, ...], ...}
-        self.queue = []  # [Connection, ...]
+        # {(host, port, ssl): deque([Connection, ...]), ...}
+        self.connections = {}
+        self.queue = collections.OrderedDict()  # {Connection: None, ...}
+        # {(host, port): (expiry time, addrinfo list or exception), ...}
+        self.dns_cache = {}
+        self.dns_next_expiry = 0  # When expire_dns() is due.
+        self.dns_pending = {}  # {(host, port): Future, ...}
+        self.dns_hits = 0
+        self.dns_misses = 0
+        self.dns_failures = 0
+        self.dns_time = 0.0  # Total time spent in the resolver.
+        self._ssl_context = ssl_context
+        self.tls_handshakes = 0
+        self.tls_resumed = 0
+        self.tls_time = 0.0  # Total time spent in handshakes.
+
+    @property
+    def ssl_context(self):
+        """The context for TLS connections, made on first use."""
+        if self._ssl_context is None:
+            self._ssl_context = tls.make_context()
+        return self._ssl_context
 
     def close(self):
         """Close all connections available for reuse."""
@@ -47,69 +120,202 @@ class ConnectionPool:
         self.queue.clear()
 
     @asyncio.coroutine
-    def get_connection(self, host, port, ssl):
-        """Create or reuse a connection."""
-        port = port or (443 if ssl else 80)
+    def resolve(self, host, port):
+        """Return the addrinfo list for (host, port), using the cache."""
+        key = host, port
+        entry = self.dns_cache.get(key)
+        if entry is not None and entry[0] > time.time():
+            self.dns_hits += 1
+            if isinstance(entry[1], Exception):
+                raise entry[1]
+            return entry[1]
+        if key in self.dns_pending:
+            # Someone is already looking this up.
+            self.dns_hits += 1
+            return (yield from asyncio.shield(self.dns_pending[key]))
+        self.dns_misses += 1
+        future = self.dns_pending[key] = asyncio.Future()
+        t0 = time.time()
+        if t0 >= self.dns_next_expiry:
+            self.expire_dns(t0)
         try:
-            ipaddrs = yield from self.loop.getaddrinfo(host, port)
+            ipaddrs = yield from self.loop.getaddrinfo(
+                host, port, type=socket.SOCK_STREAM)
         except Exception as exc:
             logger.error('Exception %r for (%r, %r)', exc, host, port)
+            self.dns_failures += 1
+            self.dns_cache[key] = time.time() + self.dns_negative_ttl, exc
+            future.set_exception(exc)
+            future.exception()  # Don't complain if nobody else waits.
             raise
-        logger.warn('* %s resolves to %s',
-                    host, ', '.join(ip[4][0] for ip in ipaddrs))
+        else:
+            logger.warn('* %s resolves to %s',
+                        host, ', '.join(ip[4][0] for ip in ipaddrs))
+            self.dns_cache[key] = time.time() + self.dns_ttl, ipaddrs
+            future.set_result(ipaddrs)
+            return ipaddrs
+        finally:
+            self.dns_time += time.time() - t0
+            del self.dns_pending[key]
+
+    def expire_dns(self, now=None):
+        """Drop the cached answers and failures that have expired.
+
+        resolve() calls this when it misses the cache, at most once per
+        the shorter of the two TTLs, so the cost of a sweep is spread
+        over the entries it may remove.
+        """
+        now = now or time.time()
+        expired = [key for key, (expiry, _) in self.dns_cache.items()
+                   if expiry <= now]
+        for key in expired:
+            del self.dns_cache[key]
+        if expired:
+            logger.info('expired %d DNS cache entries', len(expired))
+        self.dns_next_expiry = now + min(self.dns_ttl, self.dns_negative_ttl)
+
+    @asyncio.coroutine
+    def get_connection(self, host, port, ssl, timings=None):
+        """Create or reuse a connection.
+
+        If timings is a dict, the seconds spent resolving the host
+        ('dns'), and for a new connection connecting ('connect') and
+        in the TLS handshake ('tls') are stored in it.
+        """
+        port = port or (443 if ssl else 80)
+        origin = host, port, ssl
+        pipelining = self.pipeline > 1 and origin not in self.no_pipeline
+        if pipelining:
+            # Look for a pipeline with room for another request.
+            for conn in self.pipelines.get(origin, ()):
+                if len(conn.slots) < self.pipeline and not conn.stale():
+                    self.pipelined_requests += 1
+                    self.reused += 1
+                    return conn.open_slot()
+
+        t0 = time.time()
+        ipaddrs = yield from self.resolve(host, port)
+        if timings is not None:
+            timings['dns'] = time.time() - t0
 
         # Look for a reusable connection.
         for _, _, _, _, (h, p, *_) in ipaddrs:
-            key = h, p, ssl
-            conn = None
-            conns = self.connections.get(key)
-            while conns:
-                conn = conns.pop(0)
-                self.queue.remove(conn)
-                if not conns:
-                    del self.connections[key]
-                if conn.stale():
-                    logger.warn('closing stale connection %r', key)
-                    conn.close()  # Just in case.
-                else:
-                    logger.warn('* Reusing pooled connection %r', key)
-                    return conn
+            conn = self.pop_connection((h, p, ssl))
+            if conn is not None:
+                logger.warn('* Reusing pooled connection %r', conn.key)
+                self.reused += 1
+                if pipelining:
+                    conn.slots = collections.deque()
+                    conn.origin = origin
+                    self.pipelines.setdefault(origin, []).append(conn)
+                    return conn.open_slot()
+                return conn
 
         # Create a new connection.
         conn = Connection(self, host, port, ssl)
-        yield from conn.connect()
+        self.opened += 1
+        yield from conn.connect(ipaddrs, timings)
         logger.warn('* New connection %r', conn.key)
         return conn
 
+    @asyncio.coroutine
+    def warm(self, host, port, ssl, n):
+        """Open n new connections to a host and put them in the pool.
+
+        The first one is opened alone, so that the others can resume
+        its TLS session.  No more than the per-key limit are opened.
+        Returns the number of connections opened.
+        """
+        port = port or (443 if ssl else 80)
+        n = min(n, self.max_tasks)
+        try:
+            ipaddrs = yield from self.resolve(host, port)
+        except OSError:
+            return 0
+        opened = 0
+        for batch in ([Connection(self, host, port, ssl)],
+                      [Connection(self, host, port, ssl)
+                       for _ in range(n - 1)]):
+            results = yield from asyncio.gather(
+                *[conn.connect(ipaddrs) for conn in batch],
+                return_exceptions=True)
+            for conn, result in zip(batch, results):
+                if isinstance(result, Exception):
+                    logger.warn('warming up %r raised %r', host, result)
+                    continue
+                self.opened += 1
+                opened += 1
+                conn.close(recycle=True)
+            if not opened:
+                break
+        logger.warn('* Warmed up %r connections to %r', opened, host)
+        return opened
+
+    def end_pipeline(self, conn, broken=False):
+        """Stop using a connection for pipelining."""
+        conns = self.pipelines[conn.origin]
+        conns.remove(conn)
+        if not conns:
+            del self.pipelines[conn.origin]
+        if broken and conn.origin not in self.no_pipeline:
+            logger.warn('pipeline to %r broken, not pipelining there anymore',
+                        conn.origin)
+            self.no_pipeline.add(conn.origin)
+
+    def pop_connection(self, key):
+        """Take the most recently used live connection for a key, if any."""
+        conns = self.connections.get(key)
+        while conns:
+            conn = conns.pop()
+            del self.queue[conn]
+            if not conns:
+                del self.connections[key]
+            if conn.stale():
+                logger.warn('closing stale connection %r', key)
+                conn.close()  # Just in case.
+            else:
+                return conn
+        return None
+
     def recycle_connection(self, conn):
         """Make a connection available for reuse.
 
         This also prunes the pool if it exceeds the size limits.
         """
-        conns = self.connections.setdefault(conn.key, [])
+        now = conn.idle_since = time.time()
+        conns = self.connections.get(conn.key)
+        if conns is None:
+            conns = self.connections[conn.key] = collections.deque()
         conns.append(conn)
-        self.queue.append(conn)
+        self.queue[conn] = None
 
         if len(conns) > self.max_tasks:
-            victims = conns  # Prune one connection for this key.
+            victim = conns[0]  # Prune the oldest connection for this key.
         elif len(self.queue) > self.max_pool:
-            victims = self.queue  # Prune one connection for any key.
+            victim = next(iter(self.queue))  # Prune the oldest of all.
         else:
+            self.reap(now)
             return
+        logger.warn('closing oldest connection %r', victim.key)
+        self._remove_oldest(victim)
 
-        for victim in victims:
-            if victim.stale():  # Prefer pruning the oldest stale connection.
-                logger.warn('closing stale connection %r', victim.key)
+    def reap(self, now=None):
+        """Close connections that have been idle too long."""
+        deadline = (now or time.time()) - self.idle_timeout
+        while self.queue:
+            victim = next(iter(self.queue))
+            if victim.idle_since > deadline:
                 break
-        else:
-            victim = victims[0]
-            logger.warn('closing oldest connection %r', victim.key)
+            logger.info('closing idle connection %r', victim.key)
+            self._remove_oldest(victim)
 
+    def _remove_oldest(self, victim):
+        """Close a connection that is the oldest for its key."""
         conns = self.connections[victim.key]
-        conns.remove(victim)
+        conns.popleft()
         if not conns:
             del self.connections[victim.key]
-        self.queue.remove(victim)
+        del self.queue[victim]
         victim.close()
 
 
@@ -121,17 +327,84 @@ class Connection:
         self.host = host
         self.port = port
         self.ssl = ssl
+        self.hostname = host  # The host before it's resolved.
         self.reader = None
         self.writer = None
         self.key = None
+        self.idle_since = None
+        self.origin = None  # The requested (host, port, ssl), if pipelined.
+        self.slots = None  # A deque of PipelineSlots, if pipelined.
 
     def stale(self):
         return self.reader is None or self.reader.at_eof()
 
+    def open_slot(self):
+        """Return a PipelineSlot for one more request."""
+        slot = PipelineSlot(self)
+        if not self.slots:
+            slot.turn.set_result(None)
+        self.slots.append(slot)
+        return slot
+
+    def release_slot(self, slot, recycle=False, broken=False):
+        """Called by PipelineSlot.close().
+
+        If slot is the one whose response was being read and recycle is
+        true, the next slot may read its response.  Otherwise the
+        pipeline ends: the connection is closed and the other slots
+        fail.  Only if broken is true (the response couldn't be read),
+        or if the server closed the connection before answering the
+        other requests, is the origin taken off pipelining; a response
+        that is left unread on purpose (e.g. a truncated body) says
+        nothing about whether pipelining works there.
+        """
+        if recycle and self.slots[0] is slot:
+            if self.stale():
+                broken = True
+            else:
+                self.slots.popleft()
+                if self.slots:
+                    self.slots[0].turn.set_result(None)
+                else:
+                    self.pool.end_pipeline(self)
+                    self.slots = None
+                    self.close(recycle=True)
+                return
+        slots, self.slots = self.slots, None
+        self.pool.end_pipeline(self, broken=broken and len(slots) > 1)
+        for other in slots:
+            other.conn = None  # Closing it is a no-op now.
+            if other is not slot and not other.turn.done():
+                other.turn.set_exception(
+                    PipelineError('pipeline to %r broken' % (self.key,)))
+        self.close()
+
     @asyncio.coroutine
-    def connect(self):
+    def connect(self, ipaddrs, timings=None):
+        """Connect to whichever of the resolved addresses answers first.
+
+        If timings is a dict, the connect and TLS handshake times are
+        stored in it (see ConnectionPool.get_connection).
+        """
+        t0 = time.time()
+        sock = yield from open_socket(ipaddrs)
+        t1 = time.time()
+        context = self.pool.ssl_context if self.ssl else None
         self.reader, self.writer = yield from asyncio.open_connection(
-            self.host, self.port, ssl=self.ssl)
+            sock=sock, ssl=context,
+            server_hostname=self.hostname if self.ssl else None)
+        if timings is not None:
+            timings['connect'] = t1 - t0
+        if self.ssl:
+            t2 = time.time()
+            if timings is not None:
+                timings['tls'] = t2 - t1
+            self.pool.tls_handshakes += 1
+            self.pool.tls_time += t2 - t1
+            sslobj = self.writer.get_extra_info('ssl_object')
+            if getattr(sslobj, 'session_reused', False):
+                self.pool.tls_resumed += 1
+            tls.save_session(context, self.hostname, sslobj)
         peername = self.writer.get_extra_info('peername')
         if peername:
             self.host, self.port = peername[:2]
@@ -140,6 +413,11 @@ class Connection:
         self.key = self.host, self.port, self.ssl
 
     def close(self, recycle=False):
+        if self.ssl and self.writer is not None:
+            # By now a TLS 1.3 server has sent its session ticket.
+            if self.pool is not None:
+                tls.save_session(self.pool.ssl_context, self.hostname,
+                                 self.writer.get_extra_info('ssl_object'))
         if recycle and not self.stale():
             self.pool.recycle_connection(self)
         else:
@@ -147,9 +425,102 @@ class Connection:
             self.pool = self.reader = self.writer = None
 
 
+class PipelineError(OSError):
+    """A pipelined request was lost because an earlier one failed."""
+
+
+class RetryableStatus(Exception):
+    """A response with a status that the retry policy retries (e.g. 503)."""
+
+
+class PipelineSlot:
+    """One request pipelined on a Connection.
+
+    This stands in for the Connection in make_request(), read_response()
+    and Fetcher.  read_response() waits for turn before reading, i.e.
+    until the responses to the requests before it have been read.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.key = conn.key
+        self.reader = conn.reader
+        self.writer = conn.writer
+        self.turn = asyncio.Future()
+
+    def stale(self):
+        return self.conn is None or self.conn.stale()
+
+    def close(self, recycle=False, broken=False):
+        if self.conn is not None:
+            self.conn.release_slot(self, recycle, broken)
+
+
 @asyncio.coroutine
-def make_request(url, pool, *, method='GET', headers=None, version='1.1'):
-    """Start an HTTP request.  Return a Connection."""
+def open_socket(ipaddrs, delay=0.25):
+    """Return a socket connected to one of a list of addresses.
+
+    This is "Happy Eyeballs" (RFC 6555): a connection attempt to the
+    next address starts whenever the previous one fails or hasn't
+    succeeded within delay seconds, alternating between address
+    families, and the first attempt that succeeds wins.
+    """
+    # Alternate between IPv6 and IPv4 (or whatever families there are).
+    by_family = {}
+    for info in ipaddrs:
+        by_family.setdefault(info[0], []).append(info)
+    queue = []
+    for infos in itertools.zip_longest(*by_family.values()):
+        queue.extend(info for info in infos if info is not None)
+    queue.reverse()
+
+    pending = set()
+    errors = []
+    winner = None
+    try:
+        while winner is None and (queue or pending):
+            if queue:
+                family, type, proto, _, address = queue.pop()
+                pending.add(asyncio.async(
+                    connect_socket(family, type, proto, address)))
+            done, pending = yield from asyncio.wait(
+                pending, timeout=delay if queue else None,
+                return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    errors.append(task.exception())
+                elif winner is None:
+                    winner = task.result()
+                else:
+                    task.result().close()
+    finally:
+        for task in pending:
+            task.cancel()
+    if winner is None:
+        raise errors[-1] if errors else OSError('no addresses to connect to')
+    return winner
+
+
+@asyncio.coroutine
+def connect_socket(family, type, proto, address):
+    """Return a non-blocking socket connected to an address."""
+    sock = socket.socket(family, type, proto)
+    try:
+        sock.setblocking(False)
+        yield from asyncio.get_event_loop().sock_connect(sock, address)
+    except BaseException:
+        sock.close()
+        raise
+    return sock
+
+
+@asyncio.coroutine
+def make_request(url, pool, *, method='GET', headers=None, version='1.1',
+                 timings=None):
+    """Start an HTTP request.  Return a Connection.
+
+    For timings, see ConnectionPool.get_connection().
+    """
     parts = urllib.parse.urlparse(url)
     assert parts.scheme in ('http', 'https'), repr(url)
     ssl = parts.scheme == 'https'
@@ -159,12 +530,14 @@ def make_request(url, pool, *, method='GET', headers=None, version='1.1'):
 
     logger.warn('* Connecting to %s:%s using %s for %s',
                 parts.hostname, port, 'ssl' if ssl else 'tcp', url)
-    conn = yield from pool.get_connection(parts.hostname, port, ssl)
+    conn = yield from pool.get_connection(parts.hostname, port, ssl,
+                                          timings)
 
     headers = dict(headers) if headers else {}  # Must use Cap-Words.
-    headers.setdefault('User-Agent', 'asyncio-example-crawl/0.0')
+    headers.setdefault('User-Agent', USER_AGENT)
     headers.setdefault('Host', parts.netloc)
     headers.setdefault('Accept', '*/*')
+    headers.setdefault('Accept-Encoding', 'gzip, deflate')
     lines = ['%s %s HTTP/%s' % (method, path, version)]
     lines.extend('%s: %s' % kv for kv in headers.items())
     for line in lines + ['']:
@@ -176,12 +549,26 @@ def make_request(url, pool, *, method='GET', headers=None, version='1.1'):
 
 
 @asyncio.coroutine
-def read_response(conn):
-    """Read an HTTP response from a connection."""
+def read_response(conn, raw_headers=None, tap=None):
+    """Read an HTTP response from a connection.
+
+    The body is returned as a stream; if it has a Content-Encoding we
+    know, this is a DecodedStream with the decompressed data.
+
+    If raw_headers is a list, the status line and header lines are
+    appended to it as received (as bytes, with their line ends), and
+    if tap is given it is called with each piece of the body before
+    any Content-Encoding is undone (see warc.ResponseRecord).
+    """
+    if isinstance(conn, PipelineSlot):
+        yield from conn.turn
 
     @asyncio.coroutine
     def getline():
-        line = (yield from conn.reader.readline()).decode('latin-1').rstrip()
+        line = yield from conn.reader.readline()
+        if raw_headers is not None:
+            raw_headers.append(line)
+        line = line.decode('latin-1').rstrip()
         logger.info('< %s', line)
         return line
 
@@ -202,7 +589,10 @@ def read_response(conn):
         # TODO: Continuation lines; multiple header lines per key..
         headers[key.lower()] = value.lstrip()
 
-    if 'content-length' in headers:
+    if status in (204, 304) or 100 <= status < 200:
+        output = asyncio.StreamReader()  # These never have a body.
+        output.feed_eof()
+    elif 'content-length' in headers:
         nbytes = int(headers['content-length'])
         output = asyncio.StreamReader()
         asyncio.async(length_handler(nbytes, conn.reader, output))
@@ -212,16 +602,33 @@ def read_response(conn):
     else:
         output = conn.reader
 
+    if tap is not None:
+        tapped = asyncio.StreamReader()
+        asyncio.async(tap_handler(output, tapped, tap))
+        output = tapped
+
+    encoding = headers.get('content-encoding', '').lower()
+    if encoding in DecodedStream.wbits:
+        decoded = DecodedStream(encoding)
+        asyncio.async(decode_handler(output, decoded))
+        output = decoded
+
     return http_version[5:], status, reason, headers, output
 
 
 @asyncio.coroutine
 def length_handler(nbytes, input, output):
-    """Async handler for reading a body given a Content-Length header."""
+    """Async handler for reading a body given a Content-Length header.
+
+    If the input ends early, output gets an EOFError.  That's also what
+    happens when the reader stops early on purpose and closes the
+    connection (see Fetcher.read_body), so it's only logged at INFO.
+    """
     while nbytes > 0:
         buffer = yield from input.read(min(nbytes, 256*1024))
         if not buffer:
-            logger.error('premature end for content-length')
+            logger.info('premature end for content-length, %r bytes short',
+                        nbytes)
             output.set_exception(EOFError())
             return
         output.feed_data(buffer)
@@ -231,34 +638,129 @@ def length_handler(nbytes, input, output):
 
 @asyncio.coroutine
 def chunked_handler(input, output):
-    """Async handler for reading a body using Transfer-Encoding: chunked."""
+    """Async handler for reading a body using Transfer-Encoding: chunked.
+
+    As in length_handler(), an early end is only logged at INFO; a
+    malformed chunk is an error.
+    """
     logger.info('parsing chunked response')
     nblocks = 0
     nbytes = 0
     while True:
         size_header = yield from input.readline()
         if not size_header:
-            logger.error('premature end of chunked response')
+            logger.info('premature end of chunked response')
             output.set_exception(EOFError())
             return
         logger.debug('size_header = %r', size_header)
         parts = size_header.split(b';')
-        size = int(parts[0], 16)
-        nblocks += 1
-        nbytes += size
-        if size:
-            logger.debug('reading chunk of %r bytes', size)
-            block = yield from input.readexactly(size)
-            assert len(block) == size, (len(block), size)
-            output.feed_data(block)
-        crlf = yield from input.readline()
-        assert crlf == b'\r\n', repr(crlf)
+        try:
+            size = int(parts[0], 16)
+            nblocks += 1
+            nbytes += size
+            if size:
+                logger.debug('reading chunk of %r bytes', size)
+                block = yield from input.readexactly(size)
+                output.feed_data(block)
+            crlf = yield from input.readline()
+            if crlf != b'\r\n':
+                raise ValueError('bad chunk end %r' % crlf)
+        except EOFError as exc:  # An IncompleteReadError.
+            logger.info('premature end of chunked response: %r', exc)
+            output.set_exception(EOFError())
+            return
+        except ValueError as exc:
+            logger.error('broken chunked response: %r', exc)
+            output.set_exception(EOFError())
+            return
         if not size:
             break
     logger.warn('chunked response had %r bytes in %r blocks', nbytes, nblocks)
     output.feed_eof()
 
 
+@asyncio.coroutine
+def tap_handler(input, output, tap):
+    """Async handler passing a body on, and each piece of it to tap."""
+    while True:
+        try:
+            buffer = yield from input.read(256*1024)
+        except Exception as exc:
+            output.set_exception(exc)
+            return
+        if not buffer:
+            break
+        tap(buffer)
+        output.feed_data(buffer)
+    output.feed_eof()
+
+
+class DecodedStream(asyncio.StreamReader):
+    """A stream of decompressed data, fed by decode_handler().
+
+    wire_bytes counts the compressed bytes read so far.
+    """
+
+    # zlib window bits for each Content-Encoding; 'deflate' should be
+    # the zlib format, but some servers send raw deflate data instead.
+    wbits = {'gzip': 16 + zlib.MAX_WBITS,
+             'x-gzip': 16 + zlib.MAX_WBITS,
+             'deflate': zlib.MAX_WBITS,
+             }
+
+    def __init__(self, encoding):
+        super().__init__()
+        self.encoding = encoding
+        self.wire_bytes = 0
+
+
+@asyncio.coroutine
+def decode_handler(input, output):
+    """Async handler for decompressing a body with a Content-Encoding."""
+    decompressor = zlib.decompressobj(output.wbits[output.encoding])
+    first = True
+    while True:
+        try:
+            buffer = yield from input.read(256*1024)
+        except Exception as exc:
+            # E.g. the EOFError of a body that ended early.  Pass it on,
+            # or whoever reads the output waits forever.
+            output.set_exception(exc)
+            return
+        if not buffer:
+            break
+        output.wire_bytes += len(buffer)
+        try:
+            try:
+                data = decompressor.decompress(buffer)
+            except zlib.error:
+                if not (first and output.encoding == 'deflate'):
+                    raise
+                logger.info('raw deflate data, not zlib')
+                decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+                data = decompressor.decompress(buffer)
+            while decompressor.eof and decompressor.unused_data:
+                # Another gzip member follows.
+                rest = decompressor.unused_data
+                output.feed_data(data)
+                decompressor = zlib.decompressobj(
+                    output.wbits[output.encoding])
+                data = decompressor.decompress(rest)
+        except zlib.error as exc:
+            logger.error('cannot decode %s body: %r', output.encoding, exc)
+            output.set_exception(EOFError())
+            return
+        first = False
+        output.feed_data(data)
+    try:
+        output.feed_data(decompressor.flush())
+    except zlib.error as exc:
+        logger.error('cannot decode %s body: %r', output.encoding, exc)
+        output.set_exception(EOFError())
+        return
+    output.feed_eof()
+
+
 class Fetcher:
     """Logic and state for one URL.
 
@@ -271,30 +773,68 @@ class Fetcher:
     list.
 
     Call fetch() to do the fetching; results are in instance variables.
+
+    The body is read in chunks (decompressed if needed) and links are
+    extracted as they arrive; only its size, its size on the wire and a
+    SHA-1 digest are kept.  Bodies of successful non-HTML responses
+    aren't read at all (unless the crawler archives responses), and no
+    more than crawler.max_body bytes of any body are read.
+
+    If the crawler has a warc.WARCWriter, each response is also
+    streamed into a record there as it arrives.  The record is only
+    written once the response is final: one that will be retried
+    (see scheduling.RetryPolicy) is dropped.
+
+    If the crawler looks for duplicates, an HTML page whose body it has
+    seen before under another URL, or whose text is nearly the same as
+    that of an earlier page, gets that page's URL in duplicate_of, and
+    its links aren't resolved or followed (see dedup).
+
+    The time spent in each phase of the last try is kept in timings:
+    'dns', 'connect' and 'tls' (unless a pooled connection was used),
+    'ttfb' (from sending the request to having the response headers)
+    and 'body', in seconds.
     """
 
-    def __init__(self, url, crawler, max_redirect=10, max_tries=4):
+    chunk_size = 64*1024
+
+    def __init__(self, url, crawler, max_redirect=10, max_tries=4, depth=0):
         self.url = url
         self.crawler = crawler
+        # How many links away from a root this URL was found.
+        self.depth = depth
         # We don't loop resolving redirects here -- we just use this
-        # to decide whether to add the redirect URL to crawler.todo.
+        # to decide whether to follow the redirect (see
+        # Crawler.claim_url).
         self.max_redirect = max_redirect
-        # But we do loop to retry on errors a few times.
+        # But we do retry on errors a few times (see
+        # scheduling.RetryPolicy).
         self.max_tries = max_tries
+        # Seconds until the next try, if fetch() stopped to wait.
+        self.retry_delay = None
+        self.retry_after = None  # What the server asked for, if anything.
         # Everything we collect from the response goes here.
         self.task = None
         self.exceptions = []
         self.tries = 0
+        self.disallowed = False  # Whether robots.txt ruled it out.
         self.conn = None
         self.status = None
         self.headers = None
-        self.body = None
+        self.size = None
+        self.wire_size = None
+        self.digest = None
+        self.truncated = False
         self.next_url = None
+        self.redirect = None
         self.ctype = None
         self.pdict = None
         self.encoding = None
         self.urls = None
         self.new_urls = None
+        self.simhash = None
+        self.duplicate_of = None
+        self.timings = {}
 
     @asyncio.coroutine
     def fetch(self):
@@ -302,65 +842,198 @@ class Fetcher:
 
         If successful, and the data is HTML, extract further links and
         add them to the crawler.  Redirects are also added back there.
+
+        If the crawler has a response cache, this makes a conditional
+        request, and if the response is 304 (not modified) it uses the
+        links cached from last time.
+
+        If robots.txt disallows the URL, nothing is fetched: disallowed
+        is set, and the only exception is a RobotsDisallowed.
+
+        A try that fails (see the crawler's RetryPolicy) is retried, up
+        to max_tries tries in all.  Unless the policy says to retry at
+        once, this returns with retry_delay set instead, and the crawler
+        calls fetch() again once that many seconds have passed.  The
+        exception of each failed try is kept in exceptions (a
+        RetryableStatus for a retried response).
         """
+        self.retry_delay = None
+        if not (yield from self.crawler.robots_allowed(self.url)):
+            logger.info('robots.txt disallows %r', self.url)
+            self.disallowed = True
+            self.tries = 1
+            self.exceptions.append(robots.RobotsDisallowed(
+                'disallowed by robots.txt'))
+            return
+        entry = None
+        request_headers = None
+        if self.crawler.cache:
+            entry = self.crawler.cache.get(self.url)
+            if entry:
+                request_headers = entry.headers()
+        archive = self.crawler.warc
+        policy = self.crawler.retry_policy
         while self.tries < self.max_tries:
             self.tries += 1
+            self.status = self.headers = self.retry_after = None
             conn = None
+            record = raw_headers = tap = None
+            if archive is not None:
+                record = archive.response(self.url)
+                raw_headers, tap = [], record.write
+            self.timings = timings = {}
             try:
-                conn = yield from make_request(self.url, self.crawler.pool)
-                _, status, _, headers, output = yield from read_response(conn)
+                conn = yield from make_request(self.url, self.crawler.pool,
+                                               headers=request_headers,
+                                               timings=timings)
+                t0 = time.time()
+                _, status, _, headers, output = yield from read_response(
+                    conn, raw_headers, tap)
+                timings['ttfb'] = time.time() - t0
                 self.status, self.headers = status, headers
-                self.body = yield from output.read()
+                if status == 200:
+                    self.parse_content_type()
+                    if (self.ctype != 'text/html' and archive is None and
+                            not isinstance(conn, PipelineSlot)):
+                        # Don't bother reading the body.  The connection
+                        # can't be reused then, so it gets closed.  (If
+                        # it is pipelined, the body is read to keep the
+                        # pipeline going.)
+                        logger.info('not reading %r body of %r',
+                                    self.ctype, self.url)
+                        break
+                t0 = time.time()
+                yield from self.read_body(output)
+                timings['body'] = time.time() - t0
                 h_conn = headers.get('connection', '').lower()
-                if h_conn != 'close':
+                if h_conn != 'close' and not self.truncated:
                     conn.close(recycle=True)
                     conn = None
+                if policy.retryable(status) and self.tries < self.max_tries:
+                    # Not archived: the finally clause discards record.
+                    self.retry_after = scheduling.parse_retry_after(
+                        headers.get('retry-after'))
+                    raise RetryableStatus('status %r' % status)
+                if record is not None:
+                    mime = headers.get('content-type', '').partition(';')[0]
+                    record.finish(raw_headers, status, mime.strip() or None,
+                                  self.truncated)
                 if self.tries > 1:
                     logger.warn('try %r for %r success', self.tries, self.url)
                 break
-            except (BadStatusLine, OSError) as exc:
+            except (BadStatusLine, OSError, EOFError, ValueError,
+                    RetryableStatus) as exc:
+                if (isinstance(conn, PipelineSlot) and
+                        not isinstance(exc, RetryableStatus)):
+                    # Reading the response failed.
+                    conn.close(broken=True)
+                    conn = None
                 self.exceptions.append(exc)
                 logger.warn('try %r for %r raised %r',
                             self.tries, self.url, exc)
+                if self.tries < self.max_tries:
+                    delay = policy.delay(self.tries, self.retry_after)
+                    if delay > 0:
+                        logger.warn('retrying %r in %.1f secs',
+                                    self.url, delay)
+                        self.retry_delay = delay
+                        return
             finally:
                 if conn is not None:
                     conn.close()
+                if record is not None:
+                    record.discard()  # Unless it's finished.
         else:
             # We never broke out of the while loop, i.e. all tries failed.
             logger.error('no success for %r in %r tries',
                          self.url, self.max_tries)
             return
+        if status == 304 and entry:
+            # Unchanged since the last crawl; use what we found then.
+            logger.info('%r not modified', self.url)
+            self.ctype, self.encoding = entry.ctype, entry.encoding
+            self.urls = entry.urls
+        elif status == 200 and self.crawler.cache and not self.truncated:
+            self.crawler.cache.put(self.url, headers, self.ctype,
+                                   self.encoding, self.urls)
         if status in (300, 301, 302, 303, 307) and headers.get('location'):
             next_url = headers['location']
             self.next_url = urllib.parse.urljoin(self.url, next_url)
             if self.max_redirect > 0:
                 logger.warn('redirect to %r from %r', self.next_url, self.url)
-                self.crawler.add_url(self.next_url, self.max_redirect-1)
+                self.redirect = self.crawler.claim_url(
+                    self.next_url, self.url, self.max_redirect-1, self.depth)
             else:
                 logger.error('redirect limit reached for %r from %r',
                              self.next_url, self.url)
+        elif self.urls is not None:
+            if self.urls:
+                logger.warn('got %r distinct urls from %r',
+                            len(self.urls), self.url)
+            self.new_urls = set()
+            for url in self.urls:
+                if self.crawler.add_url(url, depth=self.depth+1):
+                    self.new_urls.add(url)
+
+    def parse_content_type(self):
+        """Set ctype, pdict and encoding from the Content-Type header."""
+        self.ctype = self.headers.get('content-type')
+        self.pdict = {}
+        if self.ctype:
+            self.ctype, self.pdict = cgi.parse_header(self.ctype)
+        self.encoding = self.pdict.get('charset', 'utf-8')
+
+    @asyncio.coroutine
+    def read_body(self, output):
+        """Read the body in chunks, keeping only its size and digest.
+
+        If this is a successful HTML response, also collect the links in
+        self.urls (as absolute URLs).  Reading stops after
+        crawler.max_body bytes; in that case self.truncated is set and
+        the rest of the body is unread.
+        """
+        max_body = self.crawler.max_body
+        digest = hashlib.sha1()
+        extractor = fingerprinter = None
+        if self.status == 200 and self.ctype == 'text/html':
+            extractor = links.LinkExtractor(self.url, self.encoding,
+                                          self.crawler.follow_src)
+            if self.crawler.dedup is not None:
+                fingerprinter = dedup.Fingerprinter(self.encoding)
+        self.size = 0
+        self.truncated = False
+        while True:
+            chunk = yield from output.read(self.chunk_size)
+            if not chunk:
+                break
+            if self.size + len(chunk) > max_body:
+                logger.warn('body of %r exceeds %r bytes, truncating',
+                            self.url, max_body)
+                chunk = chunk[:max_body - self.size]
+                self.truncated = True
+            self.size += len(chunk)
+            digest.update(chunk)
+            if extractor is not None:
+                extractor.feed(chunk)
+            if fingerprinter is not None:
+                fingerprinter.feed(chunk)
+            if self.truncated:
+                break
+        self.digest = digest.hexdigest()
+        if isinstance(output, DecodedStream):
+            self.wire_size = output.wire_bytes
         else:
-            if status == 200:
-                self.ctype = headers.get('content-type')
-                self.pdict = {}
-                if self.ctype:
-                    self.ctype, self.pdict = cgi.parse_header(self.ctype)
-                self.encoding = self.pdict.get('charset', 'utf-8')
-                if self.ctype == 'text/html':
-                    body = self.body.decode(self.encoding, 'replace')
-                    # Replace href with (?:href|src) to follow image links.
-                    self.urls = set(re.findall(r'(?i)href=["\']?([^\s"\'<>]+)',
-                                               body))
-                    if self.urls:
-                        logger.warn('got %r distinct urls from %r',
-                                    len(self.urls), self.url)
-                    self.new_urls = set()
-                    for url in self.urls:
-                        url = unescape(url)
-                        url = urllib.parse.urljoin(self.url, url)
-                        url, frag = urllib.parse.urldefrag(url)
-                        if self.crawler.add_url(url):
-                            self.new_urls.add(url)
+            self.wire_size = self.size
+        if fingerprinter is not None and not self.truncated:
+            self.simhash = fingerprinter.close()
+            self.duplicate_of = self.crawler.dedup.check(
+                self.url, self.digest, self.simhash)
+            if self.duplicate_of is not None:
+                logger.info('%r duplicates %r, not following its links',
+                            self.url, self.duplicate_of)
+                return
+        if extractor is not None:
+            self.urls = extractor.close()
 
 
 class Crawler:
@@ -368,25 +1041,174 @@ class Crawler:
 
     This manages three disjoint sets of URLs (todo, busy, done).  The
     data structures actually store dicts -- the values in todo give
-    the redirect limit, while the values in busy and done are Fetcher
+    the redirect limit and the depth (how many links away from a root
+    the URL was found), while the values in busy and done are Fetcher
     instances.
+
+    If cache_dir is given, a ResponseCache there is used to make
+    conditional requests (see Fetcher.fetch).
+
+    If state_dir is given, the todo and done sets are also written to
+    a FrontierStore there, and a crawl interrupted earlier is resumed
+    from it.  In that case done is the store's DoneTable, which keeps
+    finished URLs on disk instead of in memory.
+
+    URLs are canonicalized (see urlnorm.canonicalize) when they are
+    added, and a URL is only added once.  Which URLs have been seen is
+    tracked in a compact SeenSet, or if bloom is given in a BloomFilter
+    sized for that many URLs, which is smaller still but may wrongly
+    skip a few URLs.
+
+    The order in which todo URLs are fetched is decided by a
+    HostScheduler, which also limits concurrency, both overall
+    (max_tasks) and per host (max_host_tasks, host_delay).  Hosts take
+    turns, and each host's URLs are fetched in the order found, or if
+    priority is given, lowest priority(url, depth) first (see
+    scheduling.PRIORITIES).  If min_tasks is given, the overall limit
+    isn't fixed: a scheduling.ConcurrencyController moves it between
+    min_tasks and max_tasks as latency, errors and 429 or 503 responses
+    allow.
+
+    Finished fetches are counted in a metrics.Metrics instance, which
+    a metrics.Monitor can show while the crawl runs.  With a state_dir
+    it is saved at each checkpoint and restored on resume, so the
+    totals and phase histograms cover the whole crawl.  If timings is
+    given, it also writes the phase timings of each fetch to that file
+    as JSON lines.
+
+    If report is given (a reporting.ReportWriter), each Fetcher is
+    written to it when it is done, and not kept in done afterwards
+    (done then maps its URL to None, unless it is a DoneTable).
+
+    Unless obey_robots is false, the robots.txt of each host is fetched
+    (once) before the first URL there, and the URLs it disallows are
+    not fetched: they end with a RobotsDisallowed (which isn't counted
+    as an error), and once the rules are known such URLs aren't even
+    added.  A Crawl-delay is passed on to the scheduler.
+
+    If dedup_bits is given, HTML pages that duplicate an earlier page
+    (the same body, or a SimHash of their text at most dedup_bits bits
+    away; see dedup.DuplicateIndex) don't have their links followed.
+
+    If warc_dir is given, the final response for each URL (not those
+    that were retried) is archived there by a warc.WARCWriter, in files
+    of about warc_size bytes.
+
+    A failed try of a fetch is retried as retry_policy says (by default
+    a scheduling.RetryPolicy()): the URL goes back on the todo list
+    until its backoff is over (see retry()), so the wait doesn't take
+    up one of the max_tasks slots.  A Retry-After header also holds off
+    the whole host for that long.
+
+    A redirect to the same host is followed right away, in the same
+    task (see claim_url()); one to another host is added to the todo
+    list.  Unless rewrite_origins is false, origins whose every
+    URL redirects to another origin (e.g. from http to https) are
+    learned, and their URLs are then rewritten before they're added
+    (see urlnorm.OriginRewrites).
+
+    If prewarm is given, warm_up() opens that many connections to the
+    host of each root, before crawl() needs them; with https the later
+    ones resume the first one's TLS session (see tls.SessionContext).
+
+    If graph_dir is given, the links between the pages fetched are
+    collected in a graph.LinkGraph, which is saved there on close()
+    for graph.py to analyze.
     """
     def __init__(self, roots,
                  exclude=None, strict=True,  # What to crawl.
+                 follow_src=False,
                  max_redirect=10, max_tries=4,  # Per-url limits.
                  max_tasks=10, max_pool=10,  # Global limits.
+                 min_tasks=None,  # Adapt max_tasks down to this.
+                 max_host_tasks=None, host_delay=0,  # Per-host limits.
+                 max_body=10*1024*1024,  # Per-response limit.
+                 bloom=None,  # Approximate seen-set capacity.
+                 idle_timeout=30,  # How long to keep idle connections.
+                 dns_ttl=300,  # How long to cache DNS answers.
+                 pipeline=1,  # Requests per connection at once.
+                 state_dir=None,  # Where to checkpoint.
+                 cache_dir=None,  # Where to cache validators and links.
+                 timings=None,  # Where to write per-URL timings.
+                 report=None,  # Where to report finished URLs.
+                 obey_robots=True,  # Whether to honor robots.txt.
+                 priority=None,  # Which URLs of a host to fetch first.
+                 dedup_bits=None,  # How far apart near-duplicates are.
+                 warc_dir=None,  # Where to archive responses.
+                 warc_size=10**9,  # When to start a new WARC file.
+                 graph_dir=None,  # Where to save the link graph.
+                 rewrite_origins=True,  # Whether to learn redirects.
+                 retry_policy=None,  # When and how soon to retry.
+                 prewarm=0,  # Connections to open per root host first.
                  ):
         self.roots = roots
         self.exclude = exclude
         self.strict = strict
+        self.follow_src = follow_src
         self.max_redirect = max_redirect
         self.max_tries = max_tries
+        self.retry_policy = retry_policy or scheduling.RetryPolicy()
         self.max_tasks = max_tasks
         self.max_pool = max_pool
+        self.max_host_tasks = max_host_tasks or max_tasks
+        self.host_delay = host_delay
+        self.max_body = max_body
+        self.prewarm = prewarm
+        self.priority = priority
+        self.scheduler = scheduling.HostScheduler(max_tasks,
+                                                  self.max_host_tasks,
+                                                  host_delay)
+        self.controller = None
+        if min_tasks:
+            self.controller = scheduling.ConcurrencyController(
+                self.scheduler, min_tasks, max_tasks)
+        if bloom:
+            self.seen = urlnorm.BloomFilter(bloom)
+        else:
+            self.seen = urlnorm.SeenSet()
         self.todo = {}
         self.busy = {}
         self.done = {}
-        self.pool = ConnectionPool(max_pool, max_tasks)
+        self.retrying = {}  # {url: Fetcher, ...} for todo URLs to retry.
+        self.dedup = None
+        if dedup_bits is not None:
+            self.dedup = dedup.DuplicateIndex(dedup_bits)
+        self.store = None
+        if state_dir:
+            self.store = frontier.FrontierStore(state_dir)
+            self.done = self.store.done
+            self.todo.update(self.store.todo())
+            for url, (_, depth) in self.todo.items():
+                self.scheduler.push(url, self.url_priority(url, depth))
+            for url in self.store.urls():
+                self.seen.add(url)
+            if self.dedup is not None:
+                for url, digest, simhash in self.store.originals():
+                    self.dedup.add(url, digest, simhash)
+            if self.todo or self.done:
+                logger.warn('resuming from %r: %r todo, %r done',
+                            state_dir, len(self.todo), len(self.done))
+        self.cache = cache.ResponseCache(cache_dir) if cache_dir else None
+        self.warc = None
+        if warc_dir:
+            self.warc = warc.WARCWriter(warc_dir, max_size=warc_size,
+                                        software=USER_AGENT)
+        self.graph = graph.LinkGraph(graph_dir) if graph_dir else None
+        self.rewrites = urlnorm.OriginRewrites() if rewrite_origins else None
+        self.metrics = metrics.Metrics(timings_path=timings)
+        if self.store:
+            # Carry on counting where the interrupted crawl stopped.
+            state = self.store.load('metrics')
+            if state is not None:
+                self.metrics.restore(state)
+            self.store.on_checkpoint = self.save_metrics
+        self.report = report
+        self.obey_robots = obey_robots
+        self.robots = {}  # {netloc: RobotsRules, ...}
+        self.robots_pending = {}  # {netloc: Task, ...}
+        self.pool = ConnectionPool(max_pool, max_tasks,
+                                   idle_timeout=idle_timeout, dns_ttl=dns_ttl,
+                                   pipeline=pipeline)
         self.root_domains = set()
         for root in roots:
             parts = urllib.parse.urlparse(root)
@@ -403,14 +1225,31 @@ class Crawler:
                     self.root_domains.add(host)
         for root in roots:
             self.add_url(root)
-        self.governor = asyncio.Semaphore(max_tasks)
         self.termination = asyncio.Condition()
+        self.wakeup_time = None  # When the pending _wakeup() fires.
         self.t0 = time.time()
         self.t1 = None
 
+    def save_metrics(self):
+        """Save the metrics in the store, with its next commit."""
+        self.store.save('metrics', self.metrics.state())
+
     def close(self):
-        """Close resources (currently only the pool)."""
+        """Close the pool, and the store, cache and WARC writer if any.
+
+        The link graph, if any, is saved.
+        """
         self.pool.close()
+        self.metrics.close()
+        if self.store:
+            self.save_metrics()
+            self.store.close()
+        if self.cache:
+            self.cache.close()
+        if self.warc:
+            self.warc.close()
+        if self.graph is not None:
+            self.graph.save()
 
     def host_okay(self, host):
         """Check if a host should be crawled.
@@ -444,58 +1283,321 @@ class Crawler:
         """
         return host in self.root_domains
 
-    def add_url(self, url, max_redirect=None):
-        """Add a URL to the todo list if not seen before."""
+    def url_priority(self, url, depth, lastmod=None):
+        """Return the priority to queue a URL with (lower goes first).
+
+        This is priority(url, depth) (or 0), then for equal ones the
+        newest lastmod first; URLs without a lastmod (only sitemaps give
+        one) come after those with one.
+        """
+        base = 0 if self.priority is None else self.priority(url, depth)
+        return base, -lastmod if lastmod is not None else 0
+
+    def check_url(self, url):
+        """Return the URL to crawl for url, or None if it's not wanted.
+
+        The URL is canonicalized, and moved to the origin that its
+        origin is known to redirect to (see urlnorm.OriginRewrites).
+        """
         if self.exclude and re.search(self.exclude, url):
-            return False
+            return None
         parts = urllib.parse.urlparse(url)
         if parts.scheme not in ('http', 'https'):
             logger.info('skipping non-http scheme in %r', url)
-            return False
+            return None
+        url = urlnorm.canonicalize(url)
+        if self.rewrites is not None:
+            url = self.rewrites.rewrite(url)
+        parts = urllib.parse.urlparse(url)
         host, port = urllib.parse.splitport(parts.netloc)
         if not self.host_okay(host):
             logger.info('skipping non-root host in %r', url)
+            return None
+        rules = self.robots.get(parts.netloc)
+        if rules is not None:
+            path = parts.path + ('?' + parts.query if parts.query else '')
+            if not rules.allowed(path):
+                logger.info('robots.txt disallows %r', url)
+                return None
+        return url
+
+    def add_url(self, url, max_redirect=None, depth=0, lastmod=None):
+        """Add a URL to the todo list if not seen before.
+
+        The URL is checked and canonicalized first (see check_url()).
+        depth is the number of links followed from a root to find it;
+        lastmod is when it last changed, as a timestamp, if known (see
+        url_priority()).  A new URL is passed on to enqueue().
+        """
+        url = self.check_url(url)
+        if url is None or not self.seen.add(url):
             return False
         if max_redirect is None:
             max_redirect = self.max_redirect
-        if url in self.todo or url in self.busy or url in self.done:
-            return False
+        self.enqueue(url, max_redirect, depth, lastmod)
+        return True
+
+    def enqueue(self, url, max_redirect, depth, lastmod=None):
+        """Put a new URL on the todo list, and in the store if any."""
         logger.warn('adding %r %r', url, max_redirect)
-        self.todo[url] = max_redirect
+        self.todo[url] = max_redirect, depth
+        self.scheduler.push(url, self.url_priority(url, depth, lastmod))
+        if self.store:
+            self.store.add(url, max_redirect, depth)
+
+    def claim_url(self, url, from_url, max_redirect, depth):
+        """Take a URL that from_url redirected to, to fetch it at once.
+
+        If the URL is on the same host as from_url and would be added
+        by add_url(), this returns a Fetcher for it, which is put in
+        busy but not on the todo list; fetch() runs it right after the
+        redirecting Fetcher, in the same task, so it saves a trip
+        through the todo list and can reuse the connection.  A URL on
+        another host is passed to add_url() instead, so that its host's
+        limits and delay apply (the scheduler counts a chain against
+        the host it started on), and None is returned.
+        """
+        url = self.check_url(url)
+        if url is None:
+            return None
+        if scheduling.host_key(url) != scheduling.host_key(from_url):
+            self.add_url(url, max_redirect, depth)
+            return None
+        if not self.seen.add(url):
+            return None
+        logger.warn('following redirect to %r %r', url, max_redirect)
+        fetcher = Fetcher(url, crawler=self, max_redirect=max_redirect,
+                          max_tries=self.max_tries, depth=depth)
+        self.busy[url] = fetcher
+        if self.store:
+            self.store.add(url, max_redirect, depth)
+        return fetcher
+
+    def retry(self, fetcher):
+        """Move a Fetcher that is waiting to retry from busy to todo.
+
+        Its URL is queued to be fetched again (by the same Fetcher, so
+        its tries add up) once fetcher.retry_delay seconds have passed.
+        If the server sent a Retry-After, its host is paused as long.
+        """
+        url = fetcher.url
+        del self.busy[url]
+        self.todo[url] = fetcher.max_redirect, fetcher.depth
+        self.retrying[url] = fetcher
+        if fetcher.retry_after is not None:
+            self.scheduler.pause(scheduling.host_key(url),
+                                 min(fetcher.retry_after,
+                                     self.retry_policy.max_retry_after))
+        self.scheduler.push(url, self.url_priority(url, fetcher.depth),
+                            not_before=time.time() + fetcher.retry_delay)
+
+    @asyncio.coroutine
+    def robots_allowed(self, url):
+        """Check if robots.txt allows a URL, fetching it if need be."""
+        if not self.obey_robots:
+            return True
+        parts = urllib.parse.urlparse(url)
+        rules = self.robots.get(parts.netloc)
+        if rules is None:
+            task = self.robots_pending.get(parts.netloc)
+            if task is None:
+                task = asyncio.Task(self.fetch_robots(parts.scheme,
+                                                      parts.netloc))
+                self.robots_pending[parts.netloc] = task
+            # Others may be waiting for it too.
+            rules = yield from asyncio.shield(task)
+        path = parts.path + ('?' + parts.query if parts.query else '')
+        return rules.allowed(path)
+
+    @asyncio.coroutine
+    def fetch_robots(self, scheme, netloc):
+        """Fetch and parse the robots.txt for a host; return RobotsRules.
+
+        As RFC 9309 says, redirects are followed, up to
+        robots.MAX_REDIRECTS of them and to other hosts too.  If there
+        is no robots.txt (a 4xx status, or more redirects than that)
+        everything is allowed, and if the server can't be reached or
+        fails (a network error or a 5xx status) nothing is.  A response
+        that breaks in any other way counts as no robots.txt, so that
+        those waiting for the rules always get some.
+        """
+        url = '%s://%s/robots.txt' % (scheme, netloc)
+        try:
+            for _ in range(robots.MAX_REDIRECTS + 1):
+                status, headers, body = yield from self.read_robots(url)
+                location = headers.get('location')
+                if status not in (301, 302, 303, 307, 308) or not location:
+                    break
+                url = urllib.parse.urljoin(url, location)
+                if urllib.parse.urlparse(url).scheme not in ('http',
+                                                             'https'):
+                    break
+                logger.warn('robots.txt of %r redirects to %r', netloc, url)
+            if 200 <= status < 300:
+                text = bytes(body).decode('utf-8', 'replace')
+                rules = robots.RobotsRules.parse(
+                    text, USER_AGENT.partition('/')[0])
+            elif status < 500:
+                rules = robots.RobotsRules()
+            else:
+                logger.warn('%r has status %r, disallowing all', url, status)
+                rules = robots.RobotsRules.disallow_all()
+        except (BadStatusLine, OSError, EOFError) as exc:
+            logger.warn('fetching %r raised %r, disallowing all', url, exc)
+            rules = robots.RobotsRules.disallow_all()
+        except Exception as exc:
+            logger.error('reading %r raised %r, allowing all', url, exc)
+            rules = robots.RobotsRules()
+        finally:
+            del self.robots_pending[netloc]
+        self.robots[netloc] = rules
+        if rules.delay:
+            logger.warn('crawl delay for %r is %r', netloc, rules.delay)
+            self.scheduler.set_delay(netloc, rules.delay)
+        return rules
+
+    @asyncio.coroutine
+    def read_robots(self, url):
+        """Fetch a robots.txt URL; return (status, headers, body).
+
+        At most robots.MAX_SIZE bytes of the body are read.
+        """
+        conn = None
+        try:
+            conn = yield from make_request(url, self.pool)
+            _, status, _, headers, output = yield from read_response(conn)
+            body = bytearray()
+            while len(body) < robots.MAX_SIZE:
+                chunk = yield from output.read(Fetcher.chunk_size)
+                if not chunk:
+                    break
+                body.extend(chunk)
+            else:
+                logger.warn('%r is too long, ignoring the rest', url)
+            h_conn = headers.get('connection', '').lower()
+            if h_conn != 'close' and len(body) < robots.MAX_SIZE:
+                conn.close(recycle=True)
+                conn = None
+            return status, headers, body
+        finally:
+            if conn is not None:
+                conn.close()
+
+    def owns(self, url):
+        """Check if this crawler should fetch a URL itself.
+
+        A plain Crawler fetches everything; a sharded one (see
+        sharding.ShardCrawler) passes other URLs on to their owner.
+        """
         return True
 
+    @asyncio.coroutine
+    def warm_up(self):
+        """Open prewarm connections to each root's host, if we own it.
+
+        Call this before crawl(); the connections wait in the pool
+        (for up to idle_timeout seconds).
+        """
+        if not self.prewarm:
+            return
+        origins = set()
+        for root in self.roots:
+            parts = urllib.parse.urlparse(root)
+            if parts.hostname and self.owns(urlnorm.canonicalize(root)):
+                origins.add((parts.hostname, parts.port,
+                             parts.scheme == 'https'))
+        yield from asyncio.gather(
+            *[self.pool.warm(host, port, ssl, self.prewarm)
+              for host, port, ssl in origins])
+
     @asyncio.coroutine
     def crawl(self):
         """Run the crawler until all finished."""
         with (yield from self.termination):
             while self.todo or self.busy:
-                if self.todo:
-                    url, max_redirect = self.todo.popitem()
-                    fetcher = Fetcher(url,
-                                      crawler=self,
-                                      max_redirect=max_redirect,
-                                      max_tries=self.max_tries,
-                                      )
+                url, delay = self.scheduler.pop()
+                if url is not None:
+                    max_redirect, depth = self.todo.pop(url)
+                    fetcher = self.retrying.pop(url, None)
+                    if fetcher is None:
+                        fetcher = Fetcher(url,
+                                          crawler=self,
+                                          max_redirect=max_redirect,
+                                          max_tries=self.max_tries,
+                                          depth=depth,
+                                          )
                     self.busy[url] = fetcher
                     fetcher.task = asyncio.Task(self.fetch(fetcher))
                 else:
+                    if delay is not None:
+                        # A host is waiting out its delay; make sure we
+                        # wake up when it's done, if nothing else does.
+                        when = time.time() + delay
+                        if self.wakeup_time is None or when < self.wakeup_time:
+                            self.wakeup_time = when
+                            asyncio.Task(self._wakeup(delay))
                     yield from self.termination.wait()
         self.t1 = time.time()
 
+    @asyncio.coroutine
+    def _wakeup(self, delay):
+        """Wake up crawl() after a delay."""
+        yield from asyncio.sleep(delay)
+        with (yield from self.termination):
+            if self.wakeup_time is not None and \
+               self.wakeup_time <= time.time():
+                self.wakeup_time = None
+            self.termination.notify()
+
     @asyncio.coroutine
     def fetch(self, fetcher):
-        """Call the Fetcher's fetch(), with a limit on concurrency.
+        """Call the Fetcher's fetch(), then tell the scheduler it's done.
 
-        Once this returns, move the fetcher from busy to done.
+        Once a fetch is done, move its fetcher from busy to done.  If
+        it redirected to a URL it claimed (see claim_url()), fetch that
+        next, and so on down the chain; the scheduler counts the whole
+        chain as one fetch.
         """
+        first_url = fetcher.url
+        task = fetcher.task
+        try:
+            while fetcher is not None:
+                yield from self.fetch_one(fetcher)
+                fetcher = fetcher.redirect
+                if fetcher is not None:
+                    fetcher.task = task
+        finally:
+            self.scheduler.finish(first_url)
+
+    @asyncio.coroutine
+    def fetch_one(self, fetcher):
+        """Call one Fetcher's fetch(), and record the outcome."""
         url = fetcher.url
-        with (yield from self.governor):
-            try:
-                yield from fetcher.fetch()  # Fetcher gonna fetch.
-            finally:
-                # Force GC of the task, so the error is logged.
-                fetcher.task = None
+        t0 = time.time()
+        try:
+            yield from fetcher.fetch()  # Fetcher gonna fetch.
+        finally:
+            # Force GC of the task, so the error is logged.
+            fetcher.task = None
+            elapsed = time.time() - t0
+            self.metrics.record(fetcher, elapsed)
+            if self.controller is not None and not fetcher.disallowed:
+                self.controller.record(fetcher.status, elapsed)
+        if fetcher.retry_delay is not None:
+            with (yield from self.termination):
+                self.retry(fetcher)
+                self.termination.notify()
+            return
+        if self.rewrites is not None:
+            self.rewrites.observe(url, fetcher.status, fetcher.next_url)
         with (yield from self.termination):
-            self.done[url] = fetcher
+            if self.graph is not None:
+                self.graph.add_page(fetcher)
+            done = fetcher
+            if self.report is not None:
+                self.report.write(fetcher)
+                if self.store is None:
+                    done = None  # It's been reported; let it go.
+            self.done[url] = done
             del self.busy[url]
             self.termination.notify()
@@ -0,0 +1,185 @@
+"""A simple web crawler -- spotting duplicate and near-duplicate pages."""
+
+import codecs
+import hashlib
+import html
+import re
+
+
+class Fingerprinter:
+    """Compute the SimHash of the text of HTML that arrives in chunks.
+
+    Call feed() with each chunk and close() at the end; close() returns
+    the 64-bit SimHash of the page's text, or None if the page has too
+    little text (fewer than min_shingles shingles) for one to mean
+    much.  Markup, comments, scripts and styles are skipped, and the
+    text is split into lowercase words; each run of size consecutive
+    words is a shingle.
+
+    SimHash gives pages with mostly the same shingles hashes that
+    differ in few bits.  Each bit of it says whether most shingle
+    hashes have that bit set.  Rather than counting bit by bit, the
+    bytes of the shingle hashes are counted, and the bit counts are
+    worked out from those once, at the end.
+
+    A tag split across chunks is kept until the rest arrives, if it
+    has at most max_tag_size characters.  Other unclosed markup -- a
+    comment, script or style, or a longer tag -- is skipped: once its
+    start has been seen, only the new data is searched for its end (see
+    end_res), so a long one costs linear time.  A "<" only starts a tag
+    if a letter or one of "/!?" follows it; otherwise it's text.
+    """
+
+    markup_re = re.compile(r'<!--.*?(-->|\Z)|'
+                           r'<(script|style)\b.*?(</\2\s*>|\Z)|'
+                           r'<[a-zA-Z/!?][^>]*(>|\Z)', re.I | re.S)
+    word_re = re.compile(r'\w+')
+    end_res = {'--': re.compile(r'-->'),
+               'script': re.compile(r'</script\s*>', re.I),
+               'style': re.compile(r'</style\s*>', re.I),
+               '>': re.compile(r'>')}
+    tail_size = 64  # Text kept in case an end (or a word) is split.
+    max_tag_size = 16*1024
+
+    def __init__(self, encoding='utf-8', size=4, min_shingles=20):
+        try:
+            self.decoder = codecs.getincrementaldecoder(encoding)('replace')
+        except LookupError:
+            self.decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        self.size = size
+        self.min_shingles = min_shingles
+        self.pending = ''
+        self.words = []  # The last size-1 words.
+        self.shingles = 0
+        self.end_re = None  # The end of the comment, etc. we're inside.
+        self.counts = [[0] * 256 for _ in range(8)]  # Per hash byte.
+
+    def feed(self, data, final=False):
+        text = self.pending + self.decoder.decode(data, final)
+        pos = 0
+        if self.end_re is not None:
+            m = self.end_re.search(text)
+            if m is None:
+                self.pending = text[-self.tail_size:]
+                return
+            self.end_re = None
+            pos = m.end()
+        cut = len(text)
+        for m in self.markup_re.finditer(text, pos):
+            if not (final or m.group(1) or m.group(3) or m.group(4)):
+                cut = m.start()  # It isn't closed yet.
+                end = m.group(2) or ('--' if text.startswith('<!--', cut)
+                                     else None)
+                if end is None and len(text) - cut > self.max_tag_size:
+                    end = '>'
+                if end is not None:
+                    # Skip to its end, without keeping it (nor what came
+                    # before, which might look like the end).
+                    self.add_text(text[pos:cut])
+                    self.end_re = self.end_res[end.lower()]
+                    self.pending = text[max(cut, len(text) -
+                                            self.tail_size):]
+                    return
+                break
+            self.add_text(text[pos:m.start()])
+            pos = m.end()
+        else:
+            if not final and text.endswith('<', pos):
+                cut -= 1  # It may start a tag.
+            elif not final:
+                # Hold back a word that may go on in the next chunk
+                # (unless it's too long to be a word anyway).
+                stop = max(pos, cut - self.tail_size)
+                while cut > stop and (text[cut-1].isalnum() or
+                                      text[cut-1] == '_'):
+                    cut -= 1
+        if pos < cut:
+            self.add_text(text[pos:cut])
+        self.pending = text[cut:]
+
+    def add_text(self, text):
+        words = self.words
+        counts = self.counts
+        size = self.size
+        for word in self.word_re.findall(html.unescape(text).lower()):
+            words.append(word)
+            if len(words) < size:
+                continue
+            shingle = ' '.join(words).encode('utf-8')
+            del words[0]
+            digest = hashlib.md5(shingle).digest()
+            for i in range(8):
+                counts[i][digest[i]] += 1
+            self.shingles += 1
+
+    def close(self):
+        self.feed(b'', final=True)
+        if self.shingles < self.min_shingles:
+            return None
+        ones = [0] * 64
+        for i, counts in enumerate(self.counts):
+            for byte, n in enumerate(counts):
+                if n:
+                    for bit in range(8):
+                        if byte >> bit & 1:
+                            ones[i*8 + bit] += n
+        simhash = 0
+        for bit, n in enumerate(ones):
+            if 2*n > self.shingles:
+                simhash |= 1 << bit
+        return simhash
+
+
+class DuplicateIndex:
+    """Remember the pages seen, to find the earlier copy of a page.
+
+    A page is a duplicate of an earlier one if its body has the same
+    digest, or if both have a SimHash (see Fingerprinter) and the two
+    differ in at most max_distance bits; 0 means exact duplicates only.
+    Only originals are remembered, so every duplicate points at the
+    first page of its cluster.
+
+    Near-duplicates are found without comparing against every page: the
+    SimHash is cut into max_distance+1 blocks, and two hashes that
+    differ in at most max_distance bits must agree on at least one
+    block.  There is a dict per block, and only the hashes that share
+    a block with the new one are compared.
+    """
+
+    def __init__(self, max_distance=3):
+        self.max_distance = max_distance
+        self.digests = {}  # {digest: url, ...}
+        nblocks = max_distance + 1
+        self.blocks = []  # [(shift, mask), ...]
+        for i in range(nblocks):
+            start, end = 64 * i // nblocks, 64 * (i+1) // nblocks
+            self.blocks.append((start, (1 << (end - start)) - 1))
+        # For each block, {its value: [(simhash, url), ...], ...}.
+        self.tables = [{} for _ in self.blocks]
+
+    def __len__(self):
+        return len(self.digests)
+
+    def check(self, url, digest, simhash=None):
+        """Return the URL of the page that url duplicates, or None.
+
+        If it duplicates none, it is remembered as an original.
+        """
+        original = self.digests.get(digest)
+        if original is not None:
+            return original
+        if simhash is not None and self.max_distance:
+            for (shift, mask), table in zip(self.blocks, self.tables):
+                for other, other_url in table.get(simhash >> shift & mask, ()):
+                    if bin(simhash ^ other).count('1') <= self.max_distance:
+                        return other_url
+        self.add(url, digest, simhash)
+        return None
+
+    def add(self, url, digest, simhash=None):
+        """Remember a page as an original."""
+        self.digests[digest] = url
+        if simhash is not None and self.max_distance:
+            for (shift, mask), table in zip(self.blocks, self.tables):
+                table.setdefault(simhash >> shift & mask, []).append(
+                    (simhash, url))
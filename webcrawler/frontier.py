@@ -0,0 +1,232 @@
+"""A simple web crawler -- on-disk crawl state, for checkpoint and resume."""
+
+import json
+import logging
+import os
+import sqlite3
+
+import robots
+
+logger = logging.getLogger(__name__)
+
+
+# The columns of the done table after url, in the order of the
+# arguments of FetcherRecord.  Older databases may have fewer, or have
+# them in another order, so they are always named.
+DONE_COLUMNS = (
+    ('status', 'INTEGER'), ('tries', 'INTEGER'), ('error', 'TEXT'),
+    ('next_url', 'TEXT'), ('ctype', 'TEXT'), ('encoding', 'TEXT'),
+    ('size', 'INTEGER'), ('wire_size', 'INTEGER'), ('digest', 'TEXT'),
+    ('truncated', 'INTEGER'), ('nurls', 'INTEGER'), ('nnew', 'INTEGER'),
+    ('simhash', 'TEXT'), ('duplicate_of', 'TEXT'),
+)
+
+
+class FrontierStore:
+    """An SQLite database holding the crawl frontier.
+
+    The todo table holds every URL that has been added but not yet
+    finished, with its redirect limit and link depth.  A URL stays
+    there while it is busy, so an interrupted crawl fetches it again on
+    resume.  The done table holds a compact summary of every finished
+    URL (see DoneTable).  Columns added since are added to databases
+    written before.
+
+    Writes are batched in a transaction which is committed every
+    checkpoint_every changes, and by checkpoint() and close().  Other
+    state (e.g. the crawler's metrics) can be kept in the state table
+    with save() and load(); if on_checkpoint is set, it is called
+    before each commit, to save() such state along with the URLs.
+    """
+
+    def __init__(self, state_dir, checkpoint_every=100):
+        os.makedirs(state_dir, exist_ok=True)
+        self.path = os.path.join(state_dir, 'frontier.db')
+        self.checkpoint_every = checkpoint_every
+        self.pending_writes = 0
+        self.db = sqlite3.connect(self.path)
+        self.db.execute('CREATE TABLE IF NOT EXISTS todo '
+                        '(url TEXT PRIMARY KEY, max_redirect INTEGER,'
+                        ' depth INTEGER NOT NULL DEFAULT 0)')
+        self._add_column('todo', 'depth', 'INTEGER NOT NULL DEFAULT 0')
+        self.db.execute('CREATE TABLE IF NOT EXISTS done '
+                        '(url TEXT PRIMARY KEY, %s)' %
+                        ', '.join('%s %s' % column for column in DONE_COLUMNS))
+        for column, declaration in DONE_COLUMNS:
+            self._add_column('done', column, declaration)
+        self.db.execute('CREATE TABLE IF NOT EXISTS state '
+                        '(name TEXT PRIMARY KEY, value TEXT)')
+        self.db.commit()
+        self.on_checkpoint = None
+        self.done = DoneTable(self)
+
+    def _add_column(self, table, column, declaration):
+        columns = [row[1] for row in
+                   self.db.execute('PRAGMA table_info(%s)' % table)]
+        if column not in columns:
+            self.db.execute('ALTER TABLE %s ADD COLUMN %s %s' %
+                            (table, column, declaration))
+
+    def close(self):
+        """Commit outstanding writes and close the database."""
+        self.checkpoint()
+        self.db.close()
+
+    def checkpoint(self):
+        """Commit outstanding writes."""
+        if self.pending_writes:
+            logger.info('checkpointing %d writes to %s',
+                        self.pending_writes, self.path)
+            if self.on_checkpoint is not None:
+                self.on_checkpoint()
+            self.db.commit()
+            self.pending_writes = 0
+
+    def _wrote(self):
+        self.pending_writes += 1
+        if self.pending_writes >= self.checkpoint_every:
+            self.checkpoint()
+
+    def save(self, name, value):
+        """Keep a JSON-safe value under name, from the next commit on."""
+        self.db.execute('INSERT OR REPLACE INTO state VALUES (?, ?)',
+                        (name, json.dumps(value)))
+        self.pending_writes += 1
+
+    def load(self, name):
+        """Return the value kept under name, or None."""
+        for value, in self.db.execute('SELECT value FROM state '
+                                      'WHERE name = ?', (name,)):
+            return json.loads(value)
+        return None
+
+    def todo(self):
+        """Return the URLs left unfinished by an earlier run.
+
+        This is a dict mapping each URL to (max_redirect, depth).
+        """
+        return {url: (max_redirect, depth) for url, max_redirect, depth in
+                self.db.execute('SELECT url, max_redirect, depth FROM todo')}
+
+    def urls(self):
+        """Yield every URL recorded, todo or done."""
+        for row in self.db.execute('SELECT url FROM todo UNION ALL '
+                                   'SELECT url FROM done'):
+            yield row[0]
+
+    def originals(self):
+        """Yield (url, digest, simhash) for the HTML pages done so far.
+
+        Pages found to duplicate another are left out; simhash is an
+        int or None.  This is what a dedup.DuplicateIndex remembers.
+        """
+        for url, digest, simhash in self.db.execute(
+                'SELECT url, digest, simhash FROM done WHERE status = 200'
+                " AND ctype = 'text/html' AND NOT truncated"
+                ' AND duplicate_of IS NULL'):
+            yield url, digest, int(simhash, 16) if simhash else None
+
+    def add(self, url, max_redirect, depth=0):
+        """Record a URL added to the todo list."""
+        self.db.execute('INSERT OR REPLACE INTO todo'
+                        ' (url, max_redirect, depth) VALUES (?, ?, ?)',
+                        (url, max_redirect, depth))
+        self._wrote()
+
+
+class DoneTable:
+    """The done table of a FrontierStore, used in place of Crawler.done.
+
+    This looks enough like a dict of url -> Fetcher for the crawler and
+    the reporting code, but only a summary of each Fetcher is kept (in
+    the database), so finished URLs don't take up memory.  Storing a
+    Fetcher also removes its URL from the todo table.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.db = store.db
+        # Counted once and kept up to date, not counted for each len().
+        self.count = self.db.execute('SELECT COUNT(*) FROM done').fetchone()[0]
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, url):
+        return self.db.execute('SELECT 1 FROM done WHERE url = ?',
+                               (url,)).fetchone() is not None
+
+    def __setitem__(self, url, fetcher):
+        error = None
+        if fetcher.exceptions:
+            exc = fetcher.exceptions[-1]
+            error = '%s:%s' % (exc.__class__.__name__, exc)
+        if url not in self:
+            self.count += 1
+        self.db.execute('DELETE FROM todo WHERE url = ?', (url,))
+        self.db.execute('INSERT OR REPLACE INTO done (url, %s) VALUES (%s)' %
+                        (', '.join(column for column, _ in DONE_COLUMNS),
+                         ', '.join('?' * (len(DONE_COLUMNS) + 1))),
+                        (url, fetcher.status, fetcher.tries, error,
+                         fetcher.next_url, fetcher.ctype, fetcher.encoding,
+                         fetcher.size, fetcher.wire_size, fetcher.digest,
+                         fetcher.truncated,
+                         len(fetcher.urls) if fetcher.urls is not None
+                         else None,
+                         len(fetcher.new_urls) if fetcher.new_urls is not None
+                         else None,
+                         '%016x' % fetcher.simhash
+                         if fetcher.simhash is not None else None,
+                         fetcher.duplicate_of))
+        self.store._wrote()
+
+    def items(self):
+        """Yield (url, FetcherRecord) pairs, sorted by URL."""
+        cursor = self.db.execute(
+            'SELECT url, %s FROM done ORDER BY url' %
+            ', '.join(column for column, _ in DONE_COLUMNS))
+        for row in cursor:
+            yield row[0], FetcherRecord(*row)
+
+
+class FetcherRecord:
+    """The summary of a finished Fetcher, as read back from a DoneTable.
+
+    This has the attributes of a finished Fetcher that the reporting
+    code uses.  The sets of URLs are replaced by sequences of the right
+    length.
+    """
+
+    task = None
+    retry_delay = None  # It's finished.
+
+    def __init__(self, url, status, tries, error, next_url, ctype, encoding,
+                 size, wire_size, digest, truncated, nurls, nnew,
+                 simhash=None, duplicate_of=None):
+        self.url = url
+        self.status = status
+        self.tries = tries
+        self.timings = {}  # Not stored.
+        self.exceptions = []
+        self.disallowed = False
+        if error is not None:
+            # Recreate an exception with the original class name and
+            # message; the reporting code only looks at those.
+            name, msg = error.split(':', 1)
+            self.exceptions.append(type(name, (Exception,), {})(msg))
+            self.disallowed = (status is None and
+                               name == robots.RobotsDisallowed.__name__)
+            if status is None:
+                # Every try failed.
+                self.exceptions *= tries
+        self.next_url = next_url
+        self.ctype = ctype
+        self.encoding = encoding
+        self.size = size
+        self.wire_size = wire_size
+        self.digest = digest
+        self.truncated = bool(truncated)
+        self.urls = range(nurls) if nurls is not None else None
+        self.new_urls = range(nnew) if nnew is not None else None
+        self.simhash = int(simhash, 16) if simhash else None
+        self.duplicate_of = duplicate_of
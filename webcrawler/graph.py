@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+"""Link-graph analysis of a crawl: PageRank and in-degree
+
+Reads the link graphs that crawl.py --graph saved (several, e.g. one
+per shard, are merged by URL), computes the PageRank and in-degree of
+every page, and prints the top pages.  With --scores the scores are
+written to FILE, one "URL<tab>pagerank<tab>in-degree" line per page;
+crawl.py --scores FILE then fetches the pages with the highest
+PageRank first.
+
+The computation uses numpy if it is installed, which makes graphs of
+millions of edges take seconds; without it, it is done in pure Python.
+
+Usage:
+  graph.py [-h] [--top N] [--damping D] [--iterations N] [--scores FILE]
+           <graph>...
+
+Arguments:
+  graph  Graph directory saved by crawl.py --graph (may be repeated)
+
+Options:
+  -h, --help      show this help message and exit
+  --top N         Show the N pages with the highest PageRank [default: 20]
+  --damping D     PageRank damping factor [default: 0.85]
+  --iterations N  Iterate at most N times [default: 100]
+  --scores FILE   Write all the scores to FILE
+"""
+
+import array
+import os
+import sys
+import time
+
+import urlnorm
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class LinkGraph:
+    """The links between pages, collected while crawling.
+
+    Nodes are URLs, numbered in the order they are first seen.  The
+    links of each page are added in one go by add_page(), so they are
+    kept as a span of one array of targets, and building the CSR form
+    (see csr()) just puts the spans in node order.
+
+    save() writes the graph to a directory in CSR form:
+
+      nodes.txt  the URL of each node, one per line
+      indptr     node i links to indices[indptr[i]:indptr[i+1]]
+                 (little-endian unsigned 64-bit integers)
+      indices    the target nodes (little-endian unsigned 32-bit)
+
+    If path is given and a graph was saved there before (by a crawl
+    that is now resumed), it is loaded first.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.ids = {}  # {url: node, ...}
+        self.urls = []  # [url, ...] by node.
+        self.targets = array.array('I')
+        self.spans = {}  # {node: (start, end), ...} into targets.
+        if path and os.path.exists(os.path.join(path, 'nodes.txt')):
+            urls, indptr, indices = load(path)
+            for url in urls:
+                self.node(url)
+            self.targets = indices
+            for i in range(len(urls)):
+                if indptr[i] < indptr[i+1]:
+                    self.spans[i] = (indptr[i], indptr[i+1])
+
+    def __len__(self):
+        return len(self.urls)
+
+    def node(self, url):
+        """Return the node for a URL, adding it if it is new."""
+        node = self.ids.get(url)
+        if node is None:
+            node = self.ids[url] = len(self.urls)
+            self.urls.append(url)
+        return node
+
+    def add_page(self, fetcher):
+        """Add the links of a finished Fetcher (and its redirect)."""
+        links = set()
+        for url in (fetcher.urls or ()):
+            if url.startswith(('http://', 'https://')):
+                links.add(urlnorm.canonicalize(url))
+        if fetcher.next_url:
+            links.add(urlnorm.canonicalize(fetcher.next_url))
+        links.discard(fetcher.url)
+        if not links:
+            return
+        node = self.node(fetcher.url)
+        start = len(self.targets)
+        self.targets.extend(self.node(url) for url in links)
+        self.spans[node] = (start, len(self.targets))
+
+    def csr(self):
+        """Return (indptr, indices) arrays for the graph."""
+        indptr = array.array('Q', [0])
+        indices = array.array('I')
+        targets = self.targets
+        for node in range(len(self.urls)):
+            span = self.spans.get(node)
+            if span is not None:
+                indices.extend(targets[span[0]:span[1]])
+            indptr.append(len(indices))
+        return indptr, indices
+
+    def save(self, path=None):
+        path = path or self.path
+        os.makedirs(path, exist_ok=True)
+        indptr, indices = self.csr()
+        with open(os.path.join(path, 'nodes.txt'), 'w', encoding='utf-8',
+                  errors='surrogateescape') as f:
+            for url in self.urls:
+                f.write(url + '\n')
+        for name, values in (('indptr', indptr), ('indices', indices)):
+            if sys.byteorder != 'little':
+                values.byteswap()
+            with open(os.path.join(path, name), 'wb') as f:
+                values.tofile(f)
+
+
+def load(path):
+    """Return (urls, indptr, indices) for a graph saved by LinkGraph."""
+    with open(os.path.join(path, 'nodes.txt'), encoding='utf-8',
+              errors='surrogateescape') as f:
+        urls = f.read().splitlines()
+    arrays = []
+    for name, typecode in (('indptr', 'Q'), ('indices', 'I')):
+        values = array.array(typecode)
+        with open(os.path.join(path, name), 'rb') as f:
+            values.frombytes(f.read())
+        if sys.byteorder != 'little':
+            values.byteswap()
+        arrays.append(values)
+    return urls, arrays[0], arrays[1]
+
+
+def merge(paths):
+    """Load several saved graphs as one, joining their nodes by URL."""
+    if len(paths) == 1:
+        return load(paths[0])
+    graph = LinkGraph()
+    links = {}  # {node: [target, ...], ...}
+    for path in paths:
+        urls, indptr, indices = load(path)
+        nodes = [graph.node(url) for url in urls]
+        for i, node in enumerate(nodes):
+            for j in range(indptr[i], indptr[i+1]):
+                links.setdefault(node, set()).add(nodes[indices[j]])
+    for node, targets in links.items():
+        start = len(graph.targets)
+        graph.targets.extend(targets)
+        graph.spans[node] = (start, len(graph.targets))
+    indptr, indices = graph.csr()
+    return graph.urls, indptr, indices
+
+
+def in_degree(indptr, indices):
+    """Return the number of links to each node."""
+    n = len(indptr) - 1
+    if numpy is not None:
+        return numpy.bincount(numpy.asarray(indices, dtype=numpy.int64),
+                              minlength=n)
+    counts = [0] * n
+    for target in indices:
+        counts[target] += 1
+    return counts
+
+
+def pagerank(indptr, indices, damping=0.85, iterations=100, tol=1e-9):
+    """Return the PageRank of each node, by power iteration.
+
+    The rank of pages without links (dangling nodes) is spread evenly
+    over all pages.  Iteration stops when the ranks change by less
+    than tol in total.
+    """
+    n = len(indptr) - 1
+    if not n:
+        return []
+    if numpy is not None:
+        indptr = numpy.asarray(indptr, dtype=numpy.int64)
+        indices = numpy.asarray(indices, dtype=numpy.int64)
+        outdegree = numpy.diff(indptr)
+        sources = numpy.repeat(numpy.arange(n), outdegree)
+        dangling = outdegree == 0
+        share = numpy.where(dangling, 0.0, 1.0 / numpy.maximum(outdegree, 1))
+        rank = numpy.full(n, 1.0 / n)
+        for _ in range(iterations):
+            spread = numpy.bincount(indices, weights=(rank * share)[sources],
+                                    minlength=n)
+            new = (damping * (spread + rank[dangling].sum() / n) +
+                   (1 - damping) / n)
+            delta = numpy.abs(new - rank).sum()
+            rank = new
+            if delta < tol:
+                break
+        return rank
+    rank = [1.0 / n] * n
+    for _ in range(iterations):
+        spread = [0.0] * n
+        lost = 0.0
+        for i in range(n):
+            start, end = indptr[i], indptr[i+1]
+            if start == end:
+                lost += rank[i]
+                continue
+            share = rank[i] / (end - start)
+            for j in range(start, end):
+                spread[indices[j]] += share
+        base = damping * lost / n + (1 - damping) / n
+        new = [base + damping * value for value in spread]
+        delta = sum(abs(a - b) for a, b in zip(new, rank))
+        rank = new
+        if delta < tol:
+            break
+    return rank
+
+
+def load_scores(path):
+    """Return {url: pagerank, ...} from a file that --scores wrote."""
+    scores = {}
+    with open(path, encoding='utf-8', errors='surrogateescape') as f:
+        for line in f:
+            url, score = line.rstrip('\n').split('\t')[:2]
+            scores[url] = float(score)
+    return scores
+
+
+class ScorePriority:
+    """A Crawler priority that fetches pages with high scores first.
+
+    URLs without a score count as average, and equal scores are broken
+    by depth.  (This is a class rather than a closure so that it can be
+    pickled, e.g. to send it to the shards of a crawl.)
+    """
+
+    def __init__(self, scores):
+        self.scores = scores
+        self.default = sum(scores.values()) / len(scores) if scores else 0.0
+
+    def __call__(self, url, depth):
+        return -self.scores.get(url, self.default), depth
+
+
+def main():
+    t0 = time.time()
+    urls, indptr, indices = merge(args["<graph>"])
+    t1 = time.time()
+    print('%d nodes, %d edges, loaded in %.3f secs' %
+          (len(urls), len(indices), t1 - t0))
+    ranks = pagerank(indptr, indices, damping=float(args["--damping"]),
+                     iterations=int(args["--iterations"]))
+    degrees = in_degree(indptr, indices)
+    print('PageRank and in-degree in %.3f secs (%s)' %
+          (time.time() - t1, 'numpy' if numpy is not None else 'pure Python'))
+    top = sorted(range(len(urls)), key=lambda i: -ranks[i])
+    for i in top[:int(args["--top"])]:
+        print('%.6f %8d %s' % (ranks[i], degrees[i], urls[i]))
+    if args["--scores"]:
+        with open(args["--scores"], 'w', encoding='utf-8',
+                  errors='surrogateescape') as f:
+            for i in top:
+                f.write('%s\t%.9g\t%d\n' % (urls[i], ranks[i], degrees[i]))
+
+
+if __name__ == "__main__":
+    from docopt import docopt
+    args = docopt(__doc__, version="0.1")
+    main()
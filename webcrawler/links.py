@@ -0,0 +1,157 @@
+"""A simple web crawler -- link extraction from HTML."""
+
+import codecs
+import html
+import logging
+import re
+import urllib.parse
+
+logger = logging.getLogger(__name__)
+
+
+class LinkExtractor:
+    """Collect the links from HTML that arrives in chunks of bytes.
+
+    Call feed() with each chunk and close() at the end; close() returns
+    the set of absolute URLs (without fragment) that were found.
+
+    The HTML is split into tokens -- comments, script and style
+    elements, and start tags -- and links are taken from the href
+    attribute of start tags, and if follow_src is true also from src
+    and srcset.  Nothing inside comments, scripts or styles counts.
+    Relative links are resolved against the <base href> if there is
+    one, else against the URL of the page.  Duplicate raw values are
+    dropped before resolving, since that is the expensive part.
+
+    A token split across chunks is kept until the rest arrives, but
+    only if it is a start tag of at most max_tag_size characters.  The
+    rest is skipped in raw mode, in which each chunk is only searched
+    for the end (see end_res): the end tag of a script or style, '-->'
+    for a comment, '>' for a longer tag (whose links are lost).  So
+    unclosed markup costs linear time, not quadratic.
+    """
+
+    token_re = re.compile(r'<(?:!--.*?-->|'
+                          r'(script|style)\b([^>]*)>.*?</\1\s*>|'
+                          r'([a-zA-Z][^\s/>]*)([^>]*)>)', re.I | re.S)
+    attr_re = re.compile(r'(?:^|(?<=[\s/"\']))(href|src|srcset)\s*=\s*'
+                         r'(?:"([^"]*)"|\'([^\']*)\'|([^\s>]+))', re.I)
+    # What may be the start of a tag or comment that isn't closed yet.
+    open_re = re.compile(r'<(?:[a-zA-Z!]|\Z)')
+    end_res = {tag: re.compile(r'</%s\s*>' % tag, re.I)
+               for tag in ('script', 'style')}
+    end_res['--'] = re.compile(r'-->')
+    end_res['>'] = re.compile(r'>')
+    tail_size = 64  # Raw text kept in case an end tag is split.
+    max_tag_size = 16*1024
+
+    def __init__(self, url, encoding='utf-8', follow_src=False):
+        self.base = url
+        self.follow_src = follow_src
+        try:
+            self.decoder = codecs.getincrementaldecoder(encoding)('replace')
+        except LookupError:
+            logger.warn('unknown encoding %r, using utf-8', encoding)
+            self.decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        self.pending = ''
+        self.raw = set()
+        self.seen_base = False
+        self.stopped = False
+        self.end_re = None  # What ends the raw text we're in, if any.
+
+    def feed(self, data, final=False):
+        if self.stopped:
+            return
+        self.stopped = final
+        text = self.pending + self.decoder.decode(data, final)
+        pos = 0
+        while True:
+            if self.end_re is not None:
+                m = self.end_re.search(text, pos)
+                if m is None:
+                    # The end hasn't arrived yet (or never will).
+                    self.pending = text[max(pos, len(text) - self.tail_size):]
+                    return
+                self.end_re = None
+                pos = m.end()
+            cut = self.find_unclosed(text, pos)
+            for m in self.token_re.finditer(text, pos, cut):
+                raw_tag, raw_attrs, tag, attrs = m.group(1, 2, 3, 4)
+                if not tag:
+                    # A comment, or a script or style with its contents.
+                    if raw_tag and self.follow_src and '=' in raw_attrs:
+                        self.handle_attrs(raw_tag.lower(), raw_attrs)
+                    continue
+                tag = tag.lower()
+                if tag in ('script', 'style'):
+                    # Its end tag isn't here yet; skip to it.
+                    if self.follow_src and '=' in attrs:
+                        self.handle_attrs(tag, attrs)
+                    self.end_re = self.end_res[tag]
+                    pos = m.end()
+                    break
+                if '=' in attrs:
+                    self.handle_attrs(tag, attrs)
+            else:
+                if final or cut == len(text):
+                    self.pending = ''
+                    return
+                if text.startswith('<!--', cut):
+                    self.end_re = self.end_res['--']
+                    pos = cut + 4
+                elif len(text) - cut > self.max_tag_size:
+                    self.end_re = self.end_res['>']
+                    pos = cut
+                else:
+                    self.pending = text[cut:]
+                    return
+
+    def find_unclosed(self, text, pos):
+        """Return where the unclosed tag or comment in text starts.
+
+        Returns len(text) if there is none.  Every '<' before that has
+        a '>' after it (or a '-->', if it starts a comment), so each of
+        token_re's matches stops there, and a scan takes linear time.
+        """
+        i = text.rfind('<!--', pos)
+        if i >= 0 and text.find('-->', i + 4) < 0:
+            return i
+        m = self.open_re.search(text, max(pos, text.rfind('>', pos) + 1))
+        return m.start() if m else len(text)
+
+    def handle_attrs(self, tag, attrs):
+        for m in self.attr_re.finditer(attrs):
+            name = m.group(1).lower()
+            value = m.group(2) or m.group(3) or m.group(4)
+            if not value:
+                continue
+            value = html.unescape(value).strip()
+            if name == 'href':
+                if tag == 'base':
+                    if not self.seen_base:  # Only the first <base> counts.
+                        self.seen_base = True
+                        self.base = urllib.parse.urljoin(self.base, value)
+                else:
+                    self.raw.add(value)
+            elif self.follow_src:
+                if name == 'src':
+                    self.raw.add(value)
+                else:
+                    for candidate in value.split(','):
+                        parts = candidate.split()
+                        if parts:
+                            self.raw.add(parts[0])
+
+    def close(self):
+        self.feed(b'', final=True)
+        base = urllib.parse.urldefrag(self.base)[0]
+        # Fragments don't matter, and dropping them first means fewer
+        # distinct values to resolve.
+        raws = {raw.partition('#')[0] for raw in self.raw}
+        urls = set()
+        for raw in raws:
+            if raw.startswith(('http://', 'https://')):
+                urls.add(raw)  # Already absolute.
+            else:
+                urls.add(urllib.parse.urljoin(base, raw))
+        return urls
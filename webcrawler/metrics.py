@@ -0,0 +1,341 @@
+"""A simple web crawler -- live metrics while crawling."""
+
+import asyncio
+import collections
+import json
+import logging
+import math
+import os
+import sys
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Histogram:
+    """Counts of positive values (e.g. seconds) in logarithmic buckets.
+
+    Bucket i counts the values up to low * growth**i, so percentiles
+    come out within a factor of growth (10% by default) of the truth,
+    using a fixed amount of memory however many values are added.
+    """
+
+    def __init__(self, low=0.0001, growth=1.1, nbuckets=250):
+        self.low = low
+        self.growth = growth
+        self.log_growth = math.log(growth)
+        self.buckets = [0] * nbuckets
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        if value <= self.low:
+            i = 0
+        else:
+            i = int(math.ceil(math.log(value / self.low) / self.log_growth))
+            i = min(i, len(self.buckets) - 1)
+        self.buckets[i] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def merge(self, other):
+        """Add the counts of another Histogram with the same buckets."""
+        for i, n in enumerate(other.buckets):
+            self.buckets[i] += n
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def state(self):
+        """Return the counts as a dict that can be turned into JSON."""
+        return {
+            'buckets': {str(i): n for i, n in enumerate(self.buckets) if n},
+            'count': self.count,
+            'total': self.total,
+            'max': self.max,
+        }
+
+    def restore(self, state):
+        """Add the counts from a state() of a Histogram like this one."""
+        for i, n in state['buckets'].items():
+            self.buckets[int(i)] += n
+        self.count += state['count']
+        self.total += state['total']
+        self.max = max(self.max, state['max'])
+
+    def percentile(self, p):
+        """Return (an upper bound of) the p-th percentile, 0 <= p <= 100."""
+        if not self.count:
+            return 0.0
+        rank = p / 100 * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if n and seen >= rank:
+                return min(self.low * self.growth ** i, self.max)
+        return self.max
+
+    def summary(self):
+        """Return count, mean, max and the usual percentiles as a dict."""
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else 0.0,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99),
+            'max': self.max,
+        }
+
+
+class Metrics:
+    """Counters the crawler updates as fetches finish.
+
+    Crawler.fetch() calls record() for each fetch; snapshot() combines
+    these with the crawler's queues and pool into a dict that is safe
+    to turn into JSON.  Rates are given both over the whole crawl and
+    over the last window seconds of snapshots.  If the crawler adapts
+    its concurrency, the controller's state and recent decisions are
+    included too.
+
+    If timings_path is given, a line of JSON with the URL, its status
+    and sizes and the time spent in each phase (see Fetcher) is
+    appended to that file for every fetch.
+
+    The counters and histograms can be saved with state() and added
+    back with restore(), so that a resumed crawl (see
+    frontier.FrontierStore) counts the fetches made before, too.
+    """
+
+    def __init__(self, window=10, timings_path=None):
+        self.window = window
+        self.t0 = time.time()
+        self.fetches = 0
+        self.retries = 0  # Tries that failed, to be tried again later.
+        self.bytes = 0
+        self.wire_bytes = 0
+        self.statuses = collections.Counter()
+        self.latency = Histogram()
+        self.phases = {}  # {phase: Histogram, ...}
+        self.samples = collections.deque()  # [(time, fetches, bytes), ...]
+        self.timings_file = None
+        if timings_path:
+            self.timings_file = open(timings_path, 'a')
+
+    def close(self):
+        if self.timings_file is not None:
+            self.timings_file.close()
+            self.timings_file = None
+
+    def record(self, fetcher, elapsed):
+        """Count a fetch that took elapsed seconds.
+
+        If the fetcher stopped to wait for a retry (see
+        Fetcher.retry_delay), it only counts as a retry: fetches and
+        statuses count each URL once, with its final outcome.  The time
+        and bytes of every try are counted.
+        """
+        self.bytes += fetcher.size or 0
+        self.wire_bytes += fetcher.wire_size or 0
+        if fetcher.retry_delay is not None:
+            self.retries += 1
+        else:
+            self.fetches += 1
+            if fetcher.disallowed:
+                self.statuses['robots'] += 1
+            elif fetcher.status is None:
+                self.statuses['fail'] += 1
+            else:
+                self.statuses[str(fetcher.status)] += 1
+        self.latency.add(elapsed)
+        for phase, secs in fetcher.timings.items():
+            histogram = self.phases.get(phase)
+            if histogram is None:
+                histogram = self.phases[phase] = Histogram()
+            histogram.add(secs)
+        if self.timings_file is not None:
+            record = {
+                'url': fetcher.url,
+                'status': fetcher.status,
+                'tries': fetcher.tries,
+                'size': fetcher.size,
+                'wire_size': fetcher.wire_size,
+                'total': elapsed,
+            }
+            record.update(fetcher.timings)
+            self.timings_file.write(json.dumps(record) + '\n')
+
+    def state(self):
+        """Return the counters and histograms as a JSON-safe dict."""
+        return {
+            'elapsed': time.time() - self.t0,
+            'fetches': self.fetches,
+            'retries': self.retries,
+            'bytes': self.bytes,
+            'wire_bytes': self.wire_bytes,
+            'statuses': dict(self.statuses),
+            'latency': self.latency.state(),
+            'phases': {phase: histogram.state()
+                       for phase, histogram in self.phases.items()},
+        }
+
+    def restore(self, state):
+        """Add the numbers from a state() saved by an earlier run."""
+        self.t0 -= state['elapsed']
+        self.fetches += state['fetches']
+        self.retries += state.get('retries', 0)  # Not saved at first.
+        self.bytes += state['bytes']
+        self.wire_bytes += state['wire_bytes']
+        self.statuses.update(state['statuses'])
+        self.latency.restore(state['latency'])
+        for phase, histogram_state in state['phases'].items():
+            histogram = self.phases.get(phase)
+            if histogram is None:
+                histogram = self.phases[phase] = Histogram()
+            histogram.restore(histogram_state)
+        self.samples.clear()  # Rates over the window start afresh.
+
+    def snapshot(self, crawler):
+        """Return the current numbers for crawler as a dict."""
+        now = time.time()
+        samples = self.samples
+        samples.append((now, self.fetches, self.bytes))
+        while len(samples) > 2 and samples[1][0] <= now - self.window:
+            samples.popleft()
+        t, fetches, nbytes = samples[0]
+        if now > t:
+            recent_rate = (self.fetches - fetches) / (now - t)
+            recent_bytes = (self.bytes - nbytes) / (now - t)
+        else:
+            recent_rate = recent_bytes = 0.0
+        elapsed = now - self.t0
+        pool = crawler.pool
+        taken = pool.reused + pool.opened
+        snapshot = {
+            'time': now,
+            'elapsed': elapsed,
+            'todo': len(crawler.todo),
+            'busy': len(crawler.busy),
+            'done': len(crawler.done),
+            'max_tasks': crawler.scheduler.max_tasks,
+            'fetches': self.fetches,
+            'retries': self.retries,
+            'urls_per_sec': recent_rate,
+            'urls_per_sec_avg': self.fetches / elapsed if elapsed else 0.0,
+            'bytes': self.bytes,
+            'wire_bytes': self.wire_bytes,
+            'bytes_per_sec': recent_bytes,
+            'statuses': dict(self.statuses),
+            'latency': self.latency.summary(),
+            'phases': {phase: histogram.summary()
+                       for phase, histogram in self.phases.items()},
+            'pool': {
+                'pooled': len(pool.queue),
+                'max_pool': pool.max_pool,
+                'reused': pool.reused,
+                'opened': pool.opened,
+                'hit_rate': pool.reused / taken if taken else 0.0,
+                'tls_handshakes': pool.tls_handshakes,
+                'tls_resumed': pool.tls_resumed,
+                'tls_time': pool.tls_time,
+            },
+        }
+        if crawler.controller is not None:
+            snapshot['concurrency'] = crawler.controller.summary()
+        return snapshot
+
+
+def progress_line(snapshot):
+    """Format a snapshot as one line of progress."""
+    latency = snapshot['latency']
+    return ('[%.0fs] %d done, %d busy (max %d), %d todo; %.1f urls/sec, '
+            '%.1f kB/sec; pool %.0f%% reused; '
+            'latency p50/p95/p99 %.3f/%.3f/%.3f secs' %
+            (snapshot['elapsed'], snapshot['done'], snapshot['busy'],
+             snapshot['max_tasks'], snapshot['todo'],
+             snapshot['urls_per_sec'],
+             snapshot['bytes_per_sec'] / 1000,
+             100 * snapshot['pool']['hit_rate'],
+             latency['p50'], latency['p95'], latency['p99']))
+
+
+class Monitor:
+    """Show a crawler's metrics while it runs.
+
+    Every progress seconds (if given) a progress line is printed to
+    file, and if address is given the current snapshot is served as
+    JSON over HTTP there: a port number (on localhost), host:port, or
+    the path of a Unix socket.  Call start() once the crawler exists
+    and stop() when it's done.
+    """
+
+    def __init__(self, crawler, progress=None, address=None, prefix='',
+                 file=None):
+        self.crawler = crawler
+        self.progress = progress
+        self.address = address
+        self.prefix = prefix
+        self.file = file or sys.stderr
+        self.task = None
+        self.server = None
+        self.unix_path = None
+
+    @asyncio.coroutine
+    def start(self):
+        if self.progress:
+            self.task = asyncio.Task(self.show_progress())
+        if self.address:
+            host, sep, port = str(self.address).rpartition(':')
+            if port.isdigit():
+                self.server = yield from asyncio.start_server(
+                    self.handle, host or '127.0.0.1', int(port))
+            else:
+                if os.path.exists(self.address):
+                    os.unlink(self.address)  # Left over from last time.
+                self.server = yield from asyncio.start_unix_server(
+                    self.handle, self.address)
+                self.unix_path = self.address
+            logger.warn('serving metrics at %r', self.address)
+
+    @asyncio.coroutine
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        if self.server is not None:
+            self.server.close()
+            yield from self.server.wait_closed()
+            self.server = None
+        if self.unix_path is not None:
+            os.unlink(self.unix_path)
+            self.unix_path = None
+
+    @asyncio.coroutine
+    def show_progress(self):
+        while True:
+            yield from asyncio.sleep(self.progress)
+            snapshot = self.crawler.metrics.snapshot(self.crawler)
+            print(self.prefix + progress_line(snapshot), file=self.file)
+            self.file.flush()
+
+    @asyncio.coroutine
+    def handle(self, reader, writer):
+        """Answer any HTTP request with the current snapshot."""
+        try:
+            while True:
+                line = yield from reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+            snapshot = self.crawler.metrics.snapshot(self.crawler)
+            body = json.dumps(snapshot, sort_keys=True).encode('utf-8')
+            writer.write(('HTTP/1.0 200 OK\r\n'
+                          'Content-Type: application/json\r\n'
+                          'Content-Length: %d\r\n'
+                          '\r\n' % len(body)).encode('latin-1'))
+            writer.write(body)
+            yield from writer.drain()
+        except OSError as exc:
+            logger.info('metrics request failed: %r', exc)
+        finally:
+            writer.close()
@@ -1,32 +1,64 @@
 """Reporting subsystem for web crawler."""
 
+import csv
+import json
+import sys
 import time
 
+import metrics
+
 
 class Stats:
-    """Record stats of various sorts."""
+    """Record stats of various sorts.
+
+    Besides counts, distributions of values (such as the time taken
+    by each phase of fetching a URL) are kept in histograms.
+    """
 
     def __init__(self):
         self.stats = {}
+        self.histograms = {}
 
     def add(self, key, count=1):
         self.stats[key] = self.stats.get(key, 0) + count
 
+    def observe(self, key, value):
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = metrics.Histogram()
+        histogram.add(value)
+
+    def merge(self, other):
+        """Add the counts and histograms of another Stats instance."""
+        for key, count in other.stats.items():
+            self.add(key, count)
+        for key, histogram in other.histograms.items():
+            if key in self.histograms:
+                self.histograms[key].merge(histogram)
+            else:
+                self.histograms[key] = histogram
+
     def report(self, file=None):
         for key, count in sorted(self.stats.items()):
             print('%10d' % count, key, file=file)
+        for key, histogram in sorted(self.histograms.items()):
+            print('%10d' % histogram.count, key,
+                  'mean %.3f p50 %.3f p95 %.3f p99 %.3f max %.3f secs' %
+                  tuple(histogram.summary()[k]
+                        for k in ('mean', 'p50', 'p95', 'p99', 'max')),
+                  file=file)
 
 
 def report(crawler, file=None):
     """Print a report on all completed URLs."""
-    t1 = crawler.t1 or time.time()
-    dt = t1 - crawler.t0
-    if dt and crawler.max_tasks:
-        speed = len(crawler.done) / dt / crawler.max_tasks
-    else:
-        speed = 0
     stats = Stats()
     print('*** Report ***', file=file)
+    url_report(crawler, stats, file=file)
+    summary_report(summarize(crawler, stats), file=file)
+
+
+def url_report(crawler, stats, file=None):
+    """Print a line for each completed or busy URL, updating stats."""
     try:
         show = []
         show.extend(crawler.done.items())
@@ -36,66 +68,315 @@ def report(crawler, file=None):
             fetcher_report(fetcher, stats, file=file)
     except KeyboardInterrupt:
         print('\nInterrupted', file=file)
-    print('Finished', len(crawler.done),
+
+
+def summarize(crawler, stats):
+    """Return the numbers the end of the report needs, as a dict.
+
+    Unlike the crawler itself this can be pickled, and summaries of
+    several crawlers can be combined with merge_summaries().
+    """
+    pool = crawler.pool
+    rewrites = crawler.rewrites
+    return {
+        't0': crawler.t0,
+        't1': crawler.t1 or time.time(),
+        'max_tasks': crawler.max_tasks,
+        'todo': len(crawler.todo),
+        'busy': len(crawler.busy),
+        'done': len(crawler.done),
+        'stats': stats,
+        'dns_hits': pool.dns_hits,
+        'dns_misses': pool.dns_misses,
+        'dns_failures': pool.dns_failures,
+        'dns_time': pool.dns_time,
+        'tls_handshakes': pool.tls_handshakes,
+        'tls_resumed': pool.tls_resumed,
+        'tls_time': pool.tls_time,
+        'pipeline': pool.pipeline,
+        'pipelined_requests': pool.pipelined_requests,
+        'no_pipeline': len(pool.no_pipeline),
+        'rewritten': rewrites.rewritten if rewrites else 0,
+        'rewritten_origins': len(rewrites.rules) if rewrites else 0,
+    }
+
+
+def merge_summaries(summaries):
+    """Combine the summaries of crawlers that ran side by side."""
+    merged = {}
+    stats = Stats()
+    for summary in summaries:
+        for key, value in summary.items():
+            if key == 'stats':
+                stats.merge(value)
+            elif key not in merged:
+                merged[key] = value
+            elif key == 't0':
+                merged[key] = min(merged[key], value)
+            elif key in ('t1', 'pipeline'):
+                merged[key] = max(merged[key], value)
+            else:
+                merged[key] += value
+    merged['stats'] = stats
+    return merged
+
+
+def summary_report(summary, file=None):
+    """Print the totals at the end of the report."""
+    dt = summary['t1'] - summary['t0']
+    if dt and summary['max_tasks']:
+        speed = summary['done'] / dt / summary['max_tasks']
+    else:
+        speed = 0
+    print('Finished', summary['done'],
           'urls in %.3f secs' % dt,
-          '(max_tasks=%d)' % crawler.max_tasks,
+          '(max_tasks=%d)' % summary['max_tasks'],
           '(%.3f urls/sec/task)' % speed,
           file=file)
-    stats.report(file=file)
-    print('Todo:', len(crawler.todo), file=file)
-    print('Busy:', len(crawler.busy), file=file)
-    print('Done:', len(crawler.done), file=file)
+    summary['stats'].report(file=file)
+    pool_report(summary, file=file)
+    if summary['rewritten']:
+        print('Rewritten:', summary['rewritten'], 'urls from',
+              summary['rewritten_origins'], 'redirected origins', file=file)
+    print('Todo:', summary['todo'], file=file)
+    print('Busy:', summary['busy'], file=file)
+    print('Done:', summary['done'], file=file)
     print('Date:', time.ctime(), 'local time', file=file)
 
 
+def pool_report(summary, file=None):
+    """Print resolver, TLS and pipelining statistics from a summary."""
+    hits, misses = summary['dns_hits'], summary['dns_misses']
+    lookups = hits + misses
+    if lookups:
+        resolve_time = summary['dns_time'] / (misses or 1)
+        print('DNS:', lookups, 'lookups,',
+              '%.1f%% cached,' % (100 * hits / lookups),
+              summary['dns_failures'], 'failed,',
+              '%.3f secs avg resolve' % resolve_time,
+              file=file)
+    handshakes = summary['tls_handshakes']
+    if handshakes:
+        print('TLS:', handshakes, 'handshakes,',
+              '%.1f%% resumed,' % (100 * summary['tls_resumed'] / handshakes),
+              '%.3f secs avg handshake' % (summary['tls_time'] / handshakes),
+              file=file)
+    if summary['pipeline'] > 1:
+        print('Pipelined:', summary['pipelined_requests'], 'requests,',
+              'disabled for', summary['no_pipeline'], 'hosts', file=file)
+
+
 def fetcher_report(fetcher, stats, file=None):
     """Print a report on the state for this URL.
 
     Also update the Stats instance.
     """
+    record = fetcher_record(fetcher, stats)
+    url, result, status = record['url'], record['result'], record['status']
+    if result in ('pending', 'cancelled'):
+        print(url, result, file=file)
+    elif result == 'exception':
+        print(url, record['error'], file=file)
+    elif result == 'robots':
+        print(url, record['error'], file=file)
+    elif result == 'fail':
+        print(url, 'error', record['error'], file=file)
+    elif result == 'redirect':
+        print(url, status, 'redirect', record['next_url'], file=file)
+    elif result == 'not_modified':
+        print(url, status, 'not modified',
+              '%d/%d' % (record['new_urls'] or 0, record['urls'] or 0),
+              file=file)
+    elif result == 'html':
+        if record['duplicate_of']:
+            links = 'duplicate of ' + record['duplicate_of']
+        else:
+            links = '%d/%d' % (record['new_urls'] or 0, record['urls'] or 0)
+        print(url, status,
+              record['ctype'], record['encoding'],
+              record['size'] or 0, links,
+              file=file)
+    else:
+        print(url, status,
+              record['ctype'], record['encoding'],
+              record['size'] or 0,
+              file=file)
+
+
+# The keys of the dicts returned by fetcher_record(), in CSV column order.
+FIELDS = ('url', 'result', 'status', 'ctype', 'encoding', 'size',
+          'wire_size', 'urls', 'new_urls', 'next_url', 'duplicate_of',
+          'tries', 'truncated', 'error_type', 'error', 'time_dns',
+          'time_connect', 'time_tls', 'time_ttfb', 'time_body')
+
+
+def fetcher_record(fetcher, stats):
+    """Return the state of this URL as a dict with the keys in FIELDS.
+
+    The result key says what happened: pending, cancelled, exception
+    (the task crashed), robots (robots.txt disallowed it, so it wasn't
+    fetched), fail (all tries failed), redirect,
+    not_modified, html, other (any other successful response) or
+    error (any other status).  For an HTML page that duplicates an
+    earlier one, duplicate_of is that page's URL.  Also update the
+    Stats instance.
+    """
+    record = dict.fromkeys(FIELDS)
+    record['url'] = fetcher.url
     if fetcher.task is not None:
         if not fetcher.task.done():
             stats.add('pending')
-            print(fetcher.url, 'pending', file=file)
-            return
+            record['result'] = 'pending'
+            return record
         elif fetcher.task.cancelled():
             stats.add('cancelled')
-            print(fetcher.url, 'cancelled', file=file)
-            return
+            record['result'] = 'cancelled'
+            return record
         elif fetcher.task.exception():
             stats.add('exception')
             exc = fetcher.task.exception()
             stats.add('exception_' + exc.__class__.__name__)
-            print(fetcher.url, exc, file=file)
-            return
-    if len(fetcher.exceptions) == fetcher.tries:
+            record.update(result='exception',
+                          error_type=exc.__class__.__name__, error=str(exc))
+            return record
+    for phase, secs in fetcher.timings.items():
+        stats.observe('time_' + phase, secs)
+        record['time_' + phase] = secs
+    record.update(status=fetcher.status, ctype=fetcher.ctype,
+                  encoding=fetcher.encoding, size=fetcher.size,
+                  wire_size=fetcher.wire_size, next_url=fetcher.next_url,
+                  tries=fetcher.tries, truncated=fetcher.truncated)
+    if fetcher.urls is not None:
+        record['urls'] = len(fetcher.urls)
+    if fetcher.new_urls is not None:
+        record['new_urls'] = len(fetcher.new_urls)
+    if fetcher.disallowed:
+        stats.add('robots')
+        exc = fetcher.exceptions[-1]
+        record.update(result='robots',
+                      error_type=exc.__class__.__name__, error=str(exc))
+    elif len(fetcher.exceptions) == fetcher.tries:
         stats.add('fail')
         exc = fetcher.exceptions[-1]
         stats.add('fail_' + str(exc.__class__.__name__))
-        print(fetcher.url, 'error', exc, file=file)
+        record.update(result='fail',
+                      error_type=exc.__class__.__name__, error=str(exc))
     elif fetcher.next_url:
         stats.add('redirect')
-        print(fetcher.url, fetcher.status, 'redirect', fetcher.next_url,
-              file=file)
+        record['result'] = 'redirect'
+    elif fetcher.status == 304:
+        stats.add('not_modified')
+        record['result'] = 'not_modified'
     elif fetcher.ctype == 'text/html':
         stats.add('html')
-        size = len(fetcher.body or b'')
-        stats.add('html_bytes', size)
-        print(fetcher.url, fetcher.status,
-              fetcher.ctype, fetcher.encoding,
-              size,
-              '%d/%d' % (len(fetcher.new_urls or ()), len(fetcher.urls or ())),
-              file=file)
+        stats.add('html_bytes', fetcher.size or 0)
+        stats.add('html_wire_bytes', fetcher.wire_size or 0)
+        if fetcher.truncated:
+            stats.add('html_truncated')
+        if fetcher.duplicate_of:
+            stats.add('html_duplicate')
+            record['duplicate_of'] = fetcher.duplicate_of
+        record['result'] = 'html'
+    elif fetcher.status == 200:
+        stats.add('other')
+        stats.add('other_bytes', fetcher.size or 0)
+        record['result'] = 'other'
     else:
-        size = len(fetcher.body or b'')
-        if fetcher.status == 200:
-            stats.add('other')
-            stats.add('other_bytes', size)
-        else:
-            stats.add('error')
-            stats.add('error_bytes', size)
-            stats.add('status_%s' % fetcher.status)
-        print(fetcher.url, fetcher.status,
-              fetcher.ctype, fetcher.encoding,
-              size,
-              file=file)
+        stats.add('error')
+        stats.add('error_bytes', fetcher.size or 0)
+        stats.add('error_wire_bytes', fetcher.wire_size or 0)
+        stats.add('status_%s' % fetcher.status)
+        record['result'] = 'error'
+    return record
+
+
+def summary_record(summary):
+    """Return a summary (see summarize()) as a dict that JSON can take."""
+    record = {key: value for key, value in summary.items() if key != 'stats'}
+    stats = summary['stats']
+    record['stats'] = dict(stats.stats)
+    record['histograms'] = {key: histogram.summary()
+                            for key, histogram in stats.histograms.items()}
+    return record
+
+
+class ReportWriter:
+    """Write a record for each URL as it finishes, then a summary.
+
+    Unlike report(), this doesn't need all the Fetchers at the end:
+    pass the writer to the Crawler (as report), which calls write()
+    for each finished Fetcher, and call finish() when the crawl is
+    over to write the URLs still busy and the summary.
+
+    This writes JSON lines: each record is a line of JSON, and the
+    summary is the last line, an object with just a summary key.
+    Subclasses write other formats by overriding write_header(),
+    which is called first unless header is false, write_record() and
+    write_summary().
+    """
+
+    def __init__(self, file=None, header=True):
+        self.file = file or sys.stdout
+        self.stats = Stats()
+        if header:
+            self.write_header()
+
+    def write(self, fetcher):
+        self.write_record(fetcher_record(fetcher, self.stats))
+
+    def write_unfinished(self, crawler):
+        """Write records for the URLs that are still busy."""
+        for url, fetcher in sorted(crawler.busy.items()):
+            self.write(fetcher)
+
+    def finish(self, crawler):
+        self.write_unfinished(crawler)
+        self.write_summary(summarize(crawler, self.stats))
+        self.file.flush()
+
+    def write_header(self):
+        """Write what comes before the records (JSON lines need none)."""
+
+    def write_record(self, record):
+        print(json.dumps(record), file=self.file)
+
+    def write_summary(self, summary):
+        print(json.dumps({'summary': summary_record(summary)}),
+              file=self.file)
+
+
+class CSVWriter(ReportWriter):
+    """Write each record as a row of CSV, with the columns in FIELDS.
+
+    The summary follows as rows whose result is 'summary', with the
+    name of a number in the url column and its value in size.  Nested
+    names are joined with dots (e.g. stats.html).
+    """
+
+    def __init__(self, file=None, header=True):
+        self.writer = csv.DictWriter(file or sys.stdout, FIELDS)
+        super().__init__(file, header)
+
+    def write_header(self):
+        self.writer.writeheader()
+
+    def write_record(self, record):
+        self.writer.writerow(record)
+
+    def write_summary(self, summary):
+        rows = [('', summary_record(summary))]
+        while rows:
+            prefix, value = rows.pop()
+            if isinstance(value, dict):
+                for key, item in sorted(value.items(), reverse=True):
+                    rows.append((prefix + key + '.', item))
+            else:
+                self.writer.writerow({'url': prefix[:-1], 'result': 'summary',
+                                      'size': value})
+
+
+# Writers for --report-format, besides the default text report.
+WRITERS = {
+    'jsonl': ReportWriter,
+    'csv': CSVWriter,
+}
@@ -0,0 +1,109 @@
+"""A simple web crawler -- robots.txt rules."""
+
+import re
+
+MAX_SIZE = 500*1024  # How much of a robots.txt to read (see RFC 9309).
+MAX_REDIRECTS = 5  # How many redirects to follow to it (likewise).
+
+
+class RobotsDisallowed(Exception):
+    """The error recorded for a URL that robots.txt disallows."""
+
+
+class RobotsRules:
+    """The rules of a robots.txt that apply to one user agent.
+
+    allowed() applies the Allow and Disallow rules as RFC 9309 says:
+    the rule with the longest matching path wins, and Allow wins a tie.
+    Plain paths are kept in a dict, and a path is looked up by its
+    prefixes of the lengths that rules have, longest first, so a check
+    costs a few dict lookups however many rules there are.  Rules with
+    * or $ in them are compiled to regexes and checked after that.
+
+    delay is the Crawl-delay in seconds, or None; sitemaps are the
+    URLs from Sitemap lines (which apply to every user agent).
+    """
+
+    def __init__(self, rules=(), delay=None, sitemaps=()):
+        self.prefixes = {}  # {path: allowed, ...}
+        self.patterns = []  # [(length, regex, allowed), ...]
+        for path, allowed in rules:
+            if '*' in path or path.endswith('$'):
+                anchored = path.endswith('$')
+                if anchored:
+                    path = path[:-1]
+                regex = '.*'.join(re.escape(part) for part in path.split('*'))
+                if anchored:
+                    regex += r'\Z'
+                self.patterns.append((len(path), re.compile(regex), allowed))
+            else:
+                self.prefixes[path] = allowed or self.prefixes.get(path, False)
+        self.lengths = sorted({len(path) for path in self.prefixes},
+                              reverse=True)
+        self.delay = delay
+        self.sitemaps = list(sitemaps)
+
+    @classmethod
+    def parse(cls, text, agent):
+        """Return the rules in robots.txt text for agent.
+
+        agent is the crawler's product token, e.g. 'examplebot'.  The
+        groups for that name are used if there are any (matched without
+        regard to case), else the groups for '*'.
+        """
+        agent = agent.lower()
+        groups = []  # [(agents, rules, delays), ...]
+        sitemaps = []
+        in_agents = False  # Whether the last line was a User-agent.
+        for line in text.splitlines():
+            key, sep, value = line.partition('#')[0].partition(':')
+            if not sep:
+                continue
+            key, value = key.strip().lower(), value.strip()
+            if key == 'user-agent':
+                if not in_agents:
+                    groups.append(([], [], []))
+                    in_agents = True
+                groups[-1][0].append(value.split('/')[0].lower())
+                continue
+            in_agents = False
+            if key == 'sitemap':
+                sitemaps.append(value)
+            elif not groups:
+                continue
+            elif key in ('allow', 'disallow'):
+                if value:  # An empty Disallow allows everything anyway.
+                    groups[-1][1].append((value, key == 'allow'))
+            elif key == 'crawl-delay':
+                try:
+                    groups[-1][2].append(float(value))
+                except ValueError:
+                    pass
+        chosen = [group for group in groups if agent in group[0]]
+        if not chosen:
+            chosen = [group for group in groups if '*' in group[0]]
+        rules = [rule for _, group_rules, _ in chosen for rule in group_rules]
+        delays = [delay for _, _, group_delays in chosen
+                  for delay in group_delays]
+        return cls(rules, delays[0] if delays else None, sitemaps)
+
+    @classmethod
+    def disallow_all(cls):
+        return cls([('/', False)])
+
+    def allowed(self, path):
+        """Check a path (with the query, if any) against the rules."""
+        if path == '/robots.txt':
+            return True
+        best_length, best = -1, True
+        for length in self.lengths:
+            allowed = self.prefixes.get(path[:length])
+            if allowed is not None:
+                best_length, best = min(length, len(path)), allowed
+                break
+        for length, regex, allowed in self.patterns:
+            if (length > best_length or
+                    (length == best_length and allowed and not best)):
+                if regex.match(path):
+                    best_length, best = length, allowed
+        return best
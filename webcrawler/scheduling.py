@@ -0,0 +1,324 @@
+"""A simple web crawler -- per-host scheduling of fetches."""
+
+import collections
+import email.utils
+import heapq
+import itertools
+import logging
+import random
+import time
+import urllib.parse
+
+logger = logging.getLogger(__name__)
+
+
+def host_key(url):
+    """Return the key that URLs are grouped by (the lowercased netloc)."""
+    return urllib.parse.urlparse(url).netloc.lower()
+
+
+def by_depth(url, depth):
+    """Priority for a breadth-first crawl: shallower URLs first."""
+    return depth
+
+
+# Priority functions by name, for crawl.py --order; None means that
+# URLs are fetched in the order they were found.
+PRIORITIES = {
+    'fifo': None,
+    'depth': by_depth,
+}
+
+
+class HostScheduler:
+    """Decide which URL to fetch next.
+
+    URLs are queued per host, and the hosts with queued URLs take
+    turns (round-robin).  Each host's queue is a heap ordered by the
+    priority given to push() (lower first), then by arrival, so pushing
+    and popping take O(log n) time.  A host is skipped while it has
+    max_per_host fetches running or while less than min_delay seconds
+    have passed since its last fetch started.  Overall at most
+    max_tasks fetches run at once.
+
+    Call push() to queue a URL, pop() to get the next one to start,
+    and finish() when its fetch is done.  set_delay() gives a host a
+    longer delay than min_delay (e.g. its robots.txt Crawl-delay), and
+    pause() holds off a host for a while (e.g. for its Retry-After).
+
+    A URL pushed with a not_before time (a retry; see RetryPolicy)
+    waits in a separate heap, ordered by that time, and only joins its
+    host's queue once the time has come.
+    """
+
+    def __init__(self, max_tasks=10, max_per_host=10, min_delay=0):
+        self.max_tasks = max_tasks
+        self.max_per_host = max_per_host
+        self.min_delay = min_delay
+        self.queues = {}  # {host: [(priority, seq, url), ...], ...}
+        self.waiting = []  # [(not_before, seq, url, priority), ...]
+        self.seq = itertools.count()  # Keeps equal priorities in order.
+        self.hosts = collections.deque()  # Hosts with queued URLs.
+        self.active = {}  # {host: number of running fetches, ...}
+        self.next_start = {}  # {host: earliest time of next fetch, ...}
+        self.delays = {}  # {host: delay, ...} where more than min_delay.
+        self.running = 0
+        # Whether URLs were kept waiting by max_tasks (see
+        # ConcurrencyController); whoever reads it resets it.
+        self.saturated = False
+
+    def __len__(self):
+        return (sum(len(q) for q in self.queues.values()) +
+                len(self.waiting))
+
+    def push(self, url, priority=0, not_before=None):
+        """Queue a URL, not to be fetched before not_before if given."""
+        if not_before is not None and not_before > time.time():
+            heapq.heappush(self.waiting,
+                           (not_before, next(self.seq), url, priority))
+            return
+        host = host_key(url)
+        queue = self.queues.get(host)
+        if queue is None:
+            queue = self.queues[host] = []
+            self.hosts.append(host)
+        heapq.heappush(queue, (priority, next(self.seq), url))
+
+    def pop(self):
+        """Return (url, delay) for the next URL to fetch.
+
+        If no URL may start now, url is None and delay is the number of
+        seconds until one may, or None if that depends on a running
+        fetch finishing first.
+        """
+        now = time.time()
+        waiting = self.waiting
+        while waiting and waiting[0][0] <= now:
+            _, _, url, priority = heapq.heappop(waiting)
+            self.push(url, priority)
+        if self.running >= self.max_tasks:
+            if self.queues:
+                self.saturated = True
+            return None, None
+        delay = waiting[0][0] - now if waiting else None
+        for _ in range(len(self.hosts)):
+            host = self.hosts[0]
+            self.hosts.rotate(-1)
+            if self.active.get(host, 0) >= self.max_per_host:
+                continue
+            wait = self.next_start.get(host, 0) - now
+            if wait > 0:
+                if delay is None or wait < delay:
+                    delay = wait
+                continue
+            queue = self.queues[host]
+            url = heapq.heappop(queue)[2]
+            if not queue:
+                del self.queues[host]
+                self.hosts.pop()  # It was just rotated to the end.
+            self.active[host] = self.active.get(host, 0) + 1
+            self.next_start[host] = now + self.delays.get(host,
+                                                          self.min_delay)
+            self.running += 1
+            return url, None
+        return None, delay
+
+    def set_delay(self, host, delay):
+        """Make fetches from a host start at least delay seconds apart."""
+        if delay <= self.min_delay:
+            return
+        self.delays[host] = delay
+        # A fetch may have started already.
+        self.next_start[host] = max(self.next_start.get(host, 0),
+                                    time.time() + delay)
+
+    def pause(self, host, delay):
+        """Start no fetch from a host for the next delay seconds."""
+        self.next_start[host] = max(self.next_start.get(host, 0),
+                                    time.time() + delay)
+
+    def finish(self, url):
+        """Record that the fetch for a URL popped earlier is done."""
+        host = host_key(url)
+        self.running -= 1
+        self.active[host] -= 1
+        if not self.active[host]:
+            del self.active[host]
+            if (host not in self.queues and
+                    self.next_start.get(host, 0) <= time.time()):
+                del self.next_start[host]
+
+
+def parse_retry_after(value, now=None):
+    """Return the seconds a Retry-After header value asks us to wait.
+
+    The value is a number of seconds or an HTTP date.  Returns None if
+    it's neither.
+    """
+    value = (value or '').strip()
+    if value.isdigit():
+        return float(value)
+    parsed = email.utils.parsedate_tz(value)
+    if parsed is None:
+        return None
+    if now is None:
+        now = time.time()
+    return max(0.0, email.utils.mktime_tz(parsed) - now)
+
+
+class RetryPolicy:
+    """When to retry a failed try of a fetch, and how long to wait first.
+
+    A try fails if it raises a network error, or if the response has
+    one of statuses (by default 429 and the 5xx statuses that mean the
+    server is overloaded or a gateway failed).  After try n, the wait
+    is base * factor**(n-1) seconds, at most max_delay (exponential
+    backoff), less a random part of up to jitter times that, so that
+    fetches that failed together don't all come back together (1 is
+    "full jitter", 0 none).  If the response had a Retry-After header,
+    the wait is at least that long, up to max_retry_after seconds.
+    A wait of 0 means retry at once.
+
+    The Crawler doesn't sleep in the fetch's slot meanwhile: it puts
+    the URL back on the todo list, not to be fetched before the wait
+    is over (see HostScheduler.push()).
+    """
+
+    def __init__(self, base=1.0, factor=2.0, max_delay=60.0, jitter=1.0,
+                 statuses=(429, 500, 502, 503, 504), max_retry_after=600.0):
+        self.base = base
+        self.factor = factor
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.statuses = frozenset(statuses)
+        self.max_retry_after = max_retry_after
+
+    def retryable(self, status):
+        """Check if a response with this status should be retried."""
+        return status in self.statuses
+
+    def delay(self, tries, retry_after=None):
+        """Return the seconds to wait after tries failed tries."""
+        delay = min(self.max_delay, self.base * self.factor ** (tries - 1))
+        delay -= delay * self.jitter * random.random()
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_retry_after))
+        return delay
+
+
+class ConcurrencyController:
+    """Adapt a HostScheduler's max_tasks to how the servers cope (AIMD).
+
+    Call record() with the status (None if the fetch failed) and the
+    latency of each finished fetch (but not of URLs that robots.txt
+    ruled out, which weren't fetched at all).  The fetches are judged
+    in windows of as many fetches as the current limit, but at least
+    min_window.
+    A window is bad if any response was a 429 or 503, if more than
+    max_error_rate of the fetches failed or got another 5xx, or if the
+    median latency was more than latency_factor times the baseline: the
+    lowest median seen, which creeps up by a tenth each window so that
+    a server that has become slower for good doesn't keep the limit
+    down forever.
+
+    A bad window multiplies the limit by decrease.  A good one in which
+    URLs had to wait for the limit adds increase to it, or doubles it
+    until the first bad window (slow start).  The limit starts at
+    min_tasks and stays within min_tasks..max_tasks.
+
+    Every change is logged, and the last few are kept in decisions,
+    which metrics.Metrics.snapshot() reports.
+    """
+
+    def __init__(self, scheduler, min_tasks=1, max_tasks=None,
+                 min_window=10, max_error_rate=0.1, latency_factor=3.0,
+                 increase=1, decrease=0.5, history=20):
+        self.scheduler = scheduler
+        self.min_tasks = min_tasks
+        self.max_tasks = max(max_tasks or scheduler.max_tasks, min_tasks)
+        self.min_window = min_window
+        self.max_error_rate = max_error_rate
+        self.latency_factor = latency_factor
+        self.increase = increase
+        self.decrease = decrease
+        self.slow_start = True
+        self.baseline = None  # Seconds.
+        self.fetches = 0
+        self.errors = 0
+        self.throttled = 0
+        self.latencies = []
+        self.decisions = collections.deque(maxlen=history)
+        scheduler.max_tasks = min_tasks
+        scheduler.saturated = False
+
+    def record(self, status, latency):
+        """Count a finished fetch; adjust the limit if a window is full."""
+        self.fetches += 1
+        if status in (429, 503):
+            self.throttled += 1
+        elif status is None or status >= 500:
+            self.errors += 1
+        else:
+            self.latencies.append(latency)
+        if self.fetches >= max(self.scheduler.max_tasks, self.min_window):
+            self.adjust()
+
+    def adjust(self):
+        """Judge the current window and start a new one."""
+        limit = self.scheduler.max_tasks
+        median = None
+        if self.latencies:
+            self.latencies.sort()
+            median = self.latencies[len(self.latencies) // 2]
+        if self.throttled:
+            reason = '%d throttled responses' % self.throttled
+        elif self.errors > self.max_error_rate * self.fetches:
+            reason = 'error rate %.0f%%' % (100 * self.errors / self.fetches)
+        elif (median is not None and self.baseline is not None and
+              median > self.latency_factor * self.baseline):
+            reason = 'latency %.3f secs (baseline %.3f)' % (median,
+                                                            self.baseline)
+        else:
+            reason = None
+        if reason is not None:
+            self.slow_start = False
+            new_limit = max(int(limit * self.decrease), self.min_tasks)
+        elif self.scheduler.saturated:
+            if self.slow_start:
+                reason = 'slow start'
+                new_limit = limit * 2
+            else:
+                reason = 'saturated'
+                new_limit = limit + self.increase
+            new_limit = min(new_limit, self.max_tasks)
+        else:
+            new_limit = limit
+        if median is not None:
+            if self.baseline is None:
+                self.baseline = median
+            else:
+                self.baseline = min(median, self.baseline * 1.1)
+        if new_limit != limit:
+            logger.warn('max_tasks %d -> %d: %s', limit, new_limit, reason)
+            self.scheduler.max_tasks = new_limit
+            self.decisions.append({
+                'time': time.time(),
+                'from': limit,
+                'to': new_limit,
+                'reason': reason,
+                'fetches': self.fetches,
+                'median_latency': median,
+            })
+        self.fetches = self.errors = self.throttled = 0
+        self.latencies = []
+        self.scheduler.saturated = False
+
+    def summary(self):
+        """Return the current state and recent decisions as a dict."""
+        return {
+            'max_tasks': self.scheduler.max_tasks,
+            'bounds': [self.min_tasks, self.max_tasks],
+            'slow_start': self.slow_start,
+            'baseline_latency': self.baseline,
+            'decisions': list(self.decisions),
+        }
@@ -0,0 +1,284 @@
+"""A simple web crawler -- sharding a crawl over several processes."""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import multiprocessing
+import os
+import queue
+import tempfile
+import zlib
+
+import crawling
+import metrics
+import reporting
+import scheduling
+import sitemap
+
+logger = logging.getLogger(__name__)
+
+
+def shard_of(url, nshards):
+    """Return the shard (0 <= shard < nshards) that owns a URL.
+
+    All URLs of a host belong to the same shard, so per-host limits,
+    DNS caching and connection reuse work as in a single crawler.
+    This uses crc32 rather than hash(), which differs per process.
+    """
+    host = scheduling.host_key(url)
+    return zlib.crc32(host.encode('utf-8', 'surrogateescape')) % nshards
+
+
+class ShardCrawler(crawling.Crawler):
+    """A Crawler that fetches only the URLs of one shard.
+
+    New URLs that belong to another shard are put on that shard's
+    inbox queue (after the seen-set check, so each is sent at most
+    once), and a poll() task adds the URLs arriving on this shard's
+    inbox.
+
+    The crawl is over when no URL is queued, being fetched, or on its
+    way to another shard, in any of the processes.  The outstanding
+    counter, shared by all shards, keeps track of that: it goes up
+    when a URL is put on a todo list (again, for a retry) or forwarded,
+    and down when a fetch is done or a forwarded URL arrives.  It
+    starts out with one extra count per shard, which each shard drops
+    (with started()) once it has added its roots and sitemap URLs, so
+    no shard can see zero before all have started.
+    """
+
+    poll_interval = 0.05  # Seconds between looks at the inbox.
+
+    def __init__(self, roots, shard, inboxes, outstanding, **kwargs):
+        self.shard = shard
+        self.inboxes = inboxes
+        self.outstanding = outstanding
+        self.counting = False
+        super().__init__(roots, **kwargs)
+        # Count what the roots (or a resumed state dir) put on our todo
+        # list.
+        self.adjust(len(self.todo))
+        self.counting = True
+
+    def started(self):
+        """Drop our startup count; call this once before crawl()."""
+        self.adjust(-1)
+
+    def adjust(self, delta):
+        """Add delta to the shared outstanding counter."""
+        with self.outstanding.get_lock():
+            self.outstanding.value += delta
+
+    def owns(self, url):
+        return shard_of(url, len(self.inboxes)) == self.shard
+
+    def forward(self, url, max_redirect, depth):
+        """Put a URL on the inbox of the shard that owns it."""
+        self.adjust(1)
+        self.inboxes[shard_of(url, len(self.inboxes))].put(
+            (url, max_redirect, depth))
+
+    def enqueue(self, url, max_redirect, depth, lastmod=None):
+        if not self.owns(url):
+            self.forward(url, max_redirect, depth)
+            return
+        super().enqueue(url, max_redirect, depth, lastmod)
+        if self.counting:
+            self.adjust(1)
+
+    def retry(self, fetcher):
+        self.adjust(1)  # It's back on the todo list.
+        super().retry(fetcher)
+
+    @asyncio.coroutine
+    def poll(self):
+        """Add the URLs from our inbox until the whole crawl is done."""
+        inbox = self.inboxes[self.shard]
+        while True:
+            received = 0
+            while True:
+                try:
+                    url, max_redirect, depth = inbox.get_nowait()
+                except queue.Empty:
+                    break
+                received += 1
+                # Counts it if it's new.
+                self.add_url(url, max_redirect, depth)
+                self.adjust(-1)  # It's no longer on its way.
+            if received or not self.outstanding.value:
+                with (yield from self.termination):
+                    self.termination.notify()
+                if not received:
+                    return
+            yield from asyncio.sleep(self.poll_interval)
+
+    @asyncio.coroutine
+    def crawl(self):
+        """Run the crawler until all shards are finished."""
+        poller = asyncio.Task(self.poll())
+        try:
+            while True:
+                yield from super().crawl()
+                with (yield from self.termination):
+                    while not (self.todo or self.busy or poller.done()):
+                        yield from self.termination.wait()
+                if poller.done() and not (self.todo or self.busy):
+                    break
+        finally:
+            poller.cancel()
+
+    @asyncio.coroutine
+    def fetch(self, fetcher):
+        try:
+            yield from super().fetch(fetcher)
+        finally:
+            self.adjust(-1)
+
+
+def shard_address(address, shard):
+    """Return where a shard serves its metrics (see metrics.Monitor).
+
+    Shard N adds N to the port, or .N to the Unix socket path.
+    """
+    if not address:
+        return None
+    host, sep, port = str(address).rpartition(':')
+    if port.isdigit():
+        return '%s%s%d' % (host, sep, int(port) + shard)
+    return '%s.%d' % (address, shard)
+
+
+def run_shard(shard, roots, inboxes, outstanding, results, report_path,
+              report_format, log_level, monitor_args, sitemaps, kwargs):
+    """Run one ShardCrawler in this process and send back its summary.
+
+    The report lines for its URLs are written to report_path, when
+    the crawl is done for the text format, else as they finish.
+    """
+    logging.basicConfig(level=log_level)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    for key in ('state_dir', 'cache_dir', 'warc_dir', 'graph_dir'):
+        if kwargs.get(key):
+            kwargs[key] = os.path.join(kwargs[key], 'shard-%d' % shard)
+    if kwargs.get('timings'):
+        kwargs['timings'] = '%s.%d' % (kwargs['timings'], shard)
+    writer = None
+    if report_format != 'text':
+        report_file = open(report_path, 'w')
+        writer = reporting.WRITERS[report_format](report_file, header=False)
+    crawler = ShardCrawler(roots, shard, inboxes, outstanding,
+                           report=writer, **kwargs)
+    progress, address = monitor_args
+    monitor = metrics.Monitor(crawler, progress=progress,
+                              address=shard_address(address, shard),
+                              prefix='shard-%d ' % shard)
+    try:
+        loop.run_until_complete(monitor.start())
+        loop.run_until_complete(crawler.warm_up())
+        if sitemaps[0] or sitemaps[1]:
+            # Every shard reads them, but adds only its own URLs.
+            loop.run_until_complete(sitemap.seed(crawler, *sitemaps))
+        crawler.started()
+        loop.run_until_complete(crawler.crawl())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        loop.run_until_complete(monitor.stop())
+        # If we were interrupted, URLs may be left on the queues, and
+        # nobody will read them.  Don't wait for them on exit.
+        for inbox in inboxes:
+            inbox.cancel_join_thread()
+        if writer is None:
+            stats = reporting.Stats()
+            with open(report_path, 'w') as f:
+                reporting.url_report(crawler, stats, file=f)
+        else:
+            writer.write_unfinished(crawler)
+            report_file.close()
+            stats = writer.stats
+        results.put((shard, reporting.summarize(crawler, stats)))
+        crawler.close()
+        loop.close()
+
+
+def crawl(roots, workers, file=None, progress=None, address=None,
+          report_format='text', sitemaps=((), False), **kwargs):
+    """Crawl with a ShardCrawler in each of workers processes.
+
+    Each shard has a metrics.Monitor for progress and address (see
+    shard_address()), and seeds itself from sitemaps, a pair of
+    arguments for sitemap.seed().  The other keyword arguments are
+    passed on to the crawlers; a state_dir, cache_dir, warc_dir or
+    graph_dir gets a subdirectory per shard, so a crawl must be resumed
+    with the same number of workers.
+    When all shards are done their reports are merged and printed, in
+    report_format: 'text', or one of reporting.WRITERS.
+    """
+    inboxes = [multiprocessing.Queue() for _ in range(workers)]
+    outstanding = multiprocessing.Value('l', workers)
+    results = multiprocessing.Queue()
+    log_level = logging.getLogger().getEffectiveLevel()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        paths = [os.path.join(tmpdir, 'shard-%d.txt' % shard)
+                 for shard in range(workers)]
+        procs = [multiprocessing.Process(
+                     target=run_shard, name='shard-%d' % shard,
+                     args=(shard, roots, inboxes, outstanding, results,
+                           paths[shard], report_format, log_level,
+                           (progress, address), sitemaps, kwargs))
+                 for shard in range(workers)]
+        for proc in procs:
+            proc.start()
+        summaries = {}
+        lost = set()
+        while len(summaries) < workers:
+            try:
+                shard, summary = results.get(timeout=1)
+            except queue.Empty:
+                # A shard that died without a summary (and is still
+                # missing a second later) leaves the others waiting
+                # for its URLs forever.
+                dead = {shard for shard, proc in enumerate(procs)
+                        if shard not in summaries and
+                        proc.exitcode is not None}
+                if dead & lost:
+                    logger.error('shard %r died, stopping the crawl',
+                                 sorted(dead & lost))
+                    for proc in procs:
+                        proc.terminate()
+                    break
+                lost = dead
+            except KeyboardInterrupt:
+                print('\nInterrupted\n')  # The shards were, too.
+            else:
+                summaries[shard] = summary
+        for proc in procs:
+            proc.join()
+
+        writer = None
+        if report_format == 'text':
+            print('*** Report ***', file=file)
+        else:
+            writer = reporting.WRITERS[report_format](file)
+        files = [open(path) for path in paths if os.path.exists(path)]
+        try:
+            # The text reports are sorted by URL; keep them that way.
+            lines = heapq.merge(*files) if writer is None else \
+                itertools.chain(*files)
+            for line in lines:
+                print(line, end='', file=writer.file if writer else file)
+        finally:
+            for f in files:
+                f.close()
+    if summaries:
+        summary = reporting.merge_summaries(summaries.values())
+        shards = [summaries[shard]['done'] for shard in sorted(summaries)]
+        if writer is None:
+            reporting.summary_report(summary, file=file)
+            print('Shards:', ' '.join('%d' % done for done in shards),
+                  'done', file=file)
+        else:
+            summary['shards'] = shards
+            writer.write_summary(summary)
@@ -0,0 +1,207 @@
+"""A simple web crawler -- seeding the crawl from sitemaps."""
+
+import asyncio
+import calendar
+import collections
+from http.client import BadStatusLine
+import logging
+import re
+import urllib.parse
+from xml.etree import ElementTree
+import zlib
+
+import crawling
+import urlnorm
+
+logger = logging.getLogger(__name__)
+
+MAX_SIZE = 50*1024*1024  # The limit the sitemap protocol sets.
+
+_lastmod_re = re.compile(r'(\d{4})(?:-(\d\d)(?:-(\d\d)(?:T(\d\d):(\d\d)'
+                         r'(?::(\d\d)(?:\.\d+)?)?(Z|[+-]\d\d:\d\d)?)?)?)?\Z')
+
+
+def parse_lastmod(text):
+    """Return a W3C datetime (as sitemaps use) as a POSIX timestamp.
+
+    Returns None if text isn't one.  Missing parts count as their
+    lowest value, and a missing time zone as UTC.
+    """
+    m = _lastmod_re.match((text or '').strip())
+    if not m:
+        return None
+    year, month, day, hour, minute, second, zone = m.groups()
+    try:
+        timestamp = calendar.timegm((int(year), int(month or 1),
+                                     int(day or 1), int(hour or 0),
+                                     int(minute or 0), int(second or 0)))
+    except ValueError:
+        return None
+    if zone and zone != 'Z':
+        offset = int(zone[1:3]) * 3600 + int(zone[4:6]) * 60
+        timestamp -= offset if zone[0] == '+' else -offset
+    return timestamp
+
+
+class SitemapParser:
+    """Parse a sitemap or sitemap index from chunks of bytes.
+
+    Call feed() with each chunk and close() at the end.  The data may be
+    gzipped (as sitemap.xml.gz files are).  Entries are handled as
+    their elements end, and the elements are then cleared, so memory
+    doesn't grow with the size of the document.
+
+    For each page in a sitemap, on_url (if given) is called with
+    (lastmod, loc), lastmod being a timestamp or None; otherwise they
+    are collected in urls.  nurls counts them either way.  sitemaps
+    lists the sitemaps in an index.
+    """
+
+    def __init__(self, on_url=None):
+        self.parser = ElementTree.XMLPullParser(events=('end',))
+        self.decompressor = None
+        self.started = False
+        self.head = b''  # The first byte, until the second comes.
+        self.size = 0  # Uncompressed bytes so far.
+        self.on_url = on_url
+        self.urls = []
+        self.nurls = 0
+        self.sitemaps = []
+
+    def feed(self, data):
+        if not self.started:
+            # It takes two bytes to tell a gzip header.
+            data = self.head + data
+            if len(data) < 2:
+                self.head = data
+                return
+            self.started = True
+            if data[:2] == b'\x1f\x8b':
+                self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        if self.decompressor is not None:
+            data = self.decompressor.decompress(data)
+        self.size += len(data)
+        self.parser.feed(data)
+        self.collect()
+
+    def close(self):
+        if not self.started:
+            self.parser.feed(self.head)
+        if self.decompressor is not None:
+            self.parser.feed(self.decompressor.flush())
+        self.parser.close()
+        self.collect()
+
+    def collect(self):
+        for event, elem in self.parser.read_events():
+            tag = elem.tag.rpartition('}')[2]  # Ignore the namespace.
+            if tag not in ('url', 'sitemap'):
+                continue
+            loc = lastmod = None
+            for child in elem:
+                name = child.tag.rpartition('}')[2]
+                if name == 'loc':
+                    loc = (child.text or '').strip()
+                elif name == 'lastmod':
+                    lastmod = parse_lastmod(child.text)
+            if loc:
+                if tag == 'url':
+                    self.nurls += 1
+                    if self.on_url is not None:
+                        self.on_url(lastmod, loc)
+                    else:
+                        self.urls.append((lastmod, loc))
+                else:
+                    self.sitemaps.append(loc)
+            elem.clear()
+
+
+@asyncio.coroutine
+def fetch_sitemap(crawler, url, on_url=None):
+    """Fetch and parse one sitemap; return a SitemapParser, or None.
+
+    on_url is passed to the SitemapParser, so it sees each page as
+    soon as it is parsed, even if the fetch fails later on.  If the
+    document is broken or too big, what was parsed up to there is
+    returned.
+    """
+    parser = SitemapParser(on_url)
+    conn = None
+    try:
+        conn = yield from crawling.make_request(url, crawler.pool)
+        _, status, _, headers, output = yield from crawling.read_response(
+            conn)
+        if status != 200:
+            logger.warn('sitemap %r has status %r', url, status)
+            return None
+        while True:
+            chunk = yield from output.read(crawling.Fetcher.chunk_size)
+            if not chunk:
+                break
+            parser.feed(chunk)
+            if parser.size > MAX_SIZE:
+                logger.warn('sitemap %r exceeds %r bytes, truncating',
+                            url, MAX_SIZE)
+                return parser
+        parser.close()
+        if headers.get('connection', '').lower() != 'close':
+            conn.close(recycle=True)
+            conn = None
+    except (BadStatusLine, OSError, EOFError) as exc:
+        logger.warn('fetching sitemap %r raised %r', url, exc)
+        return None
+    except ElementTree.ParseError as exc:
+        logger.warn('sitemap %r is broken: %s', url, exc)
+    finally:
+        if conn is not None:
+            conn.close()
+    return parser
+
+
+@asyncio.coroutine
+def seed(crawler, sitemaps=(), discover=False, max_sitemaps=1000):
+    """Add the URLs listed in sitemaps to crawler.
+
+    Sitemap indexes are followed, up to max_sitemaps sitemaps in all.
+    If discover is true, the sitemaps listed in the robots.txt of each
+    root's host are read as well, or if there are none its /sitemap.xml.
+    Each URL is added as soon as it is parsed, with its lastmod, so a
+    sitemap of millions of URLs isn't held in memory (the crawler's
+    todo list is, of course); the crawler fetches each host's newest
+    pages first (see Crawler.url_priority).  Only URLs the crawler owns
+    (see Crawler.owns) are added.  Returns the number of URLs added.
+    """
+    todo = collections.deque(sitemaps)
+    if discover:
+        for root in crawler.roots:
+            parts = urllib.parse.urlparse(root)
+            yield from crawler.robots_allowed(root)  # Fetch robots.txt.
+            rules = crawler.robots.get(parts.netloc)
+            if rules is not None and rules.sitemaps:
+                todo.extend(rules.sitemaps)
+            else:
+                todo.append('%s://%s/sitemap.xml' %
+                            (parts.scheme, parts.netloc))
+    done = set()
+    added = 0
+
+    def add_url(lastmod, loc):
+        nonlocal added
+        if (crawler.owns(urlnorm.canonicalize(loc)) and
+                crawler.add_url(loc, lastmod=lastmod)):
+            added += 1
+
+    while todo and len(done) < max_sitemaps:
+        url = todo.popleft()
+        if url in done:
+            continue
+        done.add(url)
+        parser = yield from fetch_sitemap(crawler, url, add_url)
+        if parser is not None:
+            logger.warn('sitemap %r lists %r urls and %r sitemaps',
+                        url, parser.nurls, len(parser.sitemaps))
+            todo.extend(parser.sitemaps)
+    if todo:
+        logger.warn('not reading %r more sitemaps', len(todo))
+    logger.warn('added %r urls from %r sitemaps', added, len(done))
+    return added
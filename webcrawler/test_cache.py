@@ -0,0 +1,60 @@
+"""Tests for cache.ResponseCache."""
+
+import shutil
+import tempfile
+import unittest
+
+from cache import ResponseCache
+
+
+class TestResponseCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_put_get(self):
+        cache = ResponseCache(self.cache_dir)
+        cache.put('http://a/page', {'etag': '"v1"'}, 'text/html', 'utf-8',
+                  {'http://a/x', 'http://a/y'})
+        cache.put('http://a/img', {'last-modified': 'Tue, 02 Jan 2024'},
+                  'image/png', None, None)
+        cache.put('http://a/empty', {'etag': 'W/"e"'}, 'text/html', 'utf-8',
+                  set())
+        cache.close()
+
+        cache = ResponseCache(self.cache_dir)
+        page = cache.get('http://a/page')
+        self.assertEqual(page.urls, {'http://a/x', 'http://a/y'})
+        self.assertEqual((page.ctype, page.encoding), ('text/html', 'utf-8'))
+        self.assertEqual(page.headers(), {'If-None-Match': '"v1"'})
+        image = cache.get('http://a/img')
+        self.assertIsNone(image.urls)
+        self.assertEqual(image.headers(),
+                         {'If-Modified-Since': 'Tue, 02 Jan 2024'})
+        self.assertEqual(cache.get('http://a/empty').urls, set())
+        self.assertIsNone(cache.get('http://a/other'))
+        cache.close()
+
+    def test_no_validators(self):
+        cache = ResponseCache(self.cache_dir)
+        cache.put('http://a/page', {}, 'text/html', 'utf-8', set())
+        self.assertIsNone(cache.get('http://a/page'))
+        self.assertEqual(cache.pending_writes, 0)
+        cache.close()
+
+    def test_replace(self):
+        cache = ResponseCache(self.cache_dir)
+        cache.put('http://a/page', {'etag': '"v1"'}, 'text/html', 'utf-8',
+                  {'http://a/x'})
+        cache.put('http://a/page', {'etag': '"v2"'}, 'text/html', 'utf-8',
+                  {'http://a/z'})
+        entry = cache.get('http://a/page')
+        self.assertEqual((entry.etag, entry.urls), ('"v2"', {'http://a/z'}))
+        cache.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
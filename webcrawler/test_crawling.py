@@ -0,0 +1,638 @@
+"""Tests for crawling."""
+
+import asyncio
+import collections
+import gzip
+import hashlib
+import time
+import unittest
+import zlib
+
+import crawling
+
+
+class Server:
+    """An HTTP/1.1 server on 127.0.0.1 for a crawler to fetch from.
+
+    pages maps each path to (status, headers, body), or to a list of
+    them to answer with in turn (the last one over and over); other
+    paths get a 404.  Requests are answered in order, so several may
+    be pipelined on a connection, which is kept open unless the
+    headers say "Connection: close".  Each request is noted in
+    requests as (connection number, path).
+
+    If max_requests is set, each connection is closed without warning
+    after that many requests, as by a server that can't pipeline.
+    """
+
+    max_requests = None
+
+    def __init__(self, loop, pages, ssl=None):
+        self.loop = loop
+        self.pages = pages
+        self.requests = []
+        self.connections = 0
+        self.handlers = {}  # {task: writer, ...}
+        self.server = loop.run_until_complete(
+            asyncio.start_server(self.handle, '127.0.0.1', 0, ssl=ssl))
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.scheme = 'https' if ssl else 'http'
+
+    def url(self, path, host='127.0.0.1'):
+        return '%s://%s:%d%s' % (self.scheme, host, self.port, path)
+
+    def close(self):
+        self.server.close()
+        for writer in self.handlers.values():
+            writer.close()
+        self.loop.run_until_complete(asyncio.gather(*self.handlers))
+        self.loop.run_until_complete(self.server.wait_closed())
+
+    @asyncio.coroutine
+    def handle(self, reader, writer):
+        self.connections += 1
+        number = self.connections
+        task = asyncio.Task.current_task()
+        self.handlers[task] = writer
+        nrequests = 0
+        try:
+            while True:
+                line = yield from reader.readline()
+                if not line:
+                    break
+                while (yield from reader.readline()) not in (b'\r\n', b''):
+                    pass
+                path = line.split()[1].decode('ascii')
+                self.requests.append((number, path))
+                nrequests += 1
+                page = self.pages.get(path, (404, {}, b''))
+                if isinstance(page, list):
+                    page = page.pop(0) if len(page) > 1 else page[0]
+                status, headers, body = page
+                head = ['HTTP/1.1 %d X' % status]
+                if 'Content-Length' not in headers:
+                    head.append('Content-Length: %d' % len(body))
+                head.extend('%s: %s' % item for item in headers.items())
+                writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('ascii'))
+                writer.write(body)
+                yield from writer.drain()
+                if (headers.get('Connection') == 'close' or
+                        nrequests == self.max_requests):
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+            del self.handlers[task]
+
+
+class TestBodyHandlers(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def read_all(self, stream):
+        """Read a stream to its end, failing rather than hanging."""
+        @asyncio.coroutine
+        def read():
+            data = bytearray()
+            while True:
+                chunk = yield from stream.read(1000)
+                if not chunk:
+                    return bytes(data)
+                data.extend(chunk)
+        return self.loop.run_until_complete(asyncio.wait_for(read(), 5))
+
+    def stream(self, data, eof=True):
+        stream = asyncio.StreamReader()
+        stream.feed_data(data)
+        if eof:
+            stream.feed_eof()
+        return stream
+
+    def length(self, data, nbytes):
+        output = asyncio.StreamReader()
+        asyncio.Task(crawling.length_handler(nbytes, self.stream(data),
+                                             output))
+        return output
+
+    def decode(self, input, encoding='gzip'):
+        output = crawling.DecodedStream(encoding)
+        asyncio.Task(crawling.decode_handler(input, output))
+        return output
+
+    def test_length(self):
+        self.assertEqual(self.read_all(self.length(b'abcdef', 4)), b'abcd')
+        with self.assertRaises(EOFError):
+            self.read_all(self.length(b'ab', 4))
+
+    def test_chunked(self):
+        output = asyncio.StreamReader()
+        asyncio.Task(crawling.chunked_handler(
+            self.stream(b'3\r\nabc\r\n2;x=y\r\nde\r\n0\r\n\r\n'), output))
+        self.assertEqual(self.read_all(output), b'abcde')
+        for broken in (b'3\r\nab', b'zz\r\nabc\r\n', b'3\r\nabcXX'):
+            output = asyncio.StreamReader()
+            asyncio.Task(crawling.chunked_handler(self.stream(broken),
+                                                  output))
+            with self.assertRaises(EOFError):
+                self.read_all(output)
+
+    def test_gzip(self):
+        body = b'hello world ' * 1000
+        data = gzip.compress(body) + gzip.compress(b'more')
+        output = self.decode(self.stream(data))
+        self.assertEqual(self.read_all(output), body + b'more')
+        self.assertEqual(output.wire_bytes, len(data))
+
+    def test_deflate(self):
+        body = b'hello world ' * 1000
+        self.assertEqual(
+            self.read_all(self.decode(self.stream(zlib.compress(body)),
+                                      'deflate')), body)
+        raw = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+        data = raw.compress(body) + raw.flush()
+        self.assertEqual(
+            self.read_all(self.decode(self.stream(data), 'deflate')), body)
+
+    def test_gzip_cut_short(self):
+        # The length handler fails, and so must the decoded stream.
+        data = gzip.compress(b'hello world ' * 1000)
+        output = self.decode(self.length(data[:len(data)//2], len(data)))
+        with self.assertRaises(EOFError):
+            self.read_all(output)
+
+    def test_gzip_corrupt(self):
+        data = bytearray(gzip.compress(b'hello world ' * 1000))
+        data[20:30] = b'\xff' * 10
+        with self.assertRaises(EOFError):
+            self.read_all(self.decode(self.stream(bytes(data))))
+
+    def test_tap(self):
+        pieces = []
+        output = asyncio.StreamReader()
+        asyncio.Task(crawling.tap_handler(self.length(b'abcdef', 6), output,
+                                          pieces.append))
+        self.assertEqual(self.read_all(output), b'abcdef')
+        self.assertEqual(b''.join(pieces), b'abcdef')
+        output = asyncio.StreamReader()
+        asyncio.Task(crawling.tap_handler(self.length(b'ab', 6), output,
+                                          pieces.append))
+        with self.assertRaises(EOFError):
+            self.read_all(output)
+
+
+class TestDNSCache(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.pool = crawling.ConnectionPool(dns_ttl=60, dns_negative_ttl=10)
+
+    def tearDown(self):
+        self.pool.close()
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def resolve(self, host):
+        return self.loop.run_until_complete(self.pool.resolve(host, 80))
+
+    def test_cached(self):
+        answer = self.resolve('localhost')
+        self.assertIs(self.resolve('localhost'), answer)
+        self.assertEqual((self.pool.dns_hits, self.pool.dns_misses), (1, 1))
+
+    def test_expire(self):
+        cache = self.pool.dns_cache
+        now = time.time()
+        for i in range(100):
+            cache['old%d' % i, 80] = now - 1, []
+        cache['fresh', 80] = now + 30, []
+        self.resolve('localhost')
+        self.assertEqual(set(cache), {('fresh', 80), ('localhost', 80)})
+        # Not again until the negative TTL has passed.
+        cache['old', 80] = now - 1, []
+        self.resolve('127.0.0.1')
+        self.assertIn(('old', 80), cache)
+        self.pool.expire_dns(now + 45)
+        self.assertEqual(set(cache), {('localhost', 80), ('127.0.0.1', 80)})
+
+
+class FakeConnection:
+    """What the pool's bookkeeping looks at in a Connection."""
+
+    def __init__(self, key):
+        self.key = key
+        self.closed = False
+
+    def stale(self):
+        return self.closed
+
+    def close(self):
+        self.closed = True
+
+
+class TestConnectionPool(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.pool = crawling.ConnectionPool(max_pool=4, max_tasks=2,
+                                            idle_timeout=10)
+
+    def tearDown(self):
+        self.pool.close()
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def recycle(self, *keys):
+        conns = [FakeConnection(key) for key in keys]
+        for conn in conns:
+            self.pool.recycle_connection(conn)
+        return conns
+
+    def test_pop(self):
+        a1, a2, b1 = self.recycle('a', 'a', 'b')
+        self.assertIs(self.pool.pop_connection('a'), a2)  # The newest.
+        self.assertIs(self.pool.pop_connection('a'), a1)
+        self.assertIsNone(self.pool.pop_connection('a'))
+        self.assertEqual(list(self.pool.connections), ['b'])
+        self.assertEqual(list(self.pool.queue), [b1])
+        b1.closed = True
+        self.assertIsNone(self.pool.pop_connection('b'))  # Stale.
+        self.assertEqual((self.pool.connections, len(self.pool.queue)),
+                         ({}, 0))
+
+    def test_limits(self):
+        a1, a2, a3 = self.recycle('a', 'a', 'a')
+        # At most max_tasks per key: the oldest goes.
+        self.assertEqual(list(self.pool.connections['a']), [a2, a3])
+        self.assertTrue(a1.closed)
+        b1, c1, d1 = self.recycle('b', 'c', 'd')
+        # At most max_pool in all: the oldest of all goes.
+        self.assertTrue(a2.closed)
+        self.assertEqual(list(self.pool.queue), [a3, b1, c1, d1])
+        self.assertEqual(list(self.pool.connections['a']), [a3])
+
+    def test_reap(self):
+        a1, b1, a2 = self.recycle('a', 'b', 'a')
+        a1.idle_since -= 20
+        b1.idle_since -= 15
+        self.pool.reap()
+        self.assertEqual((a1.closed, b1.closed, a2.closed),
+                         (True, True, False))
+        self.assertEqual(list(self.pool.queue), [a2])
+        self.assertEqual(self.pool.connections, {'a': collections.deque([a2])})
+        # Recycling reaps, too.
+        a2.idle_since -= 20
+        c1, = self.recycle('c')
+        self.assertTrue(a2.closed)
+        self.assertEqual(list(self.pool.queue), [c1])
+
+    def test_reuse(self):
+        server = Server(self.loop, {})
+        try:
+            get = self.pool.get_connection
+            conn = self.loop.run_until_complete(
+                get('127.0.0.1', server.port, False))
+            conn.close(recycle=True)
+            again = self.loop.run_until_complete(
+                get('127.0.0.1', server.port, False))
+            self.assertIs(again, conn)
+            self.assertEqual((self.pool.opened, self.pool.reused), (1, 1))
+            again.close()
+        finally:
+            server.close()
+
+
+class TestRedirects(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.server = Server(self.loop, {})
+        self.url = self.server.url
+        self.crawler = None
+
+    def tearDown(self):
+        if self.crawler is not None:
+            self.crawler.close()
+        self.server.close()
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def crawl(self, roots, **kwargs):
+        self.crawler = crawling.Crawler(roots, obey_robots=False, **kwargs)
+        self.loop.run_until_complete(self.crawler.crawl())
+        return self.crawler.done
+
+    def test_claim_url(self):
+        # localhost is another host, for the same server.
+        crawler = self.crawler = crawling.Crawler(
+            [self.url('/'), self.url('/', 'localhost')])
+        fetcher = crawler.claim_url(self.url('/x'), self.url('/'), 3, 1)
+        self.assertEqual(fetcher.url, self.url('/x'))
+        self.assertEqual((fetcher.max_redirect, fetcher.depth), (3, 1))
+        self.assertIs(crawler.busy[fetcher.url], fetcher)
+        self.assertNotIn(fetcher.url, crawler.todo)
+        # Only once.
+        self.assertIsNone(crawler.claim_url(self.url('/x'), self.url('/'),
+                                            3, 1))
+        # Another host gets its turn through the todo list.
+        other = self.url('/y', 'localhost')
+        self.assertIsNone(crawler.claim_url(other, self.url('/'), 3, 1))
+        self.assertEqual(crawler.todo[other], (3, 1))
+        self.assertNotIn(other, crawler.busy)
+
+    def test_chain(self):
+        self.server.pages.update({
+            '/': (301, {'Location': '/b'}, b''),
+            '/b': (302, {'Location': self.url('/c', 'localhost')}, b''),
+            '/c': (200, {'Content-Type': 'text/html'}, b'<p>c</p>'),
+        })
+        finished = []
+        finish = crawling.scheduling.HostScheduler.finish
+
+        def record(scheduler, url):
+            finished.append(url)
+            finish(scheduler, url)
+        crawling.scheduling.HostScheduler.finish = record
+        try:
+            done = self.crawl([self.url('/'), self.url('/x', 'localhost')])
+        finally:
+            crawling.scheduling.HostScheduler.finish = finish
+        first, second = done[self.url('/')], done[self.url('/b')]
+        self.assertIs(first.redirect, second)
+        self.assertIsNone(second.redirect)
+        self.assertEqual(second.next_url, self.url('/c', 'localhost'))
+        self.assertEqual(done[self.url('/c', 'localhost')].status, 200)
+        # The scheduler saw the chain as one fetch; the redirect went on
+        # the first one's connection.
+        self.assertEqual(sorted(finished),
+                         [self.url('/'), self.url('/c', 'localhost'),
+                          self.url('/x', 'localhost')])
+        connections = {path: number
+                       for number, path in self.server.requests}
+        self.assertEqual(connections['/b'], connections['/'])
+
+    def test_other_host(self):
+        self.server.pages.update({
+            '/': (301, {'Location': self.url('/c', 'localhost')}, b''),
+            '/c': (200, {'Content-Type': 'text/html'}, b'<p>c</p>'),
+        })
+        done = self.crawl([self.url('/'), self.url('/x', 'localhost')])
+        self.assertIsNone(done[self.url('/')].redirect)
+        self.assertEqual(done[self.url('/c', 'localhost')].status, 200)
+
+    def test_limit(self):
+        self.server.pages['/'] = (301, {'Location': '/b'}, b'')
+        done = self.crawl([self.url('/')], max_redirect=0)
+        self.assertIsNone(done[self.url('/')].redirect)
+        self.assertEqual(done[self.url('/')].next_url, self.url('/b'))
+        self.assertNotIn(self.url('/b'), done)
+        self.assertEqual(self.server.requests, [(1, '/')])
+
+class TestPipelining(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        links = ''.join('<a href="/%d">%d</a>' % (i, i) for i in range(4))
+        html = {'Content-Type': 'text/html'}
+        self.server = Server(self.loop, {
+            '/': (200, html, links.encode('ascii')),
+            '/0': (200, html, b'<p>0</p>'),
+            '/1': (200, html, b'<p>big</p>' * 10000),
+            '/2': (200, html, b'<p>2</p>'),
+            '/3': (200, html, b'<p>3</p>'),
+        })
+        self.crawler = None
+
+    def tearDown(self):
+        if self.crawler is not None:
+            self.crawler.close()
+        self.server.close()
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def crawl(self, **kwargs):
+        self.crawler = crawling.Crawler(
+            [self.server.url('/')], obey_robots=False, pipeline=4,
+            retry_policy=crawling.scheduling.RetryPolicy(base=0.01), **kwargs)
+        self.loop.run_until_complete(self.crawler.crawl())
+        return self.crawler.done
+
+    def test_truncated(self):
+        # Cutting a body short ends the pipeline, but isn't a failure.
+        done = self.crawl(max_body=1000)
+        self.assertTrue(done[self.server.url('/1')].truncated)
+        self.assertEqual({fetcher.status for fetcher in done.values()},
+                         {200})
+        self.assertEqual(self.crawler.pool.no_pipeline, set())
+        self.assertGreater(self.crawler.pool.pipelined_requests, 0)
+
+    def test_pipelined(self):
+        done = self.crawl()
+        self.assertEqual(len(done), 5)
+        self.assertEqual({fetcher.status for fetcher in done.values()},
+                         {200})
+        self.assertEqual(self.crawler.pool.no_pipeline, set())
+        # The links went out together, on the root's connection.
+        self.assertEqual(self.crawler.pool.pipelined_requests, 3)
+        self.assertEqual(self.server.connections, 1)
+        self.assertEqual(sorted(self.server.requests),
+                         [(1, path) for path in ('/', '/0', '/1', '/2',
+                                                 '/3')])
+
+    def test_fallback(self):
+        # A server that drops pipelined requests is no longer pipelined
+        # to, and the lost requests are retried.
+        self.server.max_requests = 2
+        done = self.crawl()
+        self.assertEqual({fetcher.status for fetcher in done.values()},
+                         {200})
+        self.assertEqual(self.crawler.pool.no_pipeline,
+                         {('127.0.0.1', self.server.port, False)})
+        retried = [url for url, fetcher in done.items() if fetcher.tries > 1]
+        self.assertTrue(retried)
+        for url in retried:
+            self.assertIsInstance(done[url].exceptions[0], OSError)
+
+    def test_release_slot(self):
+        pool = crawling.ConnectionPool(pipeline=3)
+        get = pool.get_connection
+        origin = '127.0.0.1', self.server.port, False
+        conn = self.loop.run_until_complete(get(*origin))
+        self.assertNotIsInstance(conn, crawling.PipelineSlot)
+        conn.close(recycle=True)
+        # A pooled connection takes up to three requests at once.
+        slots = [self.loop.run_until_complete(get(*origin))
+                 for _ in range(3)]
+        self.assertIs(slots[1].conn, slots[0].conn)
+        self.assertEqual([slot.turn.done() for slot in slots],
+                         [True, False, False])
+        self.assertEqual(pool.pipelines[origin], [conn])
+        # Reading a response in full lets the next one have its turn.
+        slots[0].close(recycle=True)
+        self.assertTrue(slots[1].turn.done())
+        # Closing one ends the pipeline; the rest fail.
+        slots[1].close()
+        with self.assertRaises(crawling.PipelineError):
+            slots[2].turn.result()
+        self.assertIsNone(conn.writer)
+        self.assertEqual((pool.pipelines, pool.no_pipeline), ({}, set()))
+        slots[2].close()  # No-op.
+        # A broken one also stops pipelining there.
+        conn = self.loop.run_until_complete(get(*origin))
+        conn.close(recycle=True)
+        slots = [self.loop.run_until_complete(get(*origin))
+                 for _ in range(2)]
+        slots[0].close(broken=True)
+        self.assertEqual(pool.no_pipeline, {origin})
+        with self.assertRaises(crawling.PipelineError):
+            slots[1].turn.result()
+        conn = self.loop.run_until_complete(get(*origin))
+        self.assertNotIsInstance(conn, crawling.PipelineSlot)
+        conn.close(recycle=True)
+        self.assertNotIsInstance(self.loop.run_until_complete(get(*origin)),
+                                 crawling.PipelineSlot)
+        pool.close()
+
+
+class TestRetry(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.server = Server(self.loop, {})
+        self.url = self.server.url('/')
+        self.crawler = crawling.Crawler(
+            [self.url], obey_robots=False,
+            retry_policy=crawling.scheduling.RetryPolicy(
+                base=0.05, jitter=0, max_retry_after=60))
+
+    def tearDown(self):
+        self.crawler.close()
+        self.server.close()
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def test_retry(self):
+        crawler, url = self.crawler, self.url
+        self.assertEqual(crawler.scheduler.pop(), (url, None))
+        fetcher = crawling.Fetcher(url, crawler)
+        crawler.busy[url] = fetcher
+        fetcher.retry_delay = 5
+        fetcher.retry_after = 3600
+        now = time.time()
+        crawler.retry(fetcher)
+        crawler.scheduler.finish(url)
+        self.assertEqual(crawler.todo, {url: (10, 0)})
+        self.assertEqual((crawler.busy, crawler.retrying),
+                         ({}, {url: fetcher}))
+        # It waits out its delay off the host's queue...
+        self.assertEqual(crawler.scheduler.queues, {})
+        not_before, _, waiting, _ = crawler.scheduler.waiting[0]
+        self.assertEqual(waiting, url)
+        self.assertAlmostEqual(not_before, now + 5, delta=1)
+        # ...and the host is paused for the Retry-After, up to its limit.
+        host = crawling.scheduling.host_key(url)
+        self.assertAlmostEqual(crawler.scheduler.next_start[host], now + 60,
+                               delta=1)
+        self.assertEqual(crawler.scheduler.pop()[0], None)
+
+    def test_crawl(self):
+        self.server.pages['/'] = [
+            (503, {'Retry-After': '0'}, b''),
+            (500, {}, b''),
+            (200, {'Content-Type': 'text/html'}, b'<p>ok</p>'),
+        ]
+        t0 = time.time()
+        self.loop.run_until_complete(self.crawler.crawl())
+        fetcher = self.crawler.done[self.url]
+        self.assertEqual((fetcher.status, fetcher.tries), (200, 3))
+        self.assertEqual([exc.__class__.__name__
+                          for exc in fetcher.exceptions],
+                         ['RetryableStatus'] * 2)
+        self.assertEqual(self.crawler.retrying, {})
+        # Backoff: 0.05 secs, then 0.1 secs.
+        self.assertGreaterEqual(time.time() - t0, 0.15)
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual((self.crawler.metrics.fetches,
+                          self.crawler.metrics.retries), (1, 2))
+
+
+class TestReadBody(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.server = Server(self.loop, {})
+        self.crawler = crawling.Crawler([self.server.url('/')],
+                                        obey_robots=False, max_body=1000)
+
+    def tearDown(self):
+        self.crawler.close()
+        self.server.close()
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def read_body(self, body, chunk_size=100):
+        fetcher = crawling.Fetcher(self.server.url('/'), self.crawler)
+        fetcher.chunk_size = chunk_size
+        fetcher.status = 200
+        fetcher.ctype, fetcher.encoding = 'text/html', 'utf-8'
+        stream = asyncio.StreamReader()
+        stream.feed_data(body)
+        stream.feed_eof()
+        self.loop.run_until_complete(fetcher.read_body(stream))
+        return fetcher
+
+    def test_whole(self):
+        body = b'<a href="/1">1</a>' + b' ' * 900 + b'<a href="/2">2</a>'
+        fetcher = self.read_body(body)
+        self.assertEqual((fetcher.size, fetcher.truncated), (len(body), False))
+        self.assertEqual(fetcher.digest, hashlib.sha1(body).hexdigest())
+        self.assertEqual(fetcher.urls, {self.server.url('/1'),
+                                        self.server.url('/2')})
+
+    def test_truncated(self):
+        body = b'<a href="/1">1</a>' + b' ' * 990 + b'<a href="/2">2</a>'
+        for chunk_size in (100, 999, 64*1024):
+            fetcher = self.read_body(body, chunk_size)
+            self.assertEqual((fetcher.size, fetcher.truncated), (1000, True))
+            self.assertEqual(fetcher.digest,
+                             hashlib.sha1(body[:1000]).hexdigest())
+            # Only the links in what was read.
+            self.assertEqual(fetcher.urls, {self.server.url('/1')})
+
+    def test_crawl(self):
+        html = {'Content-Type': 'text/html'}
+        self.server.pages.update({
+            '/': (200, html, b'<a href="/big">x</a><img src="/img">'),
+            '/big': (200, html, b'<a href="/more">x</a>' * 100),
+            '/img': (200, {'Content-Type': 'image/png'}, b'\x89PNG' * 1000),
+            '/more': (200, html, b'<p>more</p>'),
+        })
+        self.crawler.follow_src = True
+        self.loop.run_until_complete(self.crawler.crawl())
+        done = self.crawler.done
+        big = done[self.server.url('/big')]
+        self.assertEqual((big.size, big.truncated), (1000, True))
+        self.assertEqual(big.urls, {self.server.url('/more')})
+        # An image isn't read at all; its connection is closed.
+        image = done[self.server.url('/img')]
+        self.assertEqual((image.status, image.ctype), (200, 'image/png'))
+        self.assertIsNone(image.size)
+        self.assertEqual(len(done), 4)
+        # Neither connection was put back in the pool.
+        self.assertEqual(self.crawler.pool.opened, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+"""Tests for dedup.Fingerprinter and dedup.DuplicateIndex."""
+
+import random
+import unittest
+
+from dedup import DuplicateIndex, Fingerprinter
+
+
+def text(seed, n=300):
+    """Return n words of pseudo-random text."""
+    rng = random.Random(seed)
+    return ' '.join('w%d' % rng.randrange(1000) for _ in range(n))
+
+
+def simhash(html, chunk=None):
+    data = html.encode('utf-8')
+    fingerprinter = Fingerprinter()
+    chunk = chunk or len(data) or 1
+    for i in range(0, len(data), chunk):
+        fingerprinter.feed(data[i:i+chunk])
+    return fingerprinter.close()
+
+
+def distance(a, b):
+    return bin(a ^ b).count('1')
+
+
+class TestFingerprinter(unittest.TestCase):
+
+    def test_too_short(self):
+        self.assertIsNone(simhash('<p>only a few words here</p>'))
+
+    def test_markup_ignored(self):
+        words = text(1)
+        plain = simhash(words)
+        self.assertEqual(simhash('<html><head><style>p { x: "%s" }</style>'
+                                 '<script>var s = "%s";</script></head>'
+                                 '<body><!-- %s --><p class="x">%s</p>'
+                                 '</body></html>' %
+                                 (text(2), text(3), text(4), words)),
+                         plain)
+
+    def test_case_and_entities(self):
+        self.assertEqual(simhash(text(1).upper().replace(' ', '&#32;')),
+                         simhash(text(1)))
+
+    def test_chunks(self):
+        html = ('<p>%s</p><script>"%s"</script><!-- x -->'
+                '<p>1 < 2 and %s</p>' % (text(1), text(2), text(3)))
+        expected = simhash(html)
+        for chunk in (1, 2, 3, 7, 64, 100, 1000):
+            self.assertEqual(simhash(html, chunk), expected, chunk)
+
+    def test_bare_less_than(self):
+        # "<" followed by a space isn't a tag, so the text is all there.
+        self.assertEqual(simhash('a < b ' + text(1)),
+                         simhash('a b ' + text(1)))
+
+    def test_long_script(self):
+        html = ('<p>%s</p><script>%s</script><p>%s</p>' %
+                (text(1), 'var x = "<a>";\n' * 100000, text(2)))
+        self.assertEqual(simhash(html, 4096),
+                         simhash('<p>%s</p><p>%s</p>' % (text(1), text(2))))
+
+    def test_long_unclosed_tag(self):
+        # Skipped once it's too long to be a tag, not rescanned each chunk.
+        html = ('<p>%s</p><img alt="%s">%s' %
+                (text(1), 'x <b y <a ' * 100000, text(2)))
+        self.assertEqual(simhash(html, 1000),
+                         simhash('<p>%s</p>%s' % (text(1), text(2))))
+
+    def test_comment_end_before_unclosed(self):
+        # The end of a comment that came before one isn't taken as its end.
+        html = '<p>%s</p><!-- a --><!-- %s -->%s' % (text(1), text(2),
+                                                     text(3))
+        cut = html.index('<!-- w')
+        expected = simhash('<p>%s</p>%s' % (text(1), text(3)))
+        self.assertEqual(simhash(html, cut + 4), expected)
+
+    def test_near_and_far(self):
+        words = text(1, 1000).split()
+        edited = list(words)
+        edited[500] = 'changed'
+        self.assertLessEqual(distance(simhash(' '.join(words)),
+                                      simhash(' '.join(edited))), 3)
+        self.assertGreater(distance(simhash(text(1, 1000)),
+                                    simhash(text(2, 1000))), 10)
+
+
+class TestDuplicateIndex(unittest.TestCase):
+
+    def test_exact(self):
+        index = DuplicateIndex(0)
+        self.assertIsNone(index.check('http://a/1', 'd1', 0))
+        self.assertEqual(index.check('http://a/2', 'd1', 12345), 'http://a/1')
+        self.assertIsNone(index.check('http://a/3', 'd2', 1))
+        self.assertEqual(len(index), 2)
+
+    def test_near(self):
+        index = DuplicateIndex(3)
+        base = 0x0123456789abcdef
+        self.assertIsNone(index.check('http://a/1', 'd1', base))
+        self.assertEqual(index.check('http://a/2', 'd2', base ^ 0b10101),
+                         'http://a/1')
+        self.assertIsNone(index.check('http://a/3', 'd3', base ^ 0b1111))
+        # Duplicates point at the original, and aren't remembered.
+        self.assertEqual(len(index), 2)
+
+    def test_blocks(self):
+        # Differences spread over every block but one are still found.
+        index = DuplicateIndex(3)
+        base = random.Random(1).getrandbits(64)
+        index.add('http://a/1', 'd1', base)
+        flipped = base ^ (1 << 0) ^ (1 << 20) ^ (1 << 40)
+        self.assertEqual(index.check('http://a/2', 'd2', flipped),
+                         'http://a/1')
+
+    def test_no_simhash(self):
+        index = DuplicateIndex(3)
+        index.add('http://a/1', 'd1', None)
+        self.assertIsNone(index.check('http://a/2', 'd2', None))
+
+
+if __name__ == '__main__':
+    unittest.main()
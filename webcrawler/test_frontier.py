@@ -0,0 +1,159 @@
+"""Tests for frontier.FrontierStore and frontier.DoneTable."""
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from frontier import FrontierStore
+
+
+class FakeFetcher:
+    """Just what DoneTable stores."""
+
+    def __init__(self, url, status=200, **kwargs):
+        self.url = url
+        self.status = status
+        self.tries = 1
+        self.exceptions = []
+        self.next_url = None
+        self.ctype = 'text/html'
+        self.encoding = 'utf-8'
+        self.size = self.wire_size = 100
+        self.digest = 'd-' + url
+        self.truncated = False
+        self.urls = {'http://a/x', 'http://a/y'}
+        self.new_urls = {'http://a/x'}
+        self.simhash = None
+        self.duplicate_of = None
+        self.__dict__.update(kwargs)
+
+
+class TestFrontierStore(unittest.TestCase):
+
+    def setUp(self):
+        self.state_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.state_dir)
+
+    def test_resume(self):
+        store = FrontierStore(self.state_dir)
+        store.add('http://a/', None, 0)
+        store.add('http://a/1', 10, 1)
+        store.add('http://a/2', 10, 1)
+        store.done['http://a/'] = FakeFetcher('http://a/')
+        store.close()
+
+        store = FrontierStore(self.state_dir)
+        self.assertEqual(store.todo(), {'http://a/1': (10, 1),
+                                        'http://a/2': (10, 1)})
+        self.assertEqual(sorted(store.urls()),
+                         ['http://a/', 'http://a/1', 'http://a/2'])
+        self.assertEqual(len(store.done), 1)
+        self.assertIn('http://a/', store.done)
+        self.assertNotIn('http://a/1', store.done)
+        store.close()
+
+    def test_checkpoint(self):
+        store = FrontierStore(self.state_dir, checkpoint_every=2)
+        for i in range(3):
+            store.add('http://a/%d' % i, 10)
+        store.db.close()  # A crash: the last write isn't committed.
+        store = FrontierStore(self.state_dir)
+        self.assertEqual(len(store.todo()), 2)
+        store.close()
+
+    def test_done_records(self):
+        store = FrontierStore(self.state_dir)
+        store.done['http://a/page'] = FakeFetcher(
+            'http://a/page', simhash=0x0123456789abcdef,
+            duplicate_of='http://a/original')
+        store.done['http://a/moved'] = FakeFetcher(
+            'http://a/moved', 301, next_url='http://a/page', urls=None,
+            new_urls=None, ctype=None)
+        store.done['http://a/down'] = FakeFetcher(
+            'http://a/down', None, tries=3, ctype=None, urls=None,
+            new_urls=None, exceptions=[OSError('refused')] * 3)
+        records = dict(store.done.items())
+        self.assertEqual(list(records),
+                         ['http://a/down', 'http://a/moved', 'http://a/page'])
+        page = records['http://a/page']
+        self.assertEqual((page.status, page.ctype, page.size, page.digest),
+                         (200, 'text/html', 100, 'd-http://a/page'))
+        self.assertEqual((len(page.urls), len(page.new_urls)), (2, 1))
+        self.assertEqual(page.simhash, 0x0123456789abcdef)
+        self.assertEqual(page.duplicate_of, 'http://a/original')
+        self.assertFalse(page.truncated)
+        self.assertEqual(records['http://a/moved'].next_url, 'http://a/page')
+        self.assertIsNone(records['http://a/moved'].urls)
+        down = records['http://a/down']
+        self.assertEqual(len(down.exceptions), 3)
+        self.assertEqual(down.exceptions[-1].__class__.__name__, 'OSError')
+        self.assertEqual(str(down.exceptions[-1]), 'refused')
+        store.close()
+
+    def test_done_len(self):
+        store = FrontierStore(self.state_dir)
+        store.done['http://a/1'] = FakeFetcher('http://a/1')
+        store.done['http://a/2'] = FakeFetcher('http://a/2')
+        store.done['http://a/1'] = FakeFetcher('http://a/1', 404)
+        self.assertEqual(len(store.done), 2)
+        store.close()
+        store = FrontierStore(self.state_dir)
+        self.assertEqual(len(store.done), 2)
+        store.done['http://a/3'] = FakeFetcher('http://a/3')
+        self.assertEqual(len(store.done), 3)
+        records = [record for _, record in store.done.items()]
+        records[0].timings['fetch'] = 1.0
+        self.assertEqual(records[1].timings, {})
+        store.close()
+
+    def test_originals(self):
+        store = FrontierStore(self.state_dir)
+        store.done['http://a/1'] = FakeFetcher('http://a/1', simhash=5)
+        store.done['http://a/2'] = FakeFetcher('http://a/2',
+                                               duplicate_of='http://a/1')
+        store.done['http://a/3'] = FakeFetcher('http://a/3', truncated=True)
+        store.done['http://a/4'] = FakeFetcher('http://a/4',
+                                               ctype='image/png')
+        self.assertEqual(list(store.originals()),
+                         [('http://a/1', 'd-http://a/1', 5)])
+        store.close()
+
+    def test_old_database(self):
+        # A database as first written, before depth, wire_size, digest,
+        # truncated, simhash and duplicate_of.
+        db = sqlite3.connect(os.path.join(self.state_dir, 'frontier.db'))
+        db.execute('CREATE TABLE todo (url TEXT PRIMARY KEY,'
+                   ' max_redirect INTEGER)')
+        db.execute('CREATE TABLE done (url TEXT PRIMARY KEY, status INTEGER,'
+                   ' tries INTEGER, error TEXT, next_url TEXT, ctype TEXT,'
+                   ' encoding TEXT, size INTEGER, nurls INTEGER,'
+                   ' nnew INTEGER)')
+        db.execute("INSERT INTO todo VALUES ('http://a/1', 10)")
+        db.execute("INSERT INTO done VALUES ('http://a/', 200, 1, NULL, NULL,"
+                   " 'text/html', 'utf-8', 50, 4, 3)")
+        db.commit()
+        db.close()
+        store = FrontierStore(self.state_dir)
+        self.assertEqual(store.todo(), {'http://a/1': (10, 0)})
+        store.add('http://a/2', 10, 2)
+        self.assertEqual(store.todo()['http://a/2'], (10, 2))
+        store.done['http://a/1'] = FakeFetcher('http://a/1', simhash=1,
+                                               truncated=True)
+        records = dict(store.done.items())
+        old = records['http://a/']
+        self.assertEqual((old.size, old.wire_size, old.digest, old.simhash),
+                         (50, None, None, None))
+        self.assertEqual((len(old.urls), len(old.new_urls)), (4, 3))
+        new = records['http://a/1']
+        self.assertEqual((new.wire_size, new.digest, new.simhash),
+                         (100, 'd-http://a/1', 1))
+        self.assertTrue(new.truncated)
+        self.assertEqual((len(new.urls), len(new.new_urls)), (2, 1))
+        store.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,154 @@
+"""Tests for graph."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import graph
+
+
+class FakeFetcher:
+    """Just what LinkGraph.add_page() looks at."""
+
+    def __init__(self, url, urls=(), next_url=None):
+        self.url = url
+        self.urls = set(urls)
+        self.next_url = next_url
+
+
+def build(pages):
+    """Return a LinkGraph of pages, a list of (url, [link, ...])."""
+    link_graph = graph.LinkGraph()
+    for url, links in pages:
+        link_graph.add_page(FakeFetcher(url, links))
+    return link_graph
+
+
+def links(urls, indptr, indices):
+    """Return {url: {url it links to, ...}, ...} for a graph in CSR form."""
+    return {urls[i]: {urls[j] for j in indices[indptr[i]:indptr[i+1]]}
+            for i in range(len(urls))}
+
+
+class TestLinkGraph(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_csr(self):
+        link_graph = build([
+            ('http://a/', ['http://a/1', 'http://A/2#x', 'mailto:x@a',
+                           'http://a/']),
+            ('http://a/2', ['http://a/1']),
+            ('http://a/lonely', []),
+        ])
+        link_graph.add_page(FakeFetcher('http://a/old',
+                                        next_url='http://a/new'))
+        self.assertEqual(link_graph.urls[0], 'http://a/')
+        self.assertEqual(len(link_graph), 5)  # Not the page without links.
+        self.assertEqual(links(link_graph.urls, *link_graph.csr()), {
+            'http://a/': {'http://a/1', 'http://a/2'},
+            'http://a/1': set(),
+            'http://a/2': {'http://a/1'},
+            'http://a/old': {'http://a/new'},
+            'http://a/new': set(),
+        })
+
+    def test_save_load(self):
+        link_graph = build([('http://a/', ['http://a/1', 'http://a/%E9']),
+                            ('http://a/1', ['http://a/'])])
+        link_graph.save(self.directory)
+        urls, indptr, indices = graph.load(self.directory)
+        self.assertEqual(urls, link_graph.urls)
+        self.assertEqual((indptr, indices), link_graph.csr())
+        # A resumed crawl carries on with the saved graph.
+        resumed = graph.LinkGraph(self.directory)
+        resumed.add_page(FakeFetcher('http://a/%E9', ['http://a/2']))
+        self.assertEqual(links(resumed.urls, *resumed.csr()), {
+            'http://a/': {'http://a/1', 'http://a/%E9'},
+            'http://a/1': {'http://a/'},
+            'http://a/%E9': {'http://a/2'},
+            'http://a/2': set(),
+        })
+
+    def test_merge(self):
+        paths = [self.directory + '/1', self.directory + '/2']
+        build([('http://a/', ['http://b/', 'http://a/1'])]).save(paths[0])
+        build([('http://b/', ['http://a/']),
+               ('http://a/', ['http://b/', 'http://c/'])]).save(paths[1])
+        self.assertEqual(links(*graph.merge(paths)), {
+            'http://a/': {'http://b/', 'http://a/1', 'http://c/'},
+            'http://b/': {'http://a/'},
+            'http://a/1': set(),
+            'http://c/': set(),
+        })
+
+
+class TestPageRank(unittest.TestCase):
+
+    def graphs(self):
+        """Yield (indptr, indices) for a few small graphs."""
+        # A cycle of three.
+        yield [0, 1, 2, 3], [1, 2, 0]
+        # 0 and 2 link to 1, which links nowhere.
+        yield [0, 1, 1, 2], [1, 1]
+        # 0 links to everyone; 3 to 0.
+        yield [0, 3, 3, 3, 4], [1, 2, 3, 0]
+
+    def pagerank(self, indptr, indices, use_numpy):
+        saved = graph.numpy
+        if not use_numpy:
+            graph.numpy = None
+        try:
+            return [float(rank) for rank in graph.pagerank(indptr, indices)]
+        finally:
+            graph.numpy = saved
+
+    def test_pagerank(self):
+        for use_numpy in (False, True):
+            if use_numpy and graph.numpy is None:
+                continue
+            ranks = [self.pagerank(indptr, indices, use_numpy)
+                     for indptr, indices in self.graphs()]
+            for rank in ranks:
+                self.assertAlmostEqual(sum(rank), 1.0)
+            for rank in ranks[0]:
+                self.assertAlmostEqual(rank, 1 / 3)
+            self.assertGreater(ranks[1][1], ranks[1][0])
+            self.assertAlmostEqual(ranks[1][0], ranks[1][2])
+            self.assertGreater(ranks[2][0], ranks[2][1])
+            self.assertEqual(self.pagerank([0], [], use_numpy), [])
+
+    def test_in_degree(self):
+        self.assertEqual(list(graph.in_degree([0, 3, 3, 3, 4], [1, 2, 3, 0])),
+                         [1, 1, 1, 1])
+        self.assertEqual(list(graph.in_degree([0, 1, 1, 2], [1, 1])),
+                         [0, 2, 0])
+
+
+class TestScorePriority(unittest.TestCase):
+
+    def test_order(self):
+        priority = graph.ScorePriority({'http://a/': 0.5, 'http://a/1': 0.1})
+        self.assertLess(priority('http://a/', 3), priority('http://a/1', 0))
+        # Unknown URLs count as average, then by depth.
+        self.assertLess(priority('http://a/x', 1), priority('http://a/1', 0))
+        self.assertLess(priority('http://a/x', 1), priority('http://a/y', 2))
+        self.assertEqual(graph.ScorePriority({})('http://a/', 1), (0.0, 1))
+
+    def test_load_scores(self):
+        with tempfile.NamedTemporaryFile('w', delete=False) as f:
+            f.write('http://a/\t0.5\t3\nhttp://a/1\t0.25\t1\n')
+        try:
+            self.assertEqual(graph.load_scores(f.name),
+                             {'http://a/': 0.5, 'http://a/1': 0.25})
+        finally:
+            os.unlink(f.name)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+"""Tests for links.LinkExtractor."""
+
+import unittest
+
+from links import LinkExtractor
+
+
+def extract(html, url='http://example.com/dir/page', chunk=None,
+            follow_src=False, encoding='utf-8'):
+    """Feed html to a LinkExtractor, in chunks of chunk bytes if given."""
+    data = html.encode(encoding)
+    extractor = LinkExtractor(url, encoding, follow_src)
+    chunk = chunk or len(data) or 1
+    for i in range(0, len(data), chunk):
+        extractor.feed(data[i:i+chunk])
+    return extractor.close()
+
+
+class TestLinkExtractor(unittest.TestCase):
+
+    def test_href(self):
+        self.assertEqual(
+            extract('<a href="/a">x</a> <A HREF=\'b\'>y</A> <a href=c#f>'),
+            {'http://example.com/a', 'http://example.com/dir/b',
+             'http://example.com/dir/c'})
+
+    def test_unescape(self):
+        self.assertEqual(extract('<a href="/q?a=1&amp;b=2">'),
+                         {'http://example.com/q?a=1&b=2'})
+
+    def test_base(self):
+        self.assertEqual(
+            extract('<base href="http://other.org/x/"><base href="/no/">'
+                    '<a href="y">'),
+            {'http://other.org/x/y'})
+
+    def test_comments_scripts_styles(self):
+        html = ('<!-- <a href="/c"> --><script>"<a href=/s>"</script>'
+                '<style>a[href="/t"] {}</style><a href="/ok">')
+        self.assertEqual(extract(html), {'http://example.com/ok'})
+
+    def test_src(self):
+        html = ('<img src="/i.png" srcset="/1x.png 1x, /2x.png 2x">'
+                '<script src="/s.js"></script>')
+        self.assertEqual(extract(html), set())
+        self.assertEqual(extract(html, follow_src=True),
+                         {'http://example.com/i.png',
+                          'http://example.com/1x.png',
+                          'http://example.com/2x.png',
+                          'http://example.com/s.js'})
+
+    def test_data_attributes(self):
+        html = '<a data-href="/no" href="/yes"><img data-src="/no2">'
+        self.assertEqual(extract(html, follow_src=True),
+                         {'http://example.com/yes'})
+
+    def test_chunks(self):
+        html = ('<html><!-- <a href="/c"> --><a href="/one">1</a>'
+                '<script type="text/javascript">x = "<a href=/s>";</script>'
+                '<a\nhref="/two">2</a><style>p {}</style >'
+                '<a href="/%C3%A9">é</a></html>')
+        expected = extract(html)
+        self.assertEqual(expected, {'http://example.com/one',
+                                    'http://example.com/two',
+                                    'http://example.com/%C3%A9'})
+        for chunk in range(1, 20):
+            self.assertEqual(extract(html, chunk=chunk), expected, chunk)
+
+    def test_unclosed_script(self):
+        html = '<a href="/a"><script>var s = "<a href=/no>";'
+        self.assertEqual(extract(html, chunk=7), {'http://example.com/a'})
+
+    def test_long_script(self):
+        # Only new data is searched for the end tag, so this is quick.
+        html = ('<a href="/a"><script>' + 'x = "<a href=/no>";\n' * 100000 +
+                '</script><a href="/b">')
+        self.assertEqual(extract(html, chunk=4096),
+                         {'http://example.com/a', 'http://example.com/b'})
+
+    def test_unclosed_comment(self):
+        # Each chunk is only searched for the '-->', so this is quick.
+        html = '<a href="/a"><!--' + '<a href="/no">\n' * 100000
+        self.assertEqual(extract(html, chunk=1000), {'http://example.com/a'})
+        html += '--><a href="/b">'
+        self.assertEqual(extract(html, chunk=1000),
+                         {'http://example.com/a', 'http://example.com/b'})
+
+    def test_comment_end_split(self):
+        html = '<!-- x --><a href="/a"><!-- <a href="/no"> --><a href="/b">'
+        for chunk in range(1, 12):
+            self.assertEqual(extract(html, chunk=chunk),
+                             {'http://example.com/a',
+                              'http://example.com/b'}, chunk)
+
+    def test_unclosed_tags(self):
+        html = ('<a href="/a"><img alt="' + 'x <b y ' * 100000 +
+                '"><a href="/b"> 1 < 2 <a href="/c"')
+        self.assertEqual(extract(html, chunk=1000),
+                         {'http://example.com/a', 'http://example.com/b'})
+        html = '<a href="/a">' + 'x <b y ' * 100000
+        self.assertEqual(extract(html, chunk=1000), {'http://example.com/a'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+"""Tests for metrics.Histogram and metrics.Metrics."""
+
+import json
+import shutil
+import tempfile
+import unittest
+
+from frontier import FrontierStore
+from metrics import Histogram, Metrics
+
+
+class FakeFetcher:
+    """Just what Metrics.record() looks at."""
+
+    def __init__(self, url, status, size=100, timings=None, retry_delay=None):
+        self.url = url
+        self.status = status
+        self.tries = 1
+        self.retry_delay = retry_delay
+        self.disallowed = False
+        self.size = size
+        self.wire_size = size // 2
+        self.timings = timings or {}
+
+
+class TestHistogram(unittest.TestCase):
+
+    def test_percentile(self):
+        histogram = Histogram()
+        for i in range(1, 101):
+            histogram.add(i / 100)
+        self.assertEqual(histogram.count, 100)
+        self.assertEqual(histogram.max, 1.0)
+        for p, value in ((50, 0.5), (90, 0.9), (100, 1.0)):
+            self.assertGreaterEqual(histogram.percentile(p), value)
+            self.assertLessEqual(histogram.percentile(p), value * 1.1)
+
+    def test_state(self):
+        histogram = Histogram()
+        for value in (0.00001, 0.01, 0.5, 3.0, 1e9):
+            histogram.add(value)
+        copy = Histogram()
+        copy.restore(json.loads(json.dumps(histogram.state())))
+        self.assertEqual(copy.buckets, histogram.buckets)
+        self.assertEqual((copy.count, copy.total, copy.max),
+                         (histogram.count, histogram.total, histogram.max))
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_retries(self):
+        # Each URL counts once, with its final outcome.
+        metrics = Metrics()
+        for status in (503, None):
+            metrics.record(FakeFetcher('http://a/1', status, retry_delay=1),
+                           0.1)
+        metrics.record(FakeFetcher('http://a/1', 200), 0.1)
+        metrics.record(FakeFetcher('http://a/2', 404), 0.1)
+        self.assertEqual((metrics.fetches, metrics.retries), (2, 2))
+        self.assertEqual(metrics.statuses, {'200': 1, '404': 1})
+        self.assertEqual(metrics.latency.count, 4)
+        self.assertEqual(metrics.bytes, 400)
+
+
+class TestMetricsState(unittest.TestCase):
+
+    def setUp(self):
+        self.state_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.state_dir)
+
+    def test_resume(self):
+        store = FrontierStore(self.state_dir)
+        metrics = Metrics()
+        store.on_checkpoint = lambda: store.save('metrics', metrics.state())
+        metrics.record(FakeFetcher('http://a/1', 200, timings={'dns': 0.01}),
+                       0.1)
+        metrics.record(FakeFetcher('http://a/2', None), 0.2)
+        metrics.record(FakeFetcher('http://a/3', 503, retry_delay=1), 0.2)
+        store.add('http://a/3', 10)
+        store.close()
+
+        store = FrontierStore(self.state_dir)
+        resumed = Metrics()
+        resumed.restore(store.load('metrics'))
+        resumed.record(FakeFetcher('http://a/3', 200,
+                                   timings={'dns': 0.02, 'ttfb': 0.05}), 0.3)
+        self.assertEqual((resumed.fetches, resumed.retries), (3, 1))
+        self.assertEqual(resumed.bytes, 400)
+        self.assertEqual(resumed.statuses, {'200': 2, 'fail': 1})
+        self.assertEqual(resumed.latency.count, 4)
+        self.assertEqual(resumed.phases['dns'].count, 2)
+        self.assertEqual(resumed.phases['ttfb'].count, 1)
+        self.assertIsNone(store.load('nothing'))
+        store.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
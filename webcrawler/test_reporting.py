@@ -0,0 +1,164 @@
+"""Tests for reporting."""
+
+import csv
+import io
+import json
+import unittest
+
+from frontier import FetcherRecord
+from metrics import Metrics
+from reporting import (FIELDS, CSVWriter, ReportWriter, Stats,
+                       fetcher_record, merge_summaries, summarize,
+                       summary_report)
+
+
+def done(url, status=200, tries=1, error=None, next_url=None,
+         ctype='text/html', size=100, nurls=3, nnew=2):
+    """Return a FetcherRecord, as for a URL read back from a DoneTable."""
+    return FetcherRecord(url, status, tries, error, next_url, ctype,
+                         'utf-8', size, size, None, False, nurls, nnew)
+
+
+class TestFetcherRecord(unittest.TestCase):
+
+    def test_results(self):
+        stats = Stats()
+        cases = [
+            (done('http://a/html'), 'html'),
+            (done('http://a/moved', 301, next_url='http://a/html'),
+             'redirect'),
+            (done('http://a/img', ctype='image/png'), 'other'),
+            (done('http://a/gone', 404, ctype='text/plain'), 'error'),
+            (done('http://a/down', None, 4, 'OSError:refused', ctype=None),
+             'fail'),
+            (done('http://a/private', None, 1,
+                  'RobotsDisallowed:disallowed by robots.txt', ctype=None),
+             'robots'),
+        ]
+        for fetcher, result in cases:
+            self.assertEqual(fetcher_record(fetcher, stats)['result'], result,
+                             fetcher.url)
+        self.assertEqual(stats.stats['fail'], 1)
+        self.assertEqual(stats.stats['fail_OSError'], 1)
+        self.assertEqual(stats.stats['robots'], 1)
+        self.assertEqual(stats.stats['status_404'], 1)
+
+    def test_robots_not_a_failure(self):
+        fetcher = done('http://a/private', None, 1,
+                       'RobotsDisallowed:disallowed by robots.txt',
+                       ctype=None, size=None, nurls=None, nnew=None)
+        self.assertTrue(fetcher.disallowed)
+        record = fetcher_record(fetcher, Stats())
+        self.assertEqual(record['error_type'], 'RobotsDisallowed')
+        metrics = Metrics()
+        metrics.record(fetcher, 0.5)
+        self.assertEqual(metrics.statuses, {'robots': 1})
+
+
+class FakePool:
+    """The numbers summarize() takes from a ConnectionPool."""
+
+    dns_hits = 3
+    dns_misses = 1
+    dns_failures = 0
+    dns_time = 0.5
+    tls_handshakes = 2
+    tls_resumed = 1
+    tls_time = 0.1
+    pipeline = 1
+    pipelined_requests = 0
+    no_pipeline = ()
+
+
+class FakeCrawler:
+    """What the report writers look at in a Crawler."""
+
+    def __init__(self, busy=()):
+        self.t0 = 1000.0
+        self.t1 = 1010.0
+        self.max_tasks = 10
+        self.todo = {}
+        self.busy = {fetcher.url: fetcher for fetcher in busy}
+        self.done = {}
+        self.pool = FakePool()
+        self.rewrites = None
+
+
+class TestWriters(unittest.TestCase):
+
+    fetchers = [
+        done('http://a/1'),
+        done('http://a/2', 404, ctype='text/plain'),
+        done('http://a/3', None, 2, 'EOFError:', ctype=None),
+    ]
+
+    def write(self, writer_class):
+        file = io.StringIO()
+        writer = writer_class(file)
+        for fetcher in self.fetchers[:2]:
+            writer.write(fetcher)
+        writer.finish(FakeCrawler(busy=self.fetchers[2:]))
+        return file.getvalue()
+
+    def test_jsonl(self):
+        lines = [json.loads(line)
+                 for line in self.write(ReportWriter).splitlines()]
+        self.assertEqual([line.get('url') for line in lines],
+                         ['http://a/1', 'http://a/2', 'http://a/3', None])
+        self.assertEqual(set(lines[0]), set(FIELDS))
+        self.assertEqual([line.get('result') for line in lines[:3]],
+                         ['html', 'error', 'fail'])
+        summary = lines[-1]['summary']
+        self.assertEqual(summary['stats'], {'html': 1, 'html_bytes': 100,
+                                            'html_wire_bytes': 100,
+                                            'error': 1, 'error_bytes': 100,
+                                            'error_wire_bytes': 100,
+                                            'status_404': 1, 'fail': 1,
+                                            'fail_EOFError': 1})
+        self.assertEqual((summary['busy'], summary['dns_hits']), (1, 3))
+
+    def test_csv(self):
+        rows = list(csv.DictReader(io.StringIO(self.write(CSVWriter))))
+        self.assertEqual(list(rows[0]), list(FIELDS))
+        self.assertEqual([row['result'] for row in rows[:3]],
+                         ['html', 'error', 'fail'])
+        self.assertEqual(rows[1]['status'], '404')
+        summary = {row['url']: row['size'] for row in rows[3:]}
+        self.assertEqual({row['result'] for row in rows[3:]}, {'summary'})
+        self.assertEqual(summary['stats.html'], '1')
+        self.assertEqual(summary['dns_misses'], '1')
+        self.assertEqual(summary['max_tasks'], '10')
+
+    def test_no_header(self):
+        # As each shard writes its part of a sharded crawl's report.
+        for writer_class in (ReportWriter, CSVWriter):
+            file = io.StringIO()
+            writer = writer_class(file, header=False)
+            writer.write(self.fetchers[0])
+            self.assertEqual(len(file.getvalue().splitlines()), 1)
+            self.assertIn('http://a/1', file.getvalue())
+
+    def test_merge_summaries(self):
+        summaries = []
+        for t0, fetchers in ((1000.0, self.fetchers[:2]),
+                             (995.0, self.fetchers[2:])):
+            crawler = FakeCrawler()
+            crawler.t0 = t0
+            stats = Stats()
+            for fetcher in fetchers:
+                fetcher_record(fetcher, stats)
+            summaries.append(summarize(crawler, stats))
+        merged = merge_summaries(summaries)
+        self.assertEqual((merged['t0'], merged['t1']), (995.0, 1010.0))
+        self.assertEqual(merged['max_tasks'], 20)
+        self.assertEqual(merged['dns_hits'], 6)
+        self.assertEqual(merged['pipeline'], 1)
+        self.assertEqual((merged['stats'].stats['html'],
+                          merged['stats'].stats['fail']), (1, 1))
+        file = io.StringIO()
+        summary_report(merged, file=file)
+        self.assertIn('DNS: 8 lookups, 75.0% cached', file.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+"""Tests for robots.RobotsRules."""
+
+import unittest
+
+from robots import RobotsRules
+
+ROBOTS = """
+# A comment.
+User-agent: OtherBot
+Disallow: /
+
+User-agent: *
+Disallow: /private/
+Allow: /private/public
+Disallow: /*.pdf$
+Disallow: /tmp
+Crawl-delay: 2.5
+
+User-agent: ExampleBot/1.0
+User-agent: also
+Disallow: /secret  # Trailing comment.
+Allow: /secret/ok
+Disallow: /*?sid=
+Crawl-delay: soon
+
+Sitemap: http://example.com/sitemap.xml
+"""
+
+
+class TestRobotsRules(unittest.TestCase):
+
+    def test_default_group(self):
+        rules = RobotsRules.parse(ROBOTS, 'somebot')
+        self.assertTrue(rules.allowed('/'))
+        self.assertFalse(rules.allowed('/private/x'))
+        self.assertTrue(rules.allowed('/private/public/x'))
+        self.assertFalse(rules.allowed('/tmp'))
+        self.assertFalse(rules.allowed('/tmpfile'))
+        self.assertFalse(rules.allowed('/a/b.pdf'))
+        self.assertTrue(rules.allowed('/a/b.pdf?x=1'))
+        self.assertEqual(rules.delay, 2.5)
+        self.assertEqual(rules.sitemaps, ['http://example.com/sitemap.xml'])
+
+    def test_named_group(self):
+        for agent in ('examplebot', 'ExampleBot', 'also'):
+            rules = RobotsRules.parse(ROBOTS, agent)
+            self.assertFalse(rules.allowed('/secret'), agent)
+            self.assertTrue(rules.allowed('/secret/ok/1'), agent)
+            self.assertFalse(rules.allowed('/x?sid=2'), agent)
+            # The * group doesn't apply to it.
+            self.assertTrue(rules.allowed('/private/x'), agent)
+            self.assertIsNone(rules.delay)
+        rules = RobotsRules.parse(ROBOTS, 'otherbot')
+        self.assertFalse(rules.allowed('/anything'))
+        self.assertTrue(rules.allowed('/robots.txt'))
+
+    def test_longest_match_wins(self):
+        rules = RobotsRules([('/a', False), ('/a/b', True), ('/a/b/c', False),
+                             ('/*/d', True)])
+        self.assertFalse(rules.allowed('/a'))
+        self.assertTrue(rules.allowed('/a/b'))
+        self.assertFalse(rules.allowed('/a/b/c/d'))
+        self.assertTrue(rules.allowed('/a/x/d'))
+        self.assertTrue(rules.allowed('/b'))
+
+    def test_allow_wins_tie(self):
+        self.assertTrue(RobotsRules([('/p', False),
+                                     ('/p', True)]).allowed('/p'))
+        self.assertTrue(RobotsRules([('/p*', False),
+                                     ('/p*', True)]).allowed('/px'))
+
+    def test_anchored(self):
+        rules = RobotsRules([('/', True), ('/exact$', False)])
+        self.assertFalse(rules.allowed('/exact'))
+        self.assertTrue(rules.allowed('/exact/more'))
+
+    def test_empty(self):
+        rules = RobotsRules.parse('', 'somebot')
+        self.assertTrue(rules.allowed('/x'))
+        rules = RobotsRules.parse('User-agent: *\nDisallow:\n', 'somebot')
+        self.assertTrue(rules.allowed('/x'))
+        self.assertFalse(RobotsRules.disallow_all().allowed('/x'))
+
+
+if __name__ == '__main__':
+    unittest.main()
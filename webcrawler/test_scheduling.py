@@ -0,0 +1,193 @@
+"""Tests for scheduling."""
+
+import email.utils
+import random
+import time
+import unittest
+
+from scheduling import (PRIORITIES, ConcurrencyController, HostScheduler,
+                        RetryPolicy, parse_retry_after)
+
+
+def pop_all(scheduler):
+    """Pop URLs (finishing each at once) until none may start now."""
+    urls = []
+    while True:
+        url, delay = scheduler.pop()
+        if url is None:
+            return urls
+        urls.append(url)
+        scheduler.finish(url)
+
+
+class TestHostScheduler(unittest.TestCase):
+
+    def test_round_robin(self):
+        scheduler = HostScheduler()
+        for url in ('http://a/1', 'http://a/2', 'http://a/3',
+                    'http://b/1', 'http://B/2', 'http://c/1'):
+            scheduler.push(url)
+        self.assertEqual(len(scheduler), 6)
+        self.assertEqual(pop_all(scheduler),
+                         ['http://a/1', 'http://b/1', 'http://c/1',
+                          'http://a/2', 'http://B/2', 'http://a/3'])
+        self.assertEqual(len(scheduler), 0)
+        self.assertEqual(scheduler.pop(), (None, None))
+        self.assertEqual((scheduler.running, scheduler.active), (0, {}))
+
+    def test_limits(self):
+        scheduler = HostScheduler(max_tasks=3, max_per_host=2)
+        for url in ('http://a/1', 'http://a/2', 'http://a/3', 'http://b/1',
+                    'http://b/2'):
+            scheduler.push(url)
+        popped = [scheduler.pop()[0] for _ in range(3)]
+        self.assertEqual(popped, ['http://a/1', 'http://b/1', 'http://a/2'])
+        self.assertEqual(scheduler.pop(), (None, None))
+        self.assertTrue(scheduler.saturated)
+        scheduler.finish('http://b/1')
+        # a has two running, so b goes next.
+        self.assertEqual(scheduler.pop()[0], 'http://b/2')
+        scheduler.finish('http://a/1')
+        self.assertEqual(scheduler.pop()[0], 'http://a/3')
+
+    def test_delay(self):
+        scheduler = HostScheduler(min_delay=10)
+        scheduler.push('http://a/1')
+        scheduler.push('http://a/2')
+        self.assertEqual(pop_all(scheduler), ['http://a/1'])
+        url, delay = scheduler.pop()
+        self.assertIsNone(url)
+        self.assertGreater(delay, 9)
+        self.assertLessEqual(delay, 10)
+        scheduler.set_delay('b', 30)
+        scheduler.push('http://b/1')
+        scheduler.push('http://b/2')
+        self.assertEqual(pop_all(scheduler), [])  # set_delay() started it.
+        self.assertGreater(scheduler.pop()[1], 9)
+
+    def test_pause(self):
+        scheduler = HostScheduler()
+        scheduler.push('http://a/1')
+        scheduler.push('http://b/1')
+        scheduler.pause('a', 5)
+        self.assertEqual(pop_all(scheduler), ['http://b/1'])
+        self.assertGreater(scheduler.pop()[1], 4)
+
+    def test_priority(self):
+        scheduler = HostScheduler()
+        by_depth = PRIORITIES['depth']
+        for url, depth in (('http://a/deep', 3), ('http://a/root', 0),
+                           ('http://a/one', 1), ('http://a/also-one', 1)):
+            scheduler.push(url, by_depth(url, depth))
+        # Lower first, then in the order they came.
+        self.assertEqual(pop_all(scheduler),
+                         ['http://a/root', 'http://a/one', 'http://a/also-one',
+                          'http://a/deep'])
+
+    def test_not_before(self):
+        scheduler = HostScheduler()
+        scheduler.push('http://a/1', not_before=time.time() + 0.05)
+        scheduler.push('http://a/2', not_before=time.time() - 1)
+        self.assertEqual(len(scheduler), 2)
+        self.assertEqual(pop_all(scheduler), ['http://a/2'])
+        url, delay = scheduler.pop()
+        self.assertIsNone(url)
+        self.assertLessEqual(delay, 0.05)
+        time.sleep(delay)
+        self.assertEqual(pop_all(scheduler), ['http://a/1'])
+
+
+
+class TestConcurrencyController(unittest.TestCase):
+
+    def setUp(self):
+        self.scheduler = HostScheduler(max_tasks=100)
+        self.controller = ConcurrencyController(
+            self.scheduler, min_tasks=2, max_tasks=20, min_window=4)
+
+    def window(self, statuses, latency=0.1, saturated=True):
+        """Record a full window of fetches with the given statuses."""
+        limit = self.scheduler.max_tasks
+        self.scheduler.saturated = saturated
+        n = max(limit, self.controller.min_window)
+        for i in range(n):
+            self.controller.record(statuses[i % len(statuses)], latency)
+        return self.scheduler.max_tasks
+
+    def test_slow_start(self):
+        self.assertEqual(self.scheduler.max_tasks, 2)
+        self.assertEqual([self.window([200]) for _ in range(4)],
+                         [4, 8, 16, 20])
+        # Not saturated: no reason to go up.
+        self.assertEqual(self.window([200], saturated=False), 20)
+
+    def test_throttled(self):
+        self.window([200])
+        self.window([200])
+        self.assertEqual(self.window([200, 503]), 4)
+        # No more slow start: one at a time from here.
+        self.assertEqual(self.window([200]), 5)
+        self.assertEqual(self.window([429, 200, 200, 200, 200]), 2)
+        self.assertEqual(self.window([429]), 2)  # Not below min_tasks.
+
+    def test_errors(self):
+        self.window([200])
+        self.assertEqual(self.window([200, 200, 200, 404]), 8)
+        self.assertEqual(self.window([200, 200, 200, None]), 4)
+        self.assertEqual(self.window([200, 500, 200, 200]), 2)
+        decision = self.controller.decisions[-1]
+        self.assertEqual((decision['from'], decision['to']), (4, 2))
+        self.assertTrue(decision['reason'].startswith('error rate'))
+
+    def test_latency(self):
+        self.window([200], latency=0.1)
+        self.assertEqual(self.window([200], latency=0.25), 8)
+        self.assertEqual(self.window([200], latency=1.0), 4)
+        self.assertEqual(self.controller.summary()['max_tasks'], 4)
+
+
+
+class TestRetryPolicy(unittest.TestCase):
+
+    def test_retryable(self):
+        policy = RetryPolicy()
+        for status in (429, 500, 503):
+            self.assertTrue(policy.retryable(status))
+        for status in (200, 301, 404, 501, None):
+            self.assertFalse(policy.retryable(status))
+        self.assertTrue(RetryPolicy(statuses=[404]).retryable(404))
+
+    def test_backoff(self):
+        policy = RetryPolicy(base=1, factor=2, max_delay=10, jitter=0)
+        self.assertEqual([policy.delay(n) for n in range(1, 7)],
+                         [1, 2, 4, 8, 10, 10])
+        self.assertEqual(RetryPolicy(base=0).delay(3), 0)
+
+    def test_jitter(self):
+        random.seed(1)
+        policy = RetryPolicy(base=1, factor=2, jitter=0.5)
+        delays = [policy.delay(3) for _ in range(100)]
+        self.assertGreaterEqual(min(delays), 2)
+        self.assertLessEqual(max(delays), 4)
+        self.assertGreater(len(set(delays)), 90)
+
+    def test_retry_after(self):
+        policy = RetryPolicy(base=1, jitter=0, max_retry_after=60)
+        self.assertEqual(policy.delay(1, 30), 30)
+        self.assertEqual(policy.delay(1, 0), 1)
+        self.assertEqual(policy.delay(1, 3600), 60)
+
+    def test_parse_retry_after(self):
+        now = time.time()
+        self.assertEqual(parse_retry_after('120'), 120)
+        self.assertEqual(parse_retry_after(' 0 '), 0)
+        date = email.utils.formatdate(now + 90, usegmt=True)
+        self.assertAlmostEqual(parse_retry_after(date, now), 90, delta=1)
+        date = email.utils.formatdate(now - 90, usegmt=True)
+        self.assertEqual(parse_retry_after(date, now), 0)
+        for value in (None, '', '-5', '1.5', 'soon'):
+            self.assertIsNone(parse_retry_after(value), value)
+
+
+if __name__ == '__main__':
+    unittest.main()
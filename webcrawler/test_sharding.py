@@ -0,0 +1,94 @@
+"""Tests for sharding.ShardCrawler."""
+
+import asyncio
+import multiprocessing
+import queue
+import unittest
+
+import scheduling
+from sharding import ShardCrawler, shard_of
+
+
+def host_of_shard(shard, nshards):
+    """Return a host name whose URLs belong to shard."""
+    for i in range(1000):
+        host = 'h%d' % i
+        if shard_of('http://%s/' % host, nshards) == shard:
+            return host
+
+
+class TestShardCrawler(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.inboxes = [queue.Queue(), queue.Queue()]
+        self.outstanding = multiprocessing.Value('l', 2)
+        self.ours = 'http://%s/' % host_of_shard(0, 2)
+        self.theirs = 'http://%s/' % host_of_shard(1, 2)
+        self.crawler = ShardCrawler([self.ours, self.theirs], 0,
+                                    self.inboxes, self.outstanding,
+                                    obey_robots=False)
+
+    def tearDown(self):
+        self.crawler.close()
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def test_roots(self):
+        self.assertEqual(list(self.crawler.todo), [self.ours])
+        self.assertEqual(self.inboxes[1].get_nowait(), (self.theirs, 10, 0))
+        # Two to start with, one on our todo list, one on its way.
+        self.assertEqual(self.outstanding.value, 4)
+        self.crawler.started()
+        self.assertEqual(self.outstanding.value, 3)
+
+    def test_forward(self):
+        crawler = self.crawler
+        self.assertTrue(crawler.add_url(self.ours + 'x', depth=2))
+        self.assertTrue(crawler.add_url(self.theirs + 'x', 3, 1))
+        self.assertFalse(crawler.add_url(self.theirs + 'x'))  # Seen.
+        self.assertIn(self.ours + 'x', crawler.todo)
+        self.assertNotIn(self.theirs + 'x', crawler.todo)
+        self.inboxes[1].get_nowait()  # The root.
+        self.assertEqual(self.inboxes[1].get_nowait(),
+                         (self.theirs + 'x', 3, 1))
+        self.assertTrue(self.inboxes[1].empty())
+        self.assertEqual(self.outstanding.value, 6)
+
+    def test_poll(self):
+        crawler = self.crawler
+        crawler.started()
+        crawler.adjust(2)  # Sent by another shard.
+        self.inboxes[0].put((self.ours + 'y', 5, 2))
+        self.inboxes[0].put((self.ours, 10, 1))  # Already here.
+        poller = asyncio.Task(crawler.poll())
+        self.loop.run_until_complete(asyncio.sleep(0.01))
+        self.assertEqual(crawler.todo[self.ours + 'y'], (5, 2))
+        # The two that arrived are off the counter, the new one on it.
+        self.assertEqual(self.outstanding.value, 4)
+        self.assertFalse(poller.done())
+        # Once nothing is left anywhere, it stops.
+        self.outstanding.value = 0
+        self.loop.run_until_complete(asyncio.wait_for(poller, 1))
+
+    def test_crawl(self):
+        # A lone shard whose one URL fails, after a retry: every count
+        # it took is dropped by the end.
+        outstanding = multiprocessing.Value('l', 1)
+        crawler = ShardCrawler(
+            ['http://127.0.0.1:1/'], 0, [queue.Queue()], outstanding,
+            obey_robots=False, max_tries=2,
+            retry_policy=scheduling.RetryPolicy(base=0.01, jitter=0))
+        try:
+            crawler.started()
+            self.loop.run_until_complete(
+                asyncio.wait_for(crawler.crawl(), 5))
+            self.assertEqual(crawler.done['http://127.0.0.1:1/'].tries, 2)
+            self.assertEqual(outstanding.value, 0)
+        finally:
+            crawler.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,158 @@
+"""Tests for sitemap."""
+
+import asyncio
+import gzip
+import unittest
+from xml.etree import ElementTree
+
+import crawling
+from sitemap import SitemapParser, parse_lastmod, seed
+
+URLSET = b'''<?xml version="1.0" encoding="UTF-8"?>
+<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+  <url><loc> http://a/1 </loc><lastmod>2024-01-02</lastmod></url>
+  <url><loc>http://a/2</loc><changefreq>daily</changefreq></url>
+  <url><lastmod>2024-01-02</lastmod></url>
+  <url><loc>http://a/3?x=1&amp;y=2</loc>
+       <lastmod>2024-01-02T10:00:00+02:00</lastmod></url>
+</urlset>
+'''
+
+INDEX = b'''<?xml version="1.0" encoding="UTF-8"?>
+<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+  <sitemap><loc>http://a/sm1.xml.gz</loc></sitemap>
+  <sitemap><loc>http://a/sm2.xml</loc><lastmod>2024</lastmod></sitemap>
+</sitemapindex>
+'''
+
+JAN2 = 1704153600  # 2024-01-02T00:00:00Z
+
+
+def parse(data, chunk=None, on_url=None):
+    parser = SitemapParser(on_url)
+    chunk = chunk or len(data)
+    for i in range(0, len(data), chunk):
+        parser.feed(data[i:i+chunk])
+    parser.close()
+    return parser
+
+
+class TestParseLastmod(unittest.TestCase):
+
+    def test_formats(self):
+        self.assertEqual(parse_lastmod('2024-01-02'), JAN2)
+        self.assertEqual(parse_lastmod(' 2024-01 '), JAN2 - 86400)
+        self.assertEqual(parse_lastmod('2024-01-02T01:02:03Z'), JAN2 + 3723)
+        self.assertEqual(parse_lastmod('2024-01-02T01:02:03.5-01:30'),
+                         JAN2 + 3723 + 5400)
+        self.assertEqual(parse_lastmod('2024-01-02T10:00+02:00'),
+                         JAN2 + 8 * 3600)
+
+    def test_invalid(self):
+        for text in (None, '', 'yesterday', '2024-13-01', '2024-1-2'):
+            self.assertIsNone(parse_lastmod(text), text)
+
+
+class TestSitemapParser(unittest.TestCase):
+
+    expected = [(JAN2, 'http://a/1'), (None, 'http://a/2'),
+                (JAN2 + 8 * 3600, 'http://a/3?x=1&y=2')]
+
+    def test_urlset(self):
+        parser = parse(URLSET)
+        self.assertEqual(parser.urls, self.expected)
+        self.assertEqual(parser.nurls, 3)
+        self.assertEqual(parser.sitemaps, [])
+        self.assertEqual(parser.size, len(URLSET))
+
+    def test_chunks_and_gzip(self):
+        for data in (URLSET, gzip.compress(URLSET)):
+            for chunk in (1, 7, 100):
+                self.assertEqual(parse(data, chunk).urls, self.expected)
+
+    def test_on_url(self):
+        # Each URL is passed on as soon as its element ends.
+        seen = []
+        parser = SitemapParser(lambda lastmod, loc: seen.append(loc))
+        end = URLSET.index(b'</url>') + len(b'</url>')
+        parser.feed(URLSET[:end])
+        self.assertEqual(seen, ['http://a/1'])
+        parser.feed(URLSET[end:])
+        parser.close()
+        self.assertEqual(seen, ['http://a/1', 'http://a/2',
+                                'http://a/3?x=1&y=2'])
+        self.assertEqual(parser.urls, [])
+        self.assertEqual(parser.nurls, 3)
+
+    def test_index(self):
+        parser = parse(INDEX)
+        self.assertEqual(parser.urls, [])
+        self.assertEqual(parser.sitemaps,
+                         ['http://a/sm1.xml.gz', 'http://a/sm2.xml'])
+
+    def test_broken(self):
+        parser = SitemapParser()
+        parser.feed(URLSET[:URLSET.index(b'<url><loc>http://a/2')])
+        with self.assertRaises(ElementTree.ParseError):
+            parser.feed(b'<oops></url>')
+        self.assertEqual(parser.urls, self.expected[:1])
+
+
+class TestSeed(unittest.TestCase):
+
+    lastmods = [('old', '2020-01-01'), ('undated', None),
+                ('newest', '2024-06-01'), ('newer', '2024-01-01T12:00Z')]
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.server = self.loop.run_until_complete(
+            asyncio.start_server(self.serve, '127.0.0.1', 0))
+        self.root = 'http://127.0.0.1:%d/' % (
+            self.server.sockets[0].getsockname()[1])
+
+    def tearDown(self):
+        self.server.close()
+        self.loop.run_until_complete(self.server.wait_closed())
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    @asyncio.coroutine
+    def serve(self, reader, writer):
+        """Answer any request with a sitemap of lastmods."""
+        while (yield from reader.readline()) not in (b'\r\n', b''):
+            pass
+        urls = ''.join(
+            '<url><loc>%s%s</loc>%s</url>' %
+            (self.root, name,
+             '<lastmod>%s</lastmod>' % lastmod if lastmod else '')
+            for name, lastmod in self.lastmods)
+        body = ('<urlset xmlns="http://www.sitemaps.org/schemas/'
+                'sitemap/0.9">%s</urlset>' % urls).encode('utf-8')
+        writer.write(b'HTTP/1.1 200 OK\r\nConnection: close\r\n'
+                     b'Content-Length: ' + str(len(body)).encode('ascii') +
+                     b'\r\n\r\n' + body)
+        writer.close()
+
+    def test_newest_first(self):
+        crawler = crawling.Crawler([self.root], obey_robots=False)
+        try:
+            added = self.loop.run_until_complete(
+                seed(crawler, [self.root + 'sitemap.xml']))
+            self.assertEqual(added, 4)
+            popped = []
+            while True:
+                url, _ = crawler.scheduler.pop()
+                if url is None:
+                    break
+                popped.append(url[len(self.root):])
+                crawler.scheduler.finish(url)
+            # Then the URLs without a lastmod, in the order found.
+            self.assertEqual(popped, ['newest', 'newer', 'old', '',
+                                      'undated'])
+        finally:
+            crawler.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
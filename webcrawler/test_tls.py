@@ -0,0 +1,134 @@
+"""Tests for tls, and TLS connections in crawling.ConnectionPool."""
+
+import asyncio
+import os
+import shutil
+import ssl
+import subprocess
+import tempfile
+import unittest
+
+import crawling
+import tls
+
+
+def make_certificate(directory):
+    """Write a self-signed cert.pem and key.pem for localhost."""
+    subprocess.check_call(
+        ['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes',
+         '-days', '1', '-subj', '/CN=localhost',
+         '-addext', 'subjectAltName=DNS:localhost',
+         '-keyout', os.path.join(directory, 'key.pem'),
+         '-out', os.path.join(directory, 'cert.pem')],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+class TestMakeContext(unittest.TestCase):
+
+    def test_context(self):
+        context = tls.make_context()
+        self.assertEqual(isinstance(context, tls.SessionContext),
+                         tls.HAS_SESSIONS)
+        self.assertEqual(context.verify_mode, ssl.CERT_REQUIRED)
+        self.assertTrue(context.check_hostname)
+        self.assertTrue(context.options & ssl.OP_NO_COMPRESSION)
+
+    def test_save_session(self):
+        # Only a SessionContext keeps sessions; no SSLObject, no session.
+        tls.save_session(ssl.create_default_context(), 'a', object())
+        if tls.HAS_SESSIONS:
+            context = tls.make_context()
+            tls.save_session(context, 'a', None)
+            self.assertEqual(context.sessions, {})
+
+
+@unittest.skipUnless(tls.HAS_SESSIONS and shutil.which('openssl'),
+                     'needs SSLSession and the openssl command')
+class TestSessions(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        make_certificate(cls.directory)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        server_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        server_context.load_cert_chain(
+            os.path.join(self.directory, 'cert.pem'),
+            os.path.join(self.directory, 'key.pem'))
+        self.handlers = []
+        self.server = self.loop.run_until_complete(asyncio.start_server(
+            self.serve, '127.0.0.1', 0, ssl=server_context))
+        self.port = self.server.sockets[0].getsockname()[1]
+        context = tls.make_context()
+        context.load_verify_locations(
+            os.path.join(self.directory, 'cert.pem'))
+        self.pool = crawling.ConnectionPool(max_tasks=3,
+                                            ssl_context=context)
+
+    def tearDown(self):
+        self.pool.close()
+        self.loop.run_until_complete(asyncio.gather(*self.handlers))
+        self.server.close()
+        self.loop.run_until_complete(self.server.wait_closed())
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    @asyncio.coroutine
+    def serve(self, reader, writer):
+        self.handlers.append(asyncio.Task.current_task())
+        try:
+            yield from reader.read()  # Until the client closes.
+        except ConnectionError:
+            pass
+        writer.close()
+
+    def warm(self, host, n):
+        return self.loop.run_until_complete(
+            self.pool.warm(host, self.port, True, n))
+
+    def test_warm(self):
+        # One full handshake; the others resume its session.
+        self.assertEqual(self.warm('localhost', 5), 3)  # max_tasks.
+        pool = self.pool
+        self.assertEqual((pool.opened, pool.tls_handshakes, pool.tls_resumed),
+                         (3, 3, 2))
+        self.assertIn('localhost', pool.ssl_context.sessions)
+        conns = pool.connections[('127.0.0.1', self.port, True)]
+        self.assertEqual(len(conns), 3)
+        # They're used before new ones are opened.
+        conn = self.loop.run_until_complete(
+            pool.get_connection('localhost', self.port, True))
+        self.assertEqual((pool.opened, pool.reused), (3, 1))
+        conn.close()
+
+    def test_resume(self):
+        get = self.pool.get_connection
+        first = self.loop.run_until_complete(get('localhost', self.port,
+                                                 True))
+        first.close()
+        second = self.loop.run_until_complete(get('localhost', self.port,
+                                                  True))
+        self.assertEqual((self.pool.tls_handshakes, self.pool.tls_resumed),
+                         (2, 1))
+        second.close()
+
+    def test_unverified(self):
+        # The server's name must match the certificate.
+        self.assertEqual(self.warm('127.0.0.1', 2), 0)
+        self.assertEqual(self.pool.opened, 0)
+
+    def test_unreachable(self):
+        self.server.close()
+        self.loop.run_until_complete(self.server.wait_closed())
+        self.assertEqual(self.warm('localhost', 2), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
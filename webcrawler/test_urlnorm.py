@@ -0,0 +1,110 @@
+"""Tests for urlnorm."""
+
+import unittest
+
+from urlnorm import BloomFilter, OriginRewrites, SeenSet, canonicalize
+
+
+class TestCanonicalize(unittest.TestCase):
+
+    def test_canonical(self):
+        cases = [
+            ('HTTP://Example.COM', 'http://example.com/'),
+            ('http://example.com:80/a', 'http://example.com/a'),
+            ('https://example.com:443/a', 'https://example.com/a'),
+            ('http://example.com:8080/a', 'http://example.com:8080/a'),
+            ('https://example.com:80/a', 'https://example.com:80/a'),
+            ('http://example.com/a#frag', 'http://example.com/a'),
+            ('http://example.com/a?', 'http://example.com/a'),
+            ('http://example.com/d/index.html', 'http://example.com/d/'),
+            ('http://example.com/index.htm?x', 'http://example.com/?x'),
+            ('http://example.com/%7ea%2f', 'http://example.com/%7Ea%2F'),
+            ('http://example.com/?b=2&a=1&&c',
+             'http://example.com/?a=1&b=2&c'),
+            ('http://User:Pw@Example.com/', 'http://User:Pw@example.com/'),
+            ('http://[::1]:8000/', 'http://[::1]:8000/'),
+        ]
+        for url, expected in cases:
+            self.assertEqual(canonicalize(url), expected, url)
+            self.assertEqual(canonicalize(expected), expected, expected)
+
+    def test_unsorted_query(self):
+        self.assertEqual(canonicalize('http://a/?b=2&a=1', sort_query=False),
+                         'http://a/?b=2&a=1')
+
+    def test_unparsable(self):
+        self.assertEqual(canonicalize('http://a:port/'), 'http://a:port/')
+
+
+class TestSeenSet(unittest.TestCase):
+
+    def test_add(self):
+        seen = SeenSet(size=4)
+        urls = ['http://a/%d' % i for i in range(1000)]
+        for url in urls:
+            self.assertTrue(seen.add(url))
+        for url in urls:
+            self.assertFalse(seen.add(url))
+            self.assertIn(url, seen)
+        self.assertNotIn('http://a/1000', seen)
+        self.assertEqual(len(seen), 1000)
+        self.assertLessEqual(len(seen.slots), 4096)
+
+
+class TestBloomFilter(unittest.TestCase):
+
+    def test_add(self):
+        bloom = BloomFilter(1000, error_rate=0.01)
+        added = sum(bloom.add('http://a/x%d' % i) for i in range(1000))
+        # A false positive may look like it was there already.
+        self.assertGreater(added, 990)
+        self.assertEqual(len(bloom), added)
+        for i in range(1000):
+            self.assertIn('http://a/x%d' % i, bloom)
+            self.assertFalse(bloom.add('http://a/x%d' % i))
+        false_positives = sum('http://a/y%d' % i in bloom
+                              for i in range(10000))
+        self.assertLess(false_positives, 300)
+
+
+
+class TestOriginRewrites(unittest.TestCase):
+
+    def test_learn(self):
+        rewrites = OriginRewrites(evidence=2)
+        rewrites.observe('http://a/1', 301, 'https://a/1')
+        self.assertEqual(rewrites.rewrite('http://a/2'), 'http://a/2')
+        rewrites.observe('http://a/3?q', 301, 'HTTPS://A:443/3?q#x')
+        self.assertEqual(rewrites.rewrite('http://a/2?x'), 'https://a/2?x')
+        self.assertEqual(rewrites.rewrite('http://b/2'), 'http://b/2')
+        self.assertEqual(rewrites.rewritten, 1)
+
+    def test_chain(self):
+        rewrites = OriginRewrites(evidence=1)
+        rewrites.observe('http://a/1', 301, 'https://a/1')
+        rewrites.observe('https://a/1', 301, 'https://www.a/1')
+        self.assertEqual(rewrites.rewrite('http://a/x'), 'https://www.a/x')
+        # A loop doesn't hang.
+        rewrites.observe('https://www.a/2', 301, 'http://a/2')
+        rewrites.rewrite('http://a/x')
+
+    def test_refuted(self):
+        rewrites = OriginRewrites(evidence=1)
+        rewrites.observe('http://a/1', 301, 'https://a/1')
+        rewrites.observe('http://a/login', 302, 'https://a/sso?from=login')
+        self.assertEqual(rewrites.rewrite('http://a/2'), 'http://a/2')
+        rewrites.observe('http://a/3', 301, 'https://a/3')
+        self.assertEqual(rewrites.rewrite('http://a/2'), 'http://a/2')
+        rewrites.observe('http://b/1', 200)
+        rewrites.observe('http://b/2', 301, 'https://b/2')
+        self.assertEqual(rewrites.rewrite('http://b/3'), 'http://b/3')
+
+    def test_failures_ignored(self):
+        rewrites = OriginRewrites(evidence=1)
+        rewrites.observe('http://a/1', None)
+        rewrites.observe('http://a/2', 301, 'https://a/2')
+        self.assertEqual(rewrites.rewrite('http://a/3'), 'https://a/3')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+"""Tests for warc.WARCWriter and warc.ResponseRecord."""
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import zlib
+
+from warc import WARCWriter
+
+
+def read_member(path, offset, length):
+    """Return the decompressed gzip member at offset in a WARC file."""
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        data = f.read(length)
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    record = decompressor.decompress(data) + decompressor.flush()
+    assert decompressor.eof and not decompressor.unused_data
+    return record
+
+
+class TestWARCWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def index(self):
+        with open(os.path.join(self.directory, 'crawl-index.jsonl')) as f:
+            return [json.loads(line) for line in f]
+
+    def archive(self, writer, url, body, status=200, chunks=1):
+        record = writer.response(url)
+        step = len(body) // chunks + 1
+        for i in range(0, len(body), step):
+            record.write(body[i:i+step])
+        headers = [('HTTP/1.1 %d X\r\n' % status).encode(),
+                   b'Transfer-Encoding: chunked\r\n',
+                   b'Content-Type: text/html\r\n', b'\r\n']
+        record.finish(headers, status, 'text/html')
+
+    def test_records(self):
+        writer = WARCWriter(self.directory, software='test')
+        self.archive(writer, 'http://a/1', b'<p>one</p>')
+        discarded = writer.response('http://a/2')
+        discarded.write(b'retried')
+        discarded.discard()
+        self.archive(writer, 'http://a/3', os.urandom(300000), chunks=7)
+        writer.close()
+        index = self.index()
+        self.assertEqual([entry['url'] for entry in index],
+                         ['http://a/1', 'http://a/3'])
+        self.assertEqual(writer.records, 3)  # With the warcinfo record.
+        entry = index[0]
+        self.assertEqual((entry['status'], entry['mime']),
+                         (200, 'text/html'))
+        record = read_member(os.path.join(self.directory, entry['filename']),
+                             entry['offset'], entry['length'])
+        head, _, content = record.partition(b'\r\n\r\n')
+        self.assertIn(b'WARC-Type: response', head)
+        self.assertIn(b'WARC-Target-URI: http://a/1', head)
+        length = 'Content-Length: %d' % (len(content) - 4)
+        self.assertIn(length.encode(), head)
+        self.assertIn(b'X-Crawler-Transfer-Encoding: chunked', content)
+        self.assertTrue(content.endswith(b'\r\n\r\n<p>one</p>\r\n\r\n'))
+        entry = index[1]
+        record = read_member(os.path.join(self.directory, entry['filename']),
+                             entry['offset'], entry['length'])
+        self.assertGreater(len(record), 300000)
+
+    def test_rotation(self):
+        writer = WARCWriter(self.directory, max_size=100)
+        for i in range(3):
+            self.archive(writer, 'http://a/%d' % i, b'x' * 1000)
+        writer.close()
+        filenames = [entry['filename'] for entry in self.index()]
+        self.assertEqual(len(set(filenames)), 3)
+        for filename in filenames:
+            # The first gzip member is the warcinfo record.
+            with open(os.path.join(self.directory, filename), 'rb') as f:
+                data = zlib.decompress(f.read(), 16 + zlib.MAX_WBITS)
+            self.assertIn(b'WARC-Type: warcinfo', data)
+
+
+if __name__ == '__main__':
+    unittest.main()
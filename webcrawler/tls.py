@@ -0,0 +1,66 @@
+"""A simple web crawler -- TLS contexts that resume sessions."""
+
+import ssl
+
+# Resuming a session needs SSLSession and wrap_bio(session=...), which
+# are new in Python 3.6; without them every handshake is a full one.
+HAS_SESSIONS = hasattr(ssl, 'SSLSession')
+
+
+class SessionContext(ssl.SSLContext):
+    """An SSLContext that resumes TLS sessions, shared by a pool.
+
+    A full handshake costs a round trip more than resuming a session
+    that an earlier connection to the server set up, and public-key
+    crypto on both ends.  But Python only resumes a session that is
+    passed to wrap_bio(), and asyncio calls that without one.  So this
+    keeps the last session of each server name (see save()) and passes
+    that in.  It needs Python 3.6 or later (see HAS_SESSIONS).
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__()  # SSLContext.__new__() took the arguments.
+        self.sessions = {}  # {server_hostname: SSLSession, ...}
+
+    def wrap_bio(self, incoming, outgoing, server_side=False,
+                 server_hostname=None, session=None):
+        if session is None and not server_side:
+            session = self.sessions.get(server_hostname)
+        return super().wrap_bio(incoming, outgoing, server_side=server_side,
+                                server_hostname=server_hostname,
+                                session=session)
+
+    def save(self, server_hostname, sslobj):
+        """Remember the session of an SSLObject, if it can be resumed.
+
+        With TLS 1.3 the server sends the ticket for that after the
+        handshake, so call this again once a response has been read.
+        """
+        session = sslobj.session
+        if session is None:
+            return
+        if session.has_ticket or sslobj.version() != 'TLSv1.3':
+            self.sessions[server_hostname] = session
+
+
+def make_context():
+    """Return a context that verifies certificates, for HTTP/1.1.
+
+    This is a SessionContext if the Python version allows, else a
+    plain default context.
+    """
+    if HAS_SESSIONS:
+        context = SessionContext(ssl.PROTOCOL_TLS_CLIENT)
+        context.load_default_certs()
+    else:
+        context = ssl.create_default_context()
+    context.options |= ssl.OP_NO_COMPRESSION
+    if getattr(ssl, 'HAS_ALPN', False):
+        context.set_alpn_protocols(['http/1.1'])
+    return context
+
+
+def save_session(context, server_hostname, sslobj):
+    """Let context remember sslobj's session, if it's a SessionContext."""
+    if isinstance(context, SessionContext) and sslobj is not None:
+        context.save(server_hostname, sslobj)
@@ -0,0 +1,216 @@
+"""A simple web crawler -- URL canonicalization and the seen-set."""
+
+import array
+import hashlib
+import math
+import re
+import urllib.parse
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+INDEX_PAGES = ('index.html', 'index.htm')
+
+
+def canonicalize(url, sort_query=True):
+    """Return a canonical form of an absolute http(s) URL.
+
+    The scheme and host are lowercased, a default port, the fragment
+    and an empty query ('?') are dropped, an empty path becomes '/',
+    a trailing index.html (or .htm) is dropped, percent escapes are
+    uppercased, and unless sort_query is false the query parameters
+    are sorted.  URLs that can't be parsed are returned unchanged.
+    """
+    parts = urllib.parse.urlsplit(url)
+    scheme = parts.scheme.lower()
+    try:
+        port = parts.port
+    except ValueError:
+        return url
+    netloc = parts.hostname or ''
+    if ':' in netloc:
+        netloc = '[%s]' % netloc  # IPv6 literal.
+    if port is not None and port != DEFAULT_PORTS.get(scheme):
+        netloc = '%s:%d' % (netloc, port)
+    if parts.username is not None:
+        userinfo = parts.netloc.rpartition('@')[0]
+        netloc = '%s@%s' % (userinfo, netloc)
+    path = _fix_escapes(parts.path) or '/'
+    head, sep, tail = path.rpartition('/')
+    if tail in INDEX_PAGES:
+        path = head + sep
+    query = _fix_escapes(parts.query)
+    if query and sort_query:
+        query = '&'.join(sorted(p for p in query.split('&') if p))
+    return urllib.parse.urlunsplit((scheme, netloc, path, query, ''))
+
+
+_escape_re = re.compile(r'%[0-9a-fA-F]{2}')
+
+
+def _fix_escapes(s):
+    """Uppercase the hex digits of percent escapes."""
+    if '%' not in s:
+        return s
+    return _escape_re.sub(lambda m: m.group().upper(), s)
+
+
+def fingerprint(url):
+    """Return a 64-bit hash of a URL, never zero."""
+    digest = hashlib.md5(url.encode('utf-8', 'surrogateescape')).digest()
+    return int.from_bytes(digest[:8], 'little') or 1
+
+
+class SeenSet:
+    """A set of URLs that stores only their 64-bit fingerprints.
+
+    This is an open-addressing hash table in an array of unsigned 64-bit
+    integers, so it takes 8 bytes per slot and at most twice as many
+    slots as URLs, a fraction of what a set of strings needs.  Two URLs
+    with the same fingerprint count as the same, which for 64 bits is
+    unlikely below billions of URLs.
+    """
+
+    def __init__(self, size=1024):
+        self.slots = array.array('Q', bytes(8 * size))
+        self.mask = size - 1  # The size must be a power of two.
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, url):
+        return self._find(fingerprint(url))[1]
+
+    def add(self, url):
+        """Add a URL; return True if it wasn't in the set yet."""
+        fp = fingerprint(url)
+        index, found = self._find(fp)
+        if found:
+            return False
+        self.slots[index] = fp
+        self.count += 1
+        if 2 * self.count > len(self.slots):
+            self._grow()
+        return True
+
+    def _find(self, fp):
+        """Return (index, found) for a fingerprint (linear probing)."""
+        slots, mask = self.slots, self.mask
+        index = fp & mask
+        while True:
+            slot = slots[index]
+            if slot == fp:
+                return index, True
+            if not slot:
+                return index, False
+            index = (index + 1) & mask
+
+    def _grow(self):
+        old = self.slots
+        self.slots = array.array('Q', bytes(16 * len(old)))
+        self.mask = len(self.slots) - 1
+        for fp in old:
+            if fp:
+                self.slots[self._find(fp)[0]] = fp
+
+
+class BloomFilter:
+    """An approximate set of URLs in a fixed amount of memory.
+
+    It is sized for capacity URLs with a false positive rate of
+    error_rate; a false positive means a URL is wrongly taken to have
+    been seen already, so it isn't crawled.  URLs are never forgotten.
+    """
+
+    def __init__(self, capacity, error_rate=0.001):
+        nbits = -capacity * math.log(error_rate) / math.log(2) ** 2
+        self.nbits = max(int(nbits), 64)
+        self.nhashes = max(int(round(self.nbits / capacity * math.log(2))), 1)
+        self.bits = bytearray((self.nbits + 7) // 8)
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def _indexes(self, url):
+        # Double hashing: derive all hash functions from two halves of
+        # the fingerprint.
+        fp = fingerprint(url)
+        h1, h2 = fp & 0xffffffff, (fp >> 32) | 1
+        return [(h1 + i * h2) % self.nbits for i in range(self.nhashes)]
+
+    def __contains__(self, url):
+        bits = self.bits
+        return all(bits[i >> 3] & (1 << (i & 7)) for i in self._indexes(url))
+
+    def add(self, url):
+        """Add a URL; return True if it wasn't (apparently) there yet."""
+        bits = self.bits
+        new = False
+        for i in self._indexes(url):
+            mask = 1 << (i & 7)
+            if not bits[i >> 3] & mask:
+                bits[i >> 3] |= mask
+                new = True
+        if new:
+            self.count += 1
+        return new
+
+
+class OriginRewrites:
+    """Learned redirects from one origin to another (e.g. http to https).
+
+    An origin is a (scheme, netloc) pair.  Many sites redirect every
+    URL of an origin to the same path on another one: http://x/p to
+    https://x/p, or x to www.x.  observe() is told about each response;
+    once evidence redirects like that have been seen from an origin,
+    and no other response from it, rewrite() sends its URLs straight to
+    the other origin, saving a fetch per URL.  A response from the
+    origin that isn't such a redirect (say a page, or a redirect to a
+    login page) means the origin is never rewritten.
+    """
+
+    def __init__(self, evidence=2):
+        self.evidence = evidence
+        self.rules = {}  # {origin: new origin, ...}
+        self.votes = {}  # {origin: (new origin, count), ...}
+        self.refuted = set()  # Origins that aren't redirected whole.
+        self.rewritten = 0  # URLs rewritten so far.
+
+    def observe(self, url, status, next_url=None):
+        """Learn from a response for url (next_url if it redirected)."""
+        if status is None:
+            return  # The fetch failed; that tells us nothing.
+        scheme, netloc, path, query, _ = urllib.parse.urlsplit(url)
+        origin = scheme, netloc
+        if origin in self.refuted:
+            return
+        if next_url is not None:
+            (next_scheme, next_netloc, next_path, next_query,
+             _) = urllib.parse.urlsplit(canonicalize(next_url))
+            target = next_scheme, next_netloc
+            if (target != origin and (path, query) == (next_path, next_query)
+                    and next_scheme in DEFAULT_PORTS):
+                new, count = self.votes.get(origin, (target, 0))
+                if new == target:
+                    self.votes[origin] = target, count + 1
+                    if count + 1 == self.evidence:
+                        self.rules[origin] = target
+                    return
+        self.refuted.add(origin)
+        self.votes.pop(origin, None)
+        self.rules.pop(origin, None)
+
+    def rewrite(self, url):
+        """Return a canonical URL, moved to the origin it redirects to."""
+        if not self.rules:
+            return url
+        parts = urllib.parse.urlsplit(url)
+        origin = parts.scheme, parts.netloc
+        seen = set()
+        while origin in self.rules and origin not in seen:
+            seen.add(origin)
+            origin = self.rules[origin]
+        if not seen:
+            return url
+        self.rewritten += 1
+        return urllib.parse.urlunsplit(origin + tuple(parts[2:]))
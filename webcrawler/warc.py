@@ -0,0 +1,207 @@
+"""A simple web crawler -- archiving responses in WARC files."""
+
+import base64
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+import uuid
+import zlib
+
+logger = logging.getLogger(__name__)
+
+
+def warc_date(t):
+    """Format a POSIX timestamp the way WARC-Date wants it."""
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(t))
+
+
+def record_id():
+    return '<urn:uuid:%s>' % uuid.uuid4()
+
+
+class WARCWriter:
+    """Write responses to rotating WARC files, with an index.
+
+    Files are named PREFIX-TIMESTAMP-NNNNN.warc.gz in directory, and a
+    new one is started once the current one has max_size bytes.  Each
+    record is a gzip member of its own, so a reader can seek straight
+    to it.  Each file starts with a warcinfo record.
+
+    For every response a line of JSON is appended to PREFIX-index.jsonl
+    with the URL, date, status, MIME type, payload digest, and the file,
+    offset and (compressed) length of the record -- the fields of a
+    CDXJ index, under the same names.
+
+    Call response() to start a ResponseRecord, and close() at the end.
+    software goes in the warcinfo records.
+    """
+
+    def __init__(self, directory, prefix='crawl', max_size=10**9,
+                 compresslevel=6, software=None):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.software = software
+        self.prefix = prefix
+        self.max_size = max_size
+        self.compresslevel = compresslevel
+        self.serial = 0
+        self.file = None
+        self.filename = None
+        self.warcinfo_id = None
+        self.records = 0
+        self.index = open(os.path.join(directory, prefix + '-index.jsonl'),
+                          'a')
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        if self.index is not None:
+            self.index.close()
+            self.index = None
+
+    def response(self, url):
+        """Return a ResponseRecord for a response from url."""
+        return ResponseRecord(self, url)
+
+    def open_file(self):
+        if self.file is not None:
+            self.file.close()
+        stamp = time.strftime('%Y%m%d%H%M%S', time.gmtime())
+        while True:
+            self.filename = '%s-%s-%05d.warc.gz' % (self.prefix, stamp,
+                                                   self.serial)
+            self.serial += 1
+            path = os.path.join(self.directory, self.filename)
+            if not os.path.exists(path):
+                break
+        logger.warn('writing WARC file %r', path)
+        self.file = open(path, 'wb')
+        self.warcinfo_id = record_id()
+        info = 'format: WARC File Format 1.1\r\n'
+        if self.software:
+            info = 'software: %s\r\n%s' % (self.software, info)
+        info = info.encode('utf-8')
+        self.write_record([('WARC-Type', 'warcinfo'),
+                           ('WARC-Record-ID', self.warcinfo_id),
+                           ('WARC-Date', warc_date(time.time())),
+                           ('WARC-Filename', self.filename),
+                           ('Content-Type', 'application/warc-fields')],
+                          [info], len(info))
+
+    def write_record(self, fields, blocks, length):
+        """Write a record as one gzip member; return (offset, length).
+
+        fields are the WARC header fields (without Content-Length) and
+        blocks are the pieces of its content: bytes, or files to copy.
+        """
+        compressor = zlib.compressobj(self.compresslevel, zlib.DEFLATED,
+                                      16 + zlib.MAX_WBITS)
+        lines = ['WARC/1.1']
+        lines.extend('%s: %s' % field for field in fields)
+        lines.append('Content-Length: %d' % length)
+        header = '\r\n'.join(lines + ['', '']).encode('utf-8')
+        offset = self.file.tell()
+        write = self.file.write
+        write(compressor.compress(header))
+        for block in blocks:
+            if isinstance(block, bytes):
+                write(compressor.compress(block))
+            else:
+                while True:
+                    data = block.read(64*1024)
+                    if not data:
+                        break
+                    write(compressor.compress(data))
+        write(compressor.compress(b'\r\n\r\n'))
+        write(compressor.flush())
+        self.records += 1
+        return offset, self.file.tell() - offset
+
+    def write_response(self, url, date, status, mime, head, payload, size,
+                       payload_digest, truncated):
+        """Write a response record and index it (see ResponseRecord)."""
+        if self.file is None or self.file.tell() >= self.max_size:
+            self.open_file()
+        fields = [('WARC-Type', 'response'),
+                  ('WARC-Record-ID', record_id()),
+                  ('WARC-Warcinfo-ID', self.warcinfo_id),
+                  ('WARC-Date', warc_date(date)),
+                  ('WARC-Target-URI', url),
+                  ('WARC-Payload-Digest', payload_digest),
+                  ('Content-Type', 'application/http;msgtype=response')]
+        if truncated:
+            fields.append(('WARC-Truncated', 'length'))
+        offset, length = self.write_record(fields, [head, payload],
+                                           len(head) + size)
+        entry = {
+            'url': url,
+            'timestamp': time.strftime('%Y%m%d%H%M%S', time.gmtime(date)),
+            'status': status,
+            'mime': mime,
+            'digest': payload_digest,
+            'filename': self.filename,
+            'offset': offset,
+            'length': length,
+        }
+        self.index.write(json.dumps(entry) + '\n')
+
+
+class ResponseRecord:
+    """A response on its way into a WARCWriter.
+
+    Pass write() as the tap of crawling.read_response(), which calls
+    it with each piece of the body as it arrives: as sent, except
+    without a chunked Transfer-Encoding.  The body is spooled to a
+    temporary file (only small bodies stay in memory), since the WARC
+    header must give the length before the body.  Then call finish()
+    with the raw header lines, or discard() if the fetch failed.
+    """
+
+    spool_size = 256*1024  # Bodies up to this size are kept in memory.
+
+    def __init__(self, writer, url):
+        self.writer = writer
+        self.url = url
+        self.date = time.time()
+        self.spool = tempfile.SpooledTemporaryFile(self.spool_size)
+        self.payload_digest = hashlib.sha1()
+        self.size = 0
+        self.closed = False
+
+    def write(self, data):
+        if self.closed:
+            return  # The fetcher stopped reading, or gave up.
+        self.spool.write(data)
+        self.payload_digest.update(data)
+        self.size += len(data)
+
+    def finish(self, raw_headers, status, mime, truncated=False):
+        """Write the record; raw_headers is the list of header lines."""
+        if self.closed:
+            return
+        self.closed = True
+        lines = []
+        for line in raw_headers:
+            if line.lower().startswith(b'transfer-encoding:'):
+                # The body is stored without it.
+                line = b'X-Crawler-' + line
+            lines.append(line)
+        head = b''.join(lines)
+        digest = 'sha1:' + base64.b32encode(
+            self.payload_digest.digest()).decode('ascii')
+        self.spool.seek(0)
+        try:
+            self.writer.write_response(self.url, self.date, status, mime,
+                                       head, self.spool, self.size, digest,
+                                       truncated)
+        finally:
+            self.spool.close()
+
+    def discard(self):
+        if not self.closed:
+            self.closed = True
+            self.spool.close()